@@ -0,0 +1,255 @@
+"""Columnar in-memory copy of every stat for cross-game analytics.
+
+Each stat is one slot in a set of NumPy arrays: int32 ids, uint8 action and
+enum codes, and the boolean details packed into a uint8 bitfield, using the
+same encoding as the compact_stats layout (see stat_store.COMPACT_LAYOUTS).
+The arrays are filled from SQLite on first use and then kept in sync from the
+stat change log: every query first applies the inserts and deletes logged
+since the last one, so writes from any code path are picked up without hooks.
+Group-by and filter queries are answered with vectorized NumPy operations.
+"""
+import asyncio
+
+import numpy as np
+from sqlalchemy import select
+
+from .models.models import ActionType, enum_code
+from .models.stat_store import COMPACT_LAYOUTS, DETAIL_MODELS, DETAILS_PRESENT
+from .models.stat_store import stat_table, encoded_detail_queries, latest_change_seq, net_stat_changes
+
+# dtype of every column array
+COLUMNS = {
+    "id": np.int32,
+    "game_id": np.int32,
+    "player_id": np.int32,
+    "action": np.uint8,
+    "flags": np.uint8,
+    "code1": np.uint8,
+    "code2": np.uint8,
+    "alive": np.bool_,
+}
+
+# Stats read from SQLite per batch while loading
+LOAD_BATCH_SIZE = 50000
+
+# SQLite caps the number of bound parameters per statement
+ID_CHUNK_SIZE = 900
+
+ACTION_CODES = {action_type: enum_code(action_type) for action_type in ActionType}
+
+
+class StatAnalytics:
+    def __init__(self, initial_capacity=1024):
+        self.initial_capacity = initial_capacity
+        self.cursor = None
+        self.size = 0
+        self.dead = 0
+        self._columns = {}
+        self._lock = None
+
+    @property
+    def loaded(self):
+        return self.cursor is not None
+
+    @property
+    def row_count(self):
+        return self.size - self.dead
+
+    @property
+    def memory_bytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def reset(self):
+        """Drop everything; the next refresh reloads from SQLite"""
+        self.cursor = None
+        self.size = 0
+        self.dead = 0
+        self._columns = {}
+
+    async def refresh(self, db):
+        """Load all stats on first use, afterwards apply logged changes since the last refresh"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.cursor is None:
+                await self._load(db)
+            else:
+                await self._apply_changes(db)
+
+    async def _load(self, db):
+        self.reset()
+        # Read the cursor first; changes racing with the load are re-applied idempotently
+        cursor = await latest_change_seq(db)
+        # Core rows rather than ORM results: this is the one full scan of the stat tables
+        conn = await db.connection()
+        result = await conn.stream(self._base_query().order_by(stat_table.c.id))
+        async for rows in result.partitions(LOAD_BATCH_SIZE):
+            self._append(rows)
+        for query in encoded_detail_queries():
+            result = await conn.stream(query)
+            async for rows in result.partitions(LOAD_BATCH_SIZE):
+                self._set_details(rows)
+        self.cursor = cursor
+        await self._apply_changes(db)
+
+    async def _apply_changes(self, db):
+        cursor, inserted_ids, deleted_ids = await net_stat_changes(db, self.cursor)
+        if deleted_ids and self.size:
+            found, positions = self._positions(deleted_ids)
+            alive = self._columns["alive"]
+            self.dead += int(np.count_nonzero(alive[positions[found]]))
+            alive[positions[found]] = False
+
+        inserted_ids.sort()
+        for start in range(0, len(inserted_ids), ID_CHUNK_SIZE):
+            chunk = inserted_ids[start:start + ID_CHUNK_SIZE]
+            result = await db.execute(self._base_query().where(stat_table.c.id.in_(chunk)).order_by(stat_table.c.id))
+            rows = result.all()
+            if not rows:
+                continue
+            found, positions = self._positions([row[0] for row in rows])
+            if found.any():
+                # Already loaded, or an id SQLite reused after its row was deleted
+                self._store(positions[found], [row for row, hit in zip(rows, found) if hit])
+            new_rows = [row for row, hit in zip(rows, found) if not hit]
+            if new_rows and self.size and new_rows[0][0] < self._columns["id"][self.size - 1]:
+                # Ids must stay sorted for lookups; an out-of-order id means starting over
+                await self._load(db)
+                return
+            self._append(new_rows)
+            for query in encoded_detail_queries():
+                result = await db.execute(query.where(query.selected_columns[0].in_(chunk)))
+                self._set_details(result.all())
+
+        self.cursor = cursor
+        if self.dead > max(self.size // 2, self.initial_capacity):
+            self._compact()
+
+    def _base_query(self):
+        return select(stat_table.c.id, stat_table.c.game_id, stat_table.c.player_id, stat_table.c.action_type)
+
+    def _positions(self, ids):
+        """(found mask, array positions) of stat ids in the loaded arrays"""
+        ids = np.asarray(ids, dtype=np.int64)
+        loaded = self._columns["id"][:self.size] if self.size else np.empty(0, dtype=np.int32)
+        positions = np.searchsorted(loaded, ids)
+        found = positions < self.size
+        found[found] = loaded[positions[found]] == ids[found]
+        return found, positions
+
+    def _encode(self, rows):
+        ids, game_ids, player_ids, actions = zip(*rows)
+        return {
+            "id": np.array(ids, dtype=np.int32),
+            "game_id": np.array(game_ids, dtype=np.int32),
+            "player_id": np.array(player_ids, dtype=np.int32),
+            "action": np.array([ACTION_CODES[action] for action in actions], dtype=np.uint8),
+            "flags": 0,
+            "code1": 0,
+            "code2": 0,
+        }
+
+    def _set_details(self, rows):
+        """Fill flags and codes from (stat_id, flags, code1, code2) rows of already loaded stats"""
+        if not rows:
+            return
+        stat_ids, flags, code1, code2 = zip(*rows)
+        found, positions = self._positions(stat_ids)
+        positions = positions[found]
+        self._columns["flags"][positions] = np.array(flags, dtype=np.uint8)[found]
+        self._columns["code1"][positions] = np.array([code or 0 for code in code1], dtype=np.uint8)[found]
+        self._columns["code2"][positions] = np.array([code or 0 for code in code2], dtype=np.uint8)[found]
+
+    def _store(self, positions, rows):
+        for name, values in self._encode(rows).items():
+            self._columns[name][positions] = values
+        alive = self._columns["alive"]
+        self.dead -= int(np.count_nonzero(~alive[positions]))
+        alive[positions] = True
+
+    def _append(self, rows):
+        if not rows:
+            return
+        needed = self.size + len(rows)
+        capacity = len(self._columns["id"]) if self._columns else 0
+        if needed > capacity:
+            capacity = max(needed, capacity * 2, self.initial_capacity)
+            for name, dtype in COLUMNS.items():
+                column = np.zeros(capacity, dtype=dtype)
+                if name in self._columns:
+                    column[:self.size] = self._columns[name][:self.size]
+                self._columns[name] = column
+        end = self.size + len(rows)
+        for name, values in self._encode(rows).items():
+            self._columns[name][self.size:end] = values
+        self._columns["alive"][self.size:end] = True
+        self.size = end
+
+    def _compact(self):
+        """Squeeze out deleted slots"""
+        keep = self._columns["alive"][:self.size].copy()
+        for name in COLUMNS:
+            live = self._columns[name][:self.size][keep]
+            self._columns[name][:len(live)] = live
+        self.size = int(np.count_nonzero(keep))
+        self.dead = 0
+
+    def breakdown(self, action_type, by=None, player_ids=None, game_ids=None):
+        """Counts and rates of one action type's boolean details, grouped by ``by``.
+
+        ``by`` is "player_id", "game_id", an enum detail of the action type
+        (e.g. "attack_direction"), or None for a single overall group. Stats
+        without that enum detail fall into a group with key None.
+        """
+        layout = COMPACT_LAYOUTS[action_type]
+        group_columns = ["player_id", "game_id"] + [name for name, (kind, _) in layout.items() if kind == "code"]
+        if by is not None and by not in group_columns:
+            raise ValueError(f"by must be one of: {', '.join(group_columns)}")
+
+        columns = {
+            name: self._columns[name][:self.size] if self._columns else np.zeros(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        mask = columns["alive"] & (columns["action"] == ACTION_CODES[action_type])
+        if player_ids:
+            mask &= np.isin(columns["player_id"], player_ids)
+        if game_ids:
+            mask &= np.isin(columns["game_id"], game_ids)
+
+        if by is None:
+            labels = [None]
+            groups = np.zeros(np.count_nonzero(mask), dtype=np.intp)
+        elif by in ("player_id", "game_id"):
+            unique, groups = np.unique(columns[by][mask], return_inverse=True)
+            labels = unique.tolist()
+        else:
+            # Code 0 means the detail was not recorded
+            enum_class = DETAIL_MODELS[action_type].__table__.c[by].type.enum_class
+            labels = [None] + [member.value for member in enum_class]
+            groups = columns[layout[by][1]][mask]
+        flags = columns["flags"][mask]
+
+        counts = np.bincount(groups, minlength=len(labels))
+        with_details = np.bincount(groups, weights=(flags & DETAILS_PRESENT) != 0, minlength=len(labels))
+        flag_counts = {
+            name: np.bincount(groups, weights=(flags & bit) != 0, minlength=len(labels))
+            for name, (kind, bit) in layout.items() if kind == "flag"
+        }
+
+        results = []
+        for index, label in enumerate(labels):
+            count = int(counts[index])
+            if not count:
+                continue
+            group = {"key": label, "count": count, "with_details": int(with_details[index])}
+            for name, values in flag_counts.items():
+                group[name] = int(values[index])
+                group[f"{name}_rate"] = float(values[index]) / count
+            if action_type == ActionType.ATTACK:
+                # Hitting efficiency: (kills - errors - blocked) / attempts
+                group["efficiency"] = (group["is_kill"] - group["is_error"] - group["is_blocked"]) / count
+            results.append(group)
+        return {"action_type": action_type.value, "by": by, "groups": results}
+
+
+analytics = StatAnalytics()
@@ -0,0 +1,276 @@
+"""Message bus between the worker processes of a multi-worker server (see serve.py).
+
+Each worker keeps its own response cache, live event subscribers and job
+queue in memory. To keep those coherent, workers connect to a hub on a Unix
+socket that the serve.py supervisor runs, and send each other small JSON
+messages, one per line: cache invalidations, live stat events and queued
+jobs. The hub relays every message to all other workers, except messages
+with a "topic", which only go to workers that subscribed to it. Live game
+events use a topic per game, so a worker only encodes and sends an event
+when another worker has a client streaming that game.
+
+Delivery is asynchronous: another worker applies an invalidation within
+milliseconds of the write, not before the write's response. If a worker
+loses its hub connection it may have missed messages, so connection
+handlers (see WorkerBus.on_connection) drop what could be stale and stop
+caching until it reconnects.
+
+Without BVB_BUS_SOCKET the bus is disabled and publishing is a no-op. Hub
+and WorkerBus only deal in message dicts over an asyncio stream; a test can
+run a Hub on a temporary socket, or call a WorkerBus's dispatch() directly.
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict
+
+from .models.config import BUS_SOCKET
+
+# Seconds between attempts to reach the hub
+RECONNECT_DELAY = 0.5
+
+# Seconds a starting worker waits for its first hub connection
+CONNECT_TIMEOUT = 5.0
+
+# Bytes queued for a worker that is not reading before the hub drops it
+MAX_PEER_BUFFER = 16 * 1024 * 1024
+
+# Longest message line either end reads (asyncio's default is 64 KiB); a
+# batch's game events can be larger, and one that fits a peer's buffer must
+# also fit its reader
+MAX_MESSAGE_BYTES = MAX_PEER_BUFFER
+
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class Peer:
+    """The hub's end of one worker connection"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.topics = set()
+
+    def send(self, line):
+        if self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+            # The worker reconnects, and treats everything cached as stale
+            self.writer.close()
+            return
+        self.writer.write(line)
+
+
+class Hub:
+    """Relays messages between workers and tracks which topics each one wants"""
+
+    def __init__(self):
+        self._peers = set()
+        # Topic -> peers subscribed to it
+        self._topics = defaultdict(set)
+
+    @property
+    def peer_count(self):
+        return len(self._peers)
+
+    def attach(self, peer):
+        self._peers.add(peer)
+        for topic, subscribers in self._topics.items():
+            if subscribers:
+                peer.send(encode({"type": "interest", "topic": topic, "active": True}))
+
+    def detach(self, peer):
+        self._peers.discard(peer)
+        for topic in list(peer.topics):
+            self._set_subscribed(peer, topic, False)
+
+    def receive(self, peer, line):
+        message = json.loads(line)
+        kind = message["type"]
+        if kind in ("subscribe", "unsubscribe"):
+            self._set_subscribed(peer, message["topic"], kind == "subscribe")
+            return
+        topic = message.get("topic")
+        targets = self._peers if topic is None else self._topics.get(topic, ())
+        for other in list(targets):
+            if other is not peer:
+                other.send(line)
+
+    def _set_subscribed(self, peer, topic, subscribed):
+        subscribers = self._topics[topic]
+        # Each peer hears whether any *other* peer wants the topic
+        before = {other: bool(subscribers - {other}) for other in self._peers}
+        if subscribed:
+            subscribers.add(peer)
+            peer.topics.add(topic)
+        else:
+            subscribers.discard(peer)
+            peer.topics.discard(topic)
+            if not subscribers:
+                del self._topics[topic]
+        for other in self._peers:
+            active = bool(subscribers - {other})
+            if active != before[other]:
+                other.send(encode({"type": "interest", "topic": topic, "active": active}))
+
+    async def handle(self, reader, writer):
+        peer = Peer(writer)
+        self.attach(peer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.receive(peer, line)
+        except (ConnectionError, ValueError, KeyError):
+            pass
+        finally:
+            self.detach(peer)
+            writer.close()
+
+    async def serve(self, path, ready=None):
+        """Accept workers on a Unix socket until cancelled"""
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle, path, limit=MAX_MESSAGE_BYTES)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run_hub_thread(path):
+    """Run a Hub on its own event loop in a daemon thread; returns once it accepts connections"""
+    ready = threading.Event()
+    hub = Hub()
+    thread = threading.Thread(target=lambda: asyncio.run(hub.serve(path, ready)), name="bus-hub", daemon=True)
+    thread.start()
+    if not ready.wait(CONNECT_TIMEOUT):
+        raise RuntimeError(f"Message hub did not start on {path}")
+    return hub
+
+
+class WorkerBus:
+    """A worker's connection to the hub, reconnecting until stopped"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.connected = False
+        self.sent = 0
+        self.received = 0
+        self._handlers = {}
+        self._connection_handlers = []
+        # Topics this worker subscribed to, and topics some other worker wants
+        self._topics = set()
+        self._interest = set()
+        self._writer = None
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def on(self, kind, handler):
+        """Call handler(message) for each message of a type from another worker"""
+        self._handlers[kind] = handler
+
+    def on_connection(self, handler):
+        """Call handler(connected) whenever the hub connection comes up or goes down"""
+        self._connection_handlers.append(handler)
+
+    def publish(self, message):
+        """Send a message to the other workers, or to those subscribed to its "topic"; never waits"""
+        if self._writer is None:
+            return
+        line = encode(message)
+        if len(line) > MAX_MESSAGE_BYTES:
+            # The hub would drop this worker's connection rather than relay it
+            print(f"Not publishing {message['type']} bus message of {len(line)} bytes")
+            return
+        self._writer.write(line)
+        self.sent += 1
+
+    def subscribe(self, topic):
+        self._topics.add(topic)
+        self.publish({"type": "subscribe", "topic": topic})
+
+    def unsubscribe(self, topic):
+        self._topics.discard(topic)
+        self.publish({"type": "unsubscribe", "topic": topic})
+
+    def peers_subscribed(self, topic):
+        return topic in self._interest
+
+    async def start(self):
+        """Connect in the background; waits up to CONNECT_TIMEOUT for the first connection"""
+        if not self.enabled:
+            return
+        connected = asyncio.Event()
+        self._task = asyncio.create_task(self._run(connected))
+        try:
+            await asyncio.wait_for(connected.wait(), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Message hub at {self.path} not reachable yet; caching is off until it is")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def dispatch(self, message):
+        self.received += 1
+        if message["type"] == "interest":
+            if message["active"]:
+                self._interest.add(message["topic"])
+            else:
+                self._interest.discard(message["topic"])
+            return
+        handler = self._handlers.get(message["type"])
+        if handler is not None:
+            handler(message)
+
+    async def _run(self, connected):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE_BYTES)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._writer = writer
+            for topic in self._topics:
+                self.publish({"type": "subscribe", "topic": topic})
+            self._set_connected(True)
+            connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        self.dispatch(json.loads(line))
+                    except Exception as e:
+                        print(f"Error handling bus message {line[:200]!r}: {e}")
+            except (ConnectionError, ValueError):
+                # ValueError: a line over MAX_MESSAGE_BYTES; reconnect rather than stop listening
+                pass
+            finally:
+                self._writer = None
+                self._interest.clear()
+                writer.close()
+                self._set_connected(False)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _set_connected(self, connected):
+        self.connected = connected
+        for handler in self._connection_handlers:
+            handler(connected)
+
+
+worker_bus = WorkerBus(BUS_SOCKET)
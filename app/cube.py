@@ -0,0 +1,224 @@
+"""Stat cube: counts and rates of one action type's stats pivoted over any dimensions.
+
+A query names an action type, the dimensions to group by, the measures to
+return and filters on any dimension. Dimensions are the player, game, date
+(day, month or year of the game), set number and every detail of the action
+type: booleans such as is_kill, enums such as attack_direction, and
+serve_target. Measures are the stat count, how many were logged with
+details, each boolean detail's count and rate, and for attacks the hitting
+efficiency.
+
+Three sources can answer a query: stat_day_rollups, stat_rollups and the raw
+stats. Each rollup merges rows of the source after it, so it is never larger;
+the planner picks the first source that has every dimension the query groups
+or filters on. All three hold details in the compact_stats encoding, so one
+grouped SQL statement serves them all.
+"""
+from datetime import date
+
+from sqlalchemy import case, func, literal, select
+
+from .models.models import ActionType, Game, StatDayRollup, StatRollup, enum_code
+from .models.stat_store import COMPACT_LAYOUTS, DETAIL_MODELS, DETAILS_PRESENT, encoded_stats_query
+
+# Source -> the dimensions it has besides the action type's details, smallest source first
+SOURCES = {
+    "day_rollup": ("player_id", "day", "month", "year"),
+    "game_rollup": ("player_id", "game_id", "day", "month", "year"),
+    "stats": ("player_id", "game_id", "day", "month", "year", "set_number"),
+}
+
+# Date dimension -> strftime format of the game date, None for the date itself
+DATE_FORMATS = {"day": None, "month": "%Y-%m", "year": "%Y"}
+
+TRUE_VALUES = ("true", "1", "yes")
+FALSE_VALUES = ("false", "0", "no")
+
+
+def dimensions(action_type):
+    return list(SOURCES["stats"]) + list(COMPACT_LAYOUTS[action_type])
+
+
+def flag_names(action_type):
+    return [name for name, (kind, _) in COMPACT_LAYOUTS[action_type].items() if kind == "flag"]
+
+
+def measures(action_type):
+    flags = flag_names(action_type)
+    names = ["count", "with_details"] + flags + [f"{name}_rate" for name in flags]
+    if action_type == ActionType.ATTACK:
+        names.append("efficiency")
+    return names
+
+
+def plan(action_type, used_dimensions, source=None):
+    """Name of the smallest source with every used dimension, or of ``source`` if it has them"""
+    details = set(COMPACT_LAYOUTS[action_type])
+    candidates = [source] if source else list(SOURCES)
+    for name in candidates:
+        if name not in SOURCES:
+            raise ValueError(f"source must be one of: {', '.join(SOURCES)}")
+        if all(dimension in details or dimension in SOURCES[name] for dimension in used_dimensions):
+            return name
+    missing = sorted(set(used_dimensions) - details - set(SOURCES[source]))
+    raise ValueError(f"{source} cannot answer for {', '.join(missing)}")
+
+
+def _facts(source, action_type):
+    """(columns by name, weight, from clause, action type condition) of a source.
+
+    Columns cover the source's dimensions plus flags, code1, code2 and
+    serve_target, with 0 and "" for missing codes and targets everywhere. Each
+    row stands for weight stats.
+    """
+    if source == "stats":
+        stats = encoded_stats_query(action_type).subquery()
+        columns = {name: stats.c[name] for name in ("player_id", "game_id", "set_number", "flags")}
+        columns.update(
+            code1=func.coalesce(stats.c.code1, 0),
+            code2=func.coalesce(stats.c.code2, 0),
+            serve_target=func.coalesce(stats.c.serve_target, ""),
+            day=Game.date,
+        )
+        return columns, literal(1), stats.join(Game, Game.id == stats.c.game_id), None
+    model = StatDayRollup if source == "day_rollup" else StatRollup
+    table = model.__table__
+    columns = {column.name: column for column in table.columns}
+    from_clause = table
+    if model is StatRollup:
+        columns["day"] = Game.date
+        from_clause = table.join(Game, Game.id == table.c.game_id)
+    return columns, table.c.count, from_clause, table.c.action_type == action_type
+
+
+def _dimension_column(columns, action_type, name):
+    if name in DATE_FORMATS:
+        if DATE_FORMATS[name] is None:
+            return columns["day"]
+        return func.strftime(DATE_FORMATS[name], columns["day"])
+    if name in SOURCES["stats"]:
+        return columns[name]
+    kind, slot = COMPACT_LAYOUTS[action_type][name]
+    if kind == "flag":
+        return columns["flags"].op("&")(slot) != 0
+    if kind == "code":
+        return columns[slot]
+    return columns["serve_target"]
+
+
+def _filter_value(action_type, name, text):
+    """SQL-side value of one filter value given as text"""
+    text = str(text).strip()
+    try:
+        if name in ("player_id", "game_id", "set_number"):
+            return int(text)
+        if name == "day":
+            return date.fromisoformat(text)
+        if name in DATE_FORMATS:
+            return text
+        kind, _ = COMPACT_LAYOUTS[action_type][name]
+    except ValueError:
+        raise ValueError(f"invalid value for {name}: {text!r}")
+    if kind == "flag":
+        if text.lower() not in TRUE_VALUES + FALSE_VALUES:
+            raise ValueError(f"{name} must be true or false")
+        return text.lower() in TRUE_VALUES
+    if kind == "code":
+        enum_class = DETAIL_MODELS[action_type].__table__.c[name].type.enum_class
+        for member in enum_class:
+            if str(member.value) == text:
+                return enum_code(member)
+        raise ValueError(f"{name} must be one of: {', '.join(str(member.value) for member in enum_class)}")
+    return text
+
+
+def _decoder(action_type, name):
+    """Function turning a grouped SQL value of a dimension into its JSON value"""
+    if name in DATE_FORMATS or name in SOURCES["stats"]:
+        return lambda value: value.isoformat() if isinstance(value, date) else value
+    kind, _ = COMPACT_LAYOUTS[action_type][name]
+    if kind == "flag":
+        return bool
+    if kind == "code":
+        # Code 0 means the detail was not recorded
+        values = [None] + [member.value for member in DETAIL_MODELS[action_type].__table__.c[name].type.enum_class]
+        return values.__getitem__
+    return lambda value: value or None
+
+
+def cube_query(action_type, by=(), filters=None, start_date=None, end_date=None, source=None):
+    """(source name, SQL statement) answering a cube query; see stat_cube for the arguments"""
+    available = dimensions(action_type)
+    filters = filters or {}
+    unknown = [name for name in list(by) + list(filters) if name not in available]
+    if unknown:
+        raise ValueError(f"unknown dimension {unknown[0]}; choose from {', '.join(available)}")
+    if len(set(by)) != len(by):
+        raise ValueError("dimensions must not repeat")
+    source = plan(action_type, list(by) + list(filters), source)
+
+    columns, weight, from_clause, action_condition = _facts(source, action_type)
+    keys = [_dimension_column(columns, action_type, name).label(name) for name in by]
+    flags = columns["flags"]
+    totals = [func.sum(weight), func.sum(case((flags.op("&")(DETAILS_PRESENT) != 0, weight), else_=0))]
+    for name in flag_names(action_type):
+        bit = COMPACT_LAYOUTS[action_type][name][1]
+        totals.append(func.sum(case((flags.op("&")(bit) != 0, weight), else_=0)))
+    query = select(*keys, *totals).select_from(from_clause)
+    if action_condition is not None:
+        query = query.where(action_condition)
+    for name, values in filters.items():
+        column = _dimension_column(columns, action_type, name)
+        query = query.where(column.in_([_filter_value(action_type, name, value) for value in values]))
+    if start_date is not None:
+        query = query.where(columns["day"] >= start_date)
+    if end_date is not None:
+        query = query.where(columns["day"] <= end_date)
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
+    return source, query
+
+
+async def stat_cube(db, action_type, by=(), measure_names=None, filters=None,
+                    start_date=None, end_date=None, source=None):
+    """Measures of one action type's stats per combination of the ``by`` dimensions.
+
+    ``filters`` maps a dimension to the values to keep (any of them), given
+    as text; start_date and end_date are inclusive bounds on the game date.
+    ``measure_names`` defaults to the count and every boolean detail's count.
+    ``source`` forces day_rollup, game_rollup or stats instead of the
+    planner's choice. Combinations without stats are left out.
+    """
+    flags = flag_names(action_type)
+    measure_names = list(measure_names or ["count"] + flags)
+    unknown = [name for name in measure_names if name not in measures(action_type)]
+    if unknown:
+        raise ValueError(f"unknown measure {unknown[0]}; choose from {', '.join(measures(action_type))}")
+    source, query = cube_query(action_type, by, filters, start_date, end_date, source)
+
+    result = await db.execute(query)
+    decoders = [(name, _decoder(action_type, name)) for name in by]
+    cells = []
+    for row in result.all():
+        keys, totals = row[:len(by)], row[len(by):]
+        count = totals[0]
+        if not count:
+            # Without dimensions the sums come back as one row of NULLs when nothing matches
+            continue
+        values = {"count": count, "with_details": totals[1]}
+        values.update(zip(flags, totals[2:]))
+        for name in flags:
+            values[f"{name}_rate"] = values[name] / count if count else None
+        if action_type == ActionType.ATTACK:
+            # Hitting efficiency: (kills - errors - blocked) / attempts
+            values["efficiency"] = (values["is_kill"] - values["is_error"] - values["is_blocked"]) / count if count else None
+        cell = {name: decode(key) for (name, decode), key in zip(decoders, keys)}
+        cell.update((name, values[name]) for name in measure_names)
+        cells.append(cell)
+    return {
+        "action_type": action_type.value,
+        "dimensions": list(by),
+        "measures": measure_names,
+        "source": source,
+        "cells": cells,
+    }
@@ -0,0 +1,90 @@
+"""In-process fan-out of live stat changes to per-game subscribers.
+
+Each subscriber owns a bounded asyncio queue. Publishing never waits: when a
+subscriber's queue is full its oldest event is dropped and the subscriber is
+flagged, so one slow client cannot stall the event loop or other clients.
+
+Under serve.py's multi-worker mode a game's stream may be open on another
+worker than the one that wrote the stat. Each worker subscribes to the bus
+topic of every game it has streams for (see bus.py), and an event is also
+sent over the bus when another worker has subscribed to its game.
+"""
+import asyncio
+import json
+from collections import defaultdict
+
+from .bus import worker_bus
+
+# Events buffered per subscriber before the oldest ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscription:
+    def __init__(self, game_id, queue_size):
+        self.game_id = game_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def push(self, event):
+        """Enqueue without blocking, discarding the oldest event when full"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class GameEventBroker:
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, game_id):
+        subscription = Subscription(game_id, self.queue_size)
+        if game_id not in self._subscribers:
+            worker_bus.subscribe(game_topic(game_id))
+        self._subscribers[game_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self._subscribers.get(subscription.game_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.game_id]
+                worker_bus.unsubscribe(game_topic(subscription.game_id))
+
+    def has_subscribers(self, game_id):
+        """Whether a client of this or any other worker streams the game"""
+        return game_id in self._subscribers or worker_bus.peers_subscribed(game_topic(game_id))
+
+    def subscriber_count(self, game_id=None):
+        if game_id is not None:
+            return len(self._subscribers.get(game_id, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, game_id, stats=(), deleted=()):
+        """Send a change to every subscriber of a game, encoded once as an SSE frame"""
+        if not self.has_subscribers(game_id):
+            return
+        payload = json.dumps({"stats": list(stats), "deleted": list(deleted)}, default=str)
+        topic = game_topic(game_id)
+        if worker_bus.peers_subscribed(topic):
+            worker_bus.publish({"type": "game_event", "topic": topic, "game_id": game_id, "payload": payload})
+        self.deliver(game_id, payload)
+
+    def deliver(self, game_id, payload):
+        """Push an encoded change to this worker's subscribers of a game"""
+        subscribers = self._subscribers.get(game_id)
+        if not subscribers:
+            return
+        event = f"data: {payload}\n\n".encode()
+        for subscription in list(subscribers):
+            subscription.push(event)
+
+
+def game_topic(game_id):
+    return f"game:{game_id}"
+
+
+broker = GameEventBroker()
+worker_bus.on("game_event", lambda message: broker.deliver(message["game_id"], message["payload"]))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Bulk-load CSV/NDJSON stat files, e.g. exports from another database or historical scouting sheets.
+
+Run it like init_database.py, from the app directory:
+
+    python import_stats.py season_2024.csv other_tracker.ndjson
+
+Running it again after an interruption resumes each file where it stopped;
+files that finished importing are skipped.
+"""
+import os
+import sys
+import asyncio
+import argparse
+
+# The importer shares the server's modules, which live in the app package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.database import async_engine
+from app.models.migrations import upgrade_schema
+from app.stat_files import FORMATS, format_for
+from app.stat_import import IMPORT_BATCH_SIZE, import_stat_file
+
+def print_progress(summary, game_ids=()):
+    print(f"  {summary['records']} records, {summary['stats_imported']} stats, "
+          f"{summary['errors']} rejected ({summary['records_per_second']} records/s)")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk-load CSV/NDJSON stat files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--format", choices=FORMATS, help="default: from each file's extension")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="records per transaction")
+    args = parser.parse_args()
+
+    async with async_engine.begin() as conn:
+        await conn.run_sync(upgrade_schema)
+
+    for path in args.files:
+        file_format = args.format or format_for(path)
+        if file_format is None:
+            print(f"Skipping {path}: can't tell the format from its extension, pass --format")
+            continue
+        print(f"Importing {path}...")
+        summary = await import_stat_file(path, file_format, batch_size=args.batch_size, progress=print_progress)
+        if summary["resumed_from"]:
+            print(f"  Resumed after record {summary['resumed_from']}")
+        for error in summary["error_samples"]:
+            print(f"  record {error['record']}: {error['error']}")
+        print(f"Done: {summary['stats_imported']} stats in {summary['games_created']} new games, "
+              f"{summary['players_created']} new players, {summary['errors']} records rejected.")
+
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
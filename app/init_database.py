@@ -3,10 +3,14 @@ import os
 import sys
 import json
 import asyncio
+import time
 from sqlalchemy.ext.asyncio import AsyncSession
 from models.database import async_engine, AsyncSessionLocal
 from models.models import Base, Game, Player, BaseStat
 from models.models import ServeStat, ReceiveStat, AttackStat, BlockStat, DigStat, SetStat
+from models.migrations import upgrade_schema, set_schema_version, LATEST_VERSION
+from models.stat_store import rebuild_aggregates, rebuild_rallies, rebuild_rollups, convert_stat_storage
+from models.config import STAT_STORAGE
 from datetime import date
 
 async def reset_db():
@@ -18,15 +22,78 @@ async def reset_db():
     print("Creating tables for new schema...")
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(set_schema_version, LATEST_VERSION)
     
     print("Database schema reset successfully!")
 
+async def upgrade_db():
+    """Upgrade an existing database to the current schema, keeping its data"""
+    print("Upgrading database schema...")
+    async with async_engine.begin() as conn:
+        await conn.run_sync(upgrade_schema)
+    
+    print(f"Database schema is at version {LATEST_VERSION}")
+
+async def rebuild_db_aggregates():
+    """Recompute player_game_aggregates from raw stats and report drift"""
+    print("Rebuilding player/game aggregates from raw stats...")
+    async with async_engine.begin() as conn:
+        mismatches = await conn.run_sync(rebuild_aggregates)
+    
+    if mismatches:
+        print(f"{len(mismatches)} aggregate counts differed from the raw stats and were corrected:")
+        for player_id, game_id, metric in mismatches:
+            print(f"  player {player_id}, game {game_id}: {metric}")
+    else:
+        print("Incremental aggregates match the raw stats.")
+
+async def rebuild_db_rallies():
+    """Reconstruct every game's rallies and possessions from raw stats"""
+    print("Rebuilding rallies from raw stats...")
+    started = time.perf_counter()
+    async with async_engine.begin() as conn:
+        games, rallies = await conn.run_sync(rebuild_rallies)
+    
+    print(f"Rebuilt {rallies} rallies in {games} games in {time.perf_counter() - started:.1f} s.")
+
+async def rebuild_db_rollups():
+    """Recompute the stat cube's game and day rollups from raw stats"""
+    print("Rebuilding stat rollups from raw stats...")
+    started = time.perf_counter()
+    async with async_engine.begin() as conn:
+        game_rows, day_rows = await conn.run_sync(rebuild_rollups)
+    
+    print(f"Rebuilt {game_rows} game and {day_rows} day rollup rows in {time.perf_counter() - started:.1f} s.")
+
+async def convert_db_storage():
+    """Move existing stats into the layout selected by BVB_STAT_STORAGE"""
+    print(f"Converting stats to the {STAT_STORAGE} layout...")
+    async with async_engine.begin() as conn:
+        moved = await conn.run_sync(convert_stat_storage, STAT_STORAGE)
+    
+    print(f"Moved {moved} stats.")
+
 async def main():
     """Main function to initialize the database"""
     print("Initializing database...")
     
-    # Reset database schema
-    await reset_db()
+    # Upgrade in place unless a full reset was requested
+    if "--reset" in sys.argv[1:]:
+        await reset_db()
+    else:
+        await upgrade_db()
+    
+    if "--convert-storage" in sys.argv[1:]:
+        await convert_db_storage()
+    
+    if "--rebuild-aggregates" in sys.argv[1:]:
+        await rebuild_db_aggregates()
+    
+    if "--rebuild-rallies" in sys.argv[1:]:
+        await rebuild_db_rallies()
+    
+    if "--rebuild-rollups" in sys.argv[1:]:
+        await rebuild_db_rollups()
     
     print("Database initialization complete!")
 
@@ -0,0 +1,538 @@
+"""Background jobs for work too heavy to run inside a request.
+
+A job is a row in the jobs table plus a function from JOB_KINDS: full
+rebuilds of the aggregates, rallies and rollups, stat file exports and
+imports, and season reports. POST /api/jobs queues one and returns at once;
+the JobRunner feeds queued jobs, JOB_CONCURRENCY at a time, to a pool of
+JOB_PROCESSES worker processes, so parsing, encoding and recomputing never
+hold the server's event loop or GIL. The rally and rollup rebuilds compute
+into TEMP tables and take the SQLite write lock only to swap them in (see
+rebuild_online in stat_store.py); imports hold it one batch at a time, so
+live stat entry waits at most that long.
+
+Workers report progress and the games they changed over a queue that a
+listener thread hands to the event loop; the runner applies the cache
+invalidations and saves progress to the job's row every
+PROGRESS_SAVE_INTERVAL seconds. Cancelling a queued job drops it, cancelling
+a running one sets cancel_requested, which the worker polls at its next
+progress report and answers by rolling back (rebuilds), deleting the partial
+file (exports) or stopping after the last committed batch (imports, which
+resume by file hash when the file is submitted again). Jobs still queued or
+running when the server stopped are run again on the next start.
+
+One process runs the jobs of a database: the one holding the runner lock in
+JOB_DIR. Under serve.py's multi-worker mode the other workers record the
+jobs they are sent and hand them to it over the bus (see bus.py), and take
+over when it exits. Only the runner's GET /api/jobs/{id} shows progress
+between the saves to the job's row.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timezone
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): every process runs its own jobs
+    fcntl = None
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError
+
+from .bus import worker_bus
+from .models.aggregates import season_summaries
+from .models.config import JOB_CONCURRENCY, JOB_DIR, JOB_PROCESSES
+from .models.database import AsyncSessionLocal, async_engine, engine
+from .models.models import ActionType, Job, Player, format_timestamp
+from .models.schemas import ExportJobParams, SeasonReportJobParams
+from .models.stat_store import rebuild_aggregates, rebuild_rallies_online, rebuild_rollups_online
+from .response_cache import response_cache, stats_changed
+from .stat_files import encode_records, filtered_export_query
+from .stat_import import import_stat_file
+
+# Seconds between progress messages from a worker, and between cancellation checks
+PROGRESS_INTERVAL = 0.25
+
+# Seconds between saves of a running job's progress to its row
+PROGRESS_SAVE_INTERVAL = 1.0
+
+# Export rows encoded and written per batch
+EXPORT_BATCH_SIZE = 5000
+
+# Added to the worker processes' nice value so the server gets the CPU first
+WORKER_NICENESS = 10
+
+# Seconds between attempts of a standby worker to take over running jobs
+LOCK_RETRY_INTERVAL = 5.0
+
+# Mismatched aggregate keys listed in a rebuild_aggregates result
+MAX_REPORTED_MISMATCHES = 20
+
+STATUSES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# Worker process side
+
+# Progress queue to the server process, set by the pool initializer
+_messages = None
+
+
+def _init_worker(messages):
+    global _messages
+    _messages = messages
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICENESS)
+
+
+class JobContext:
+    """Progress reporting and cancellation checks for the job running in this worker"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.done = 0
+        self.total = None
+        self._sent = 0.0
+        self._checked = 0.0
+
+    def progress(self, done, total=None, changed_games=()):
+        """Report progress; raises JobCancelled once the job has been cancelled"""
+        self.done = done
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if changed_games or now - self._sent >= PROGRESS_INTERVAL:
+            self._send(changed_games)
+        if now - self._checked >= PROGRESS_INTERVAL:
+            self.check_cancelled()
+
+    def check_cancelled(self):
+        self._checked = time.monotonic()
+        try:
+            with engine.connect() as conn:
+                cancelled = conn.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        except OperationalError:
+            # Locked out for now; check again at the next report
+            return
+        if cancelled:
+            raise JobCancelled()
+
+    def _send(self, changed_games=()):
+        self._sent = time.monotonic()
+        if _messages is not None:
+            _messages.put((self.job_id, self.done, self.total, list(changed_games)))
+
+
+def run_job(job_id, kind, params):
+    """Worker process entry point: run a job to the end; returns (result, progress done, progress total)"""
+    job = JobContext(job_id)
+    job.check_cancelled()
+    try:
+        result = JOB_KINDS[kind].run(job, params)
+    finally:
+        engine.dispose()
+    return result, job.done, job.total
+
+
+def _date(text):
+    # Params hold dates as ISO text
+    return None if text is None else date.fromisoformat(text)
+
+
+def _rebuild_aggregates(job, params):
+    with engine.begin() as conn:
+        mismatches = rebuild_aggregates(conn, progress=job.progress)
+    return {
+        "mismatches": len(mismatches),
+        "samples": [list(key) for key in sorted(mismatches)[:MAX_REPORTED_MISMATCHES]],
+    }
+
+
+def _rebuild_rallies(job, params):
+    games, rallies = rebuild_rallies_online(engine, progress=job.progress)
+    return {"games": games, "rallies": rallies}
+
+
+def _rebuild_rollups(job, params):
+    game_rows, day_rows = rebuild_rollups_online(engine, progress=job.progress)
+    return {"game_rollup": game_rows, "day_rollup": day_rows}
+
+
+def _export(job, params):
+    query = filtered_export_query(
+        params["game_id"], params["player_id"],
+        None if params["action_type"] is None else ActionType(params["action_type"]),
+        _date(params["start_date"]), _date(params["end_date"]),
+    )
+    path = job_file(job.job_id, params["format"])
+    partial = f"{path}.part"
+    rows_written = 0
+    try:
+        with engine.connect() as conn, open(partial, "wb") as file:
+            total = conn.execute(select(func.count()).select_from(query.subquery())).scalar()
+            job.progress(0, total)
+            result = conn.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            if params["format"] == "csv":
+                file.write(encode_records([], "csv", header=True))
+            for rows in result.partitions():
+                file.write(encode_records(rows, params["format"]))
+                rows_written += len(rows)
+                job.progress(rows_written, total)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return {"rows": rows_written, "bytes": os.path.getsize(path), "file": os.path.basename(path)}
+
+
+def _import(job, params):
+    def progress(summary, game_ids):
+        job.progress(summary["records"], None, game_ids)
+
+    async def run():
+        try:
+            return await import_stat_file(params["path"], params["format"], params.get("source_name"),
+                                          progress=progress)
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(run())
+
+
+def _season_report(job, params):
+    with engine.connect() as conn:
+        summaries = season_summaries(conn, _date(params["start_date"]), _date(params["end_date"]))
+        names = dict(conn.execute(select(Player.id, Player.name).where(Player.id.in_(summaries))).all())
+    job.progress(len(summaries), len(summaries))
+    return {
+        "start_date": params["start_date"],
+        "end_date": params["end_date"],
+        "players": [
+            {"player_id": player_id, "player_name": names.get(player_id), **summary}
+            for player_id, summary in sorted(summaries.items())
+        ],
+    }
+
+
+class JobKind:
+    """A job function plus how the server treats it.
+
+    ``params`` is the pydantic model submitted params are checked against;
+    ``clears_cache`` drops every cached response once the job is done;
+    ``internal`` kinds are only created by other endpoints, never by POST
+    /api/jobs.
+    """
+
+    def __init__(self, run, params=None, clears_cache=False, internal=False):
+        self.run = run
+        self.params = params
+        self.clears_cache = clears_cache
+        self.internal = internal
+
+
+JOB_KINDS = {
+    "rebuild_aggregates": JobKind(_rebuild_aggregates, clears_cache=True),
+    "rebuild_rallies": JobKind(_rebuild_rallies, clears_cache=True),
+    "rebuild_rollups": JobKind(_rebuild_rollups, clears_cache=True),
+    "export": JobKind(_export, ExportJobParams),
+    "import": JobKind(_import, internal=True),
+    "season_report": JobKind(_season_report, SeasonReportJobParams),
+}
+
+
+def job_file(job_id, format):
+    """Path of the file an export job writes"""
+    return os.path.join(JOB_DIR, f"job-{job_id}.{format}")
+
+
+def check_params(kind, params):
+    """Submitted params of a public job kind, validated and as JSON-ready values; raises ValueError"""
+    if kind not in JOB_KINDS or JOB_KINDS[kind].internal:
+        public = [name for name, job_kind in JOB_KINDS.items() if not job_kind.internal]
+        raise ValueError(f"kind must be one of: {', '.join(public)}")
+    model = JOB_KINDS[kind].params
+    if model is None:
+        if params:
+            raise ValueError(f"{kind} takes no params")
+        return {}
+    # pydantic's ValidationError is a ValueError
+    return model(**params).model_dump(mode="json")
+
+
+def _timestamp(value):
+    return None if value is None else format_timestamp(value)
+
+
+def describe_job(job, progress=None):
+    """JSON-ready dict of a Job row; ``progress`` is fresher (done, total) than the row's"""
+    done, total = progress or (job.progress_done, job.progress_total)
+    params = json.loads(job.params)
+    record = {
+        "id": job.id,
+        "kind": job.kind,
+        "params": params,
+        "status": job.status,
+        "progress": {"done": done, "total": total, "fraction": round(done / total, 4) if total else None},
+        "result": None if job.result is None else json.loads(job.result),
+        "error": job.error,
+        "cancel_requested": job.cancel_requested,
+        "created_at": _timestamp(job.created_at),
+        "started_at": _timestamp(job.started_at),
+        "finished_at": _timestamp(job.finished_at),
+        "download": None,
+    }
+    if job.kind == "export" and job.status == "done":
+        record["download"] = f"/api/jobs/{job.id}/file"
+    return record
+
+
+# Server side
+
+class JobRunner:
+    def __init__(self, concurrency, processes, job_dir):
+        self.concurrency = concurrency
+        self.processes = processes
+        self.job_dir = job_dir
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._pool = None
+        self._messages = None
+        self._listener = None
+        # Job id -> (done, total) last reported by a running job
+        self._progress = {}
+        # Only the process holding the runner lock runs jobs; the others hand theirs over the bus
+        self.active = False
+        self._lock_file = None
+        self._standby = None
+
+    @property
+    def queued_count(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    @property
+    def running_count(self):
+        return len(self._progress)
+
+    async def start(self):
+        """Run jobs if no other process on this database does, otherwise stand by to take over"""
+        os.makedirs(self.job_dir, exist_ok=True)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        if self._lock():
+            await self._activate()
+        else:
+            self._standby = asyncio.create_task(self._wait_for_lock())
+
+    async def stop(self):
+        """Stop taking jobs; running ones are abandoned and run again on the next start"""
+        if self._standby is not None:
+            self._standby.cancel()
+            await asyncio.gather(self._standby, return_exceptions=True)
+            self._standby = None
+        if self.active:
+            await self._deactivate()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _lock(self):
+        """Take the runner lock of the job directory; False while another process holds it"""
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(self.job_dir, "runner.lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def _wait_for_lock(self):
+        # The lock is freed when its holder exits, so its jobs are then orphaned
+        while not self._lock():
+            await asyncio.sleep(LOCK_RETRY_INTERVAL)
+        self._standby = None
+        await self._activate()
+
+    async def _activate(self):
+        """Start the worker pool, then queue again every job a previous runner left unfinished"""
+        context = multiprocessing.get_context("spawn")
+        self._messages = context.Queue()
+        self._pool = self._new_pool()
+        self._listener = threading.Thread(target=self._listen, name="job-progress", daemon=True)
+        self._listener.start()
+        self.active = True
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Job.id).where(Job.status.in_(("queued", "running"))).order_by(Job.id)
+            )
+            job_ids = result.scalars().all()
+            if job_ids:
+                await db.execute(
+                    update(Job).where(Job.id.in_(job_ids)).values(status="queued", started_at=None)
+                )
+                await db.commit()
+        if job_ids:
+            print(f"Requeueing {len(job_ids)} unfinished jobs")
+        for job_id in job_ids:
+            self._queue.put_nowait(job_id)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def _deactivate(self):
+        self.active = False
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Don't let a long job hold up the exit; its row stays "running" and the next start requeues it
+        for process in list((self._pool._processes or {}).values()):
+            process.terminate()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._messages.put(None)
+        self._listener.join()
+        self._progress.clear()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._messages,),
+        )
+
+    async def submit(self, db, kind, params):
+        """Record a job and queue it; ``params`` must already be checked"""
+        job = Job(kind=kind, params=json.dumps(params), status="queued", progress_done=0,
+                  cancel_requested=False, created_at=datetime.now(timezone.utc))
+        db.add(job)
+        await db.commit()
+        if self.active:
+            self._queue.put_nowait(job.id)
+        else:
+            worker_bus.publish({"type": "job_queued", "id": job.id})
+        return job
+
+    def enqueue(self, job_id):
+        """Queue a job another worker submitted, if this one runs jobs"""
+        if self.active:
+            self._queue.put_nowait(job_id)
+
+    def bus_connected(self, connected):
+        # Submissions sent while this runner was cut off from the bus were lost
+        if connected and self.active:
+            asyncio.create_task(self._queue_submitted())
+
+    async def _queue_submitted(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Job.id).where(Job.status == "queued").order_by(Job.id))
+            for job_id in result.scalars().all():
+                # Queued twice is harmless: only the first _run claims it
+                self._queue.put_nowait(job_id)
+
+    async def cancel(self, db, job_id):
+        """Cancel a queued job outright, or ask a running one to stop; returns False if it already finished"""
+        result = await db.execute(
+            update(Job).where(Job.id == job_id, Job.status == "queued")
+            .values(status="cancelled", finished_at=datetime.now(timezone.utc))
+        )
+        if result.rowcount == 0:
+            result = await db.execute(
+                update(Job).where(Job.id == job_id, Job.status == "running").values(cancel_requested=True)
+            )
+        await db.commit()
+        return result.rowcount > 0
+
+    def describe(self, job):
+        return describe_job(job, self._progress.get(job.id))
+
+    def _listen(self):
+        # Runs in a thread: blocking reads of the worker queue, handed to the event loop
+        while True:
+            message = self._messages.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._on_progress, *message)
+
+    def _on_progress(self, job_id, done, total, changed_games):
+        if job_id in self._progress:
+            self._progress[job_id] = (done, total)
+        if changed_games:
+            response_cache.invalidate("games", "players")
+            for game_id in changed_games:
+                stats_changed(game_id)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} could not be run: {e}")
+
+    async def _run(self, job_id):
+        async with AsyncSessionLocal() as db:
+            # Conditional so a cancel that got in first wins
+            claimed = await db.execute(
+                update(Job).where(Job.id == job_id, Job.status == "queued")
+                .values(status="running", started_at=datetime.now(timezone.utc))
+            )
+            await db.commit()
+            if claimed.rowcount == 0:
+                return
+            job = (await db.execute(select(Job).where(Job.id == job_id))).scalars().one()
+            kind, params = job.kind, json.loads(job.params)
+
+        self._progress[job_id] = (0, None)
+        saved = (0, None)
+        pool = self._pool
+        future = asyncio.wrap_future(pool.submit(run_job, job_id, kind, params))
+        try:
+            while not future.done():
+                await asyncio.wait([future], timeout=PROGRESS_SAVE_INTERVAL)
+                if self._progress[job_id] != saved:
+                    saved = self._progress[job_id]
+                    await self._save(job_id, progress_done=saved[0], progress_total=saved[1])
+            result, done, total = future.result()
+            values = {"status": "done", "result": json.dumps(result), "progress_done": done, "progress_total": total}
+        except JobCancelled:
+            values = {"status": "cancelled"}
+        except BrokenProcessPool:
+            values = {"status": "failed", "error": "The worker process exited unexpectedly"}
+            if self._pool is pool:
+                self._pool = self._new_pool()
+        except Exception as e:
+            values = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        if "progress_done" not in values:
+            values["progress_done"], values["progress_total"] = self._progress[job_id]
+        del self._progress[job_id]
+        await self._save(job_id, finished_at=datetime.now(timezone.utc), **values)
+
+        if kind == "import":
+            # The upload was spooled for this job alone
+            if os.path.exists(params["path"]):
+                os.remove(params["path"])
+        if values["status"] == "done" and JOB_KINDS[kind].clears_cache:
+            response_cache.clear()
+
+    async def _save(self, job_id, **values):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(**values))
+            await db.commit()
+
+
+job_runner = JobRunner(JOB_CONCURRENCY, JOB_PROCESSES, JOB_DIR)
+worker_bus.on("job_queued", lambda message: job_runner.enqueue(message["id"]))
+worker_bus.on_connection(job_runner.bus_connected)
@@ -1,14 +1,21 @@
 from fastapi import FastAPI, Depends, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
 import os
 
-from .models.database import get_db, async_engine, Base
-from .routers import players, games, stats, game_stats
+from .models.database import get_db, async_engine
+from .models.migrations import upgrade_schema
+from .routers import players, games, stats, game_stats, export, imports, jobs
+from .write_behind import write_buffer
+from .jobs import job_runner
+from .bus import worker_bus
+from .response_cache import response_cache
+from .analytics import analytics
+from .metrics import MetricsMiddleware, metrics_registry
 
 # Create FastAPI app
 app = FastAPI(
@@ -26,11 +33,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route timing and SQL counts, outermost so it covers the other middleware
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(games.router)
 app.include_router(players.router)
 app.include_router(stats.router)
 app.include_router(game_stats.router)
+app.include_router(export.router)
+app.include_router(imports.router)
+app.include_router(jobs.router)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -38,11 +51,55 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Configure templates
 templates = Jinja2Templates(directory="app/templates")
 
-# On startup, create database tables
+# On startup, create missing tables and migrate existing databases in place
 @app.on_event("startup")
 async def on_startup():
     async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+    # Reach the other workers before anything is cached or published
+    await worker_bus.start()
+    if write_buffer.enabled:
+        await write_buffer.start()
+    await job_runner.start()
+
+# On shutdown, drain buffered stats before the process exits
+@app.on_event("shutdown")
+async def on_shutdown():
+    await job_runner.stop()
+    if write_buffer.enabled:
+        await write_buffer.stop()
+    await worker_bus.stop()
+
+@app.get("/api/_cache")
+async def cache_stats():
+    """Hit rate and memory use of the read response cache"""
+    return response_cache.stats()
+
+@app.get("/api/_metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-route request metrics and cache gauges in Prometheus text format, of the worker that answers"""
+    cache = response_cache.stats()
+    samples = [
+        ("bvb_response_cache_entries", "gauge", "Responses held in the response cache", cache["entries"]),
+        ("bvb_response_cache_bytes", "gauge", "Memory used by cached responses", cache["bytes"]),
+        ("bvb_response_cache_hits_total", "counter", "Response cache hits", cache["hits"]),
+        ("bvb_response_cache_misses_total", "counter", "Response cache misses", cache["misses"]),
+        ("bvb_response_cache_not_modified_total", "counter", "Cached responses answered with 304", cache["not_modified"]),
+        ("bvb_response_cache_invalidations_total", "counter", "Cached responses dropped by writes", cache["invalidations"]),
+        ("bvb_response_cache_evictions_total", "counter", "Cached responses evicted for space", cache["evictions"]),
+        ("bvb_analytics_loaded", "gauge", "1 once the analytics arrays are loaded", int(analytics.loaded)),
+        ("bvb_analytics_rows", "gauge", "Live stats held in the analytics arrays", analytics.row_count),
+        ("bvb_analytics_bytes", "gauge", "Memory used by the analytics arrays", analytics.memory_bytes),
+        ("bvb_write_behind_pending", "gauge", "Stats acknowledged but not yet committed", write_buffer.pending_count),
+        ("bvb_write_behind_rejected_total", "counter", "Acknowledged stats moved to the rejected-stats file", write_buffer.rejected),
+        ("bvb_jobs_queued", "gauge", "Background jobs waiting for a worker", job_runner.queued_count),
+        ("bvb_jobs_running", "gauge", "Background jobs running in worker processes", job_runner.running_count),
+        ("bvb_jobs_runner", "gauge", "1 if this process runs the background jobs", int(job_runner.active)),
+        ("bvb_bus_connected", "gauge", "1 while connected to the multi-worker message hub", int(worker_bus.connected)),
+        ("bvb_bus_messages_sent_total", "counter", "Messages sent to other workers", worker_bus.sent),
+        ("bvb_bus_messages_received_total", "counter", "Messages received from other workers", worker_bus.received),
+    ]
+    return PlainTextResponse(metrics_registry.render(samples), media_type="text/plain; version=0.0.4")
 
 @app.get("/", response_class=HTMLResponse)
 async def serve_home(request: Request):
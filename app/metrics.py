@@ -0,0 +1,237 @@
+"""Per-route request metrics in Prometheus text format.
+
+MetricsMiddleware times every HTTP request and, through cursor events on
+async_engine, counts the SQL statements it executed, their time and the rows
+they returned or changed. Totals are kept per route template (e.g.
+/api/games/{game_id}), so a handler that starts issuing one query per item
+shows up as a jump in bvb_sql_statements_per_request for that route.
+
+Everything is exposed at /api/_metrics together with the response cache and
+analytics cache gauges, and each response carries a Server-Timing header with
+its handler time and SQL time.
+"""
+import time
+from contextvars import ContextVar
+from collections import defaultdict
+
+from sqlalchemy import event
+
+from .models.config import METRICS_ENABLED
+from .models.database import async_engine
+
+# Upper bounds of the histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# Requests that match no route share one label instead of one per URL
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestMetrics:
+    __slots__ = ("statements", "sql_seconds", "rows")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+
+# The request being served by the current task; None outside requests
+current_request = ContextVar("current_request", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class RouteMetrics:
+    __slots__ = ("latency", "statements", "statement_total", "sql_seconds", "rows", "response_bytes", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statement_total = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.response_bytes = 0
+        self.statuses = defaultdict(int)
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.time()
+        self._routes = defaultdict(RouteMetrics)
+        # Statements run outside any request: write-behind flushes, imports, startup
+        self.background = RequestMetrics()
+
+    def record(self, method, route, status, seconds, request, response_bytes):
+        metrics = self._routes[(method, route)]
+        metrics.latency.observe(seconds)
+        metrics.statements.observe(request.statements)
+        metrics.statement_total += request.statements
+        metrics.sql_seconds += request.sql_seconds
+        metrics.rows += request.rows
+        metrics.response_bytes += response_bytes
+        metrics.statuses[status] += 1
+
+    def reset(self):
+        self._routes.clear()
+        self.background = RequestMetrics()
+
+    def render(self, extra=()):
+        """Prometheus text exposition of every route's metrics, followed by (name, type, help, value) samples"""
+        routes = sorted(self._routes.items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("bvb_http_requests_total", "counter", "Requests served, by route and status")
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'bvb_http_requests_total{{{_labels(method, route)},status="{status}"}} {count}')
+        family("bvb_http_request_duration_seconds", "histogram", "Time from request to the end of the response body")
+        for (method, route), metrics in routes:
+            lines.extend(metrics.latency.lines("bvb_http_request_duration_seconds", _labels(method, route)))
+        family("bvb_sql_statements_per_request", "histogram", "SQL statements executed per request")
+        for (method, route), metrics in routes:
+            lines.extend(metrics.statements.lines("bvb_sql_statements_per_request", _labels(method, route)))
+        for name, attribute, help_text in (
+            ("bvb_sql_statements_total", "statement_total", "SQL statements executed"),
+            ("bvb_sql_duration_seconds_total", "sql_seconds", "Time spent executing SQL statements"),
+            ("bvb_sql_rows_total", "rows", "Rows returned by queries plus rows changed by writes"),
+            ("bvb_http_response_bytes_total", "response_bytes", "Response body bytes sent"),
+        ):
+            family(name, "counter", help_text)
+            for (method, route), metrics in routes:
+                lines.append(f"{name}{{{_labels(method, route)}}} {getattr(metrics, attribute)}")
+
+        family("bvb_background_sql_statements_total", "counter", "SQL statements executed outside requests")
+        lines.append(f"bvb_background_sql_statements_total {self.background.statements}")
+        family("bvb_background_sql_rows_total", "counter", "Rows returned or changed outside requests")
+        lines.append(f"bvb_background_sql_rows_total {self.background.rows}")
+        for name, kind, help_text, value in extra:
+            family(name, kind, help_text)
+            lines.append(f"{name} {value}")
+        family("bvb_uptime_seconds", "gauge", "Seconds since the metrics started")
+        lines.append(f"bvb_uptime_seconds {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(method, route):
+    return f'method="{method}",route="{route}"'
+
+
+metrics_registry = MetricsRegistry(enabled=METRICS_ENABLED)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Statements on one connection never overlap, so one start time is enough
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("query_started")
+    request = current_request.get() or metrics_registry.background
+    request.statements += 1
+    request.sql_seconds += elapsed
+    if cursor.description is None:
+        rows = cursor.rowcount
+    else:
+        # aiosqlite's adapter buffers a whole non-streamed result during execute;
+        # streamed (server-side) results are not counted. _rows is private, so
+        # tests/test_metrics.py checks it is still there
+        rows = len(getattr(cursor, "_rows", ()))
+    if rows > 0:
+        request.rows += rows
+
+
+def _handle_error(context):
+    # after_cursor_execute does not run for a statement that raised
+    if context.connection is not None:
+        context.connection.info.pop("query_started", None)
+
+
+if METRICS_ENABLED:
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(async_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(async_engine.sync_engine, "handle_error", _handle_error)
+
+
+def _route_label(scope):
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mounts such as /static set root_path rather than a route
+    if scope.get("root_path"):
+        return scope["root_path"]
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording each HTTP request in metrics_registry and adding Server-Timing"""
+
+    def __init__(self, app, registry=metrics_registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics()
+        token = current_request.set(request)
+        started = time.perf_counter()
+        status = 500
+        response_bytes = 0
+
+        async def send_with_timing(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # For streamed responses this is the time to the first byte
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                timing = (
+                    f'app;dur={elapsed_ms:.1f}, '
+                    f'db;dur={request.sql_seconds * 1000:.1f};desc="{request.statements} SQL statements"'
+                )
+                message = dict(message)
+                message["headers"] = list(message.get("headers", ())) + [(b"server-timing", timing.encode())]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            self.registry.record(
+                scope["method"], _route_label(scope), status,
+                time.perf_counter() - started, request, response_bytes,
+            )
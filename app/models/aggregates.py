@@ -0,0 +1,145 @@
+"""Incrementally maintained per-player, per-game stat counters.
+
+Every stat maps to a handful of metrics named after PlayerGameStats fields
+(histogram buckets are "<field>:<enum value>"). Inserting a stat adds +1 to
+each of its metrics and deleting it adds -1, inside the same transaction as
+the write, so summaries are read back from player_game_aggregates instead of
+re-scanning base_stats.
+"""
+from collections import Counter
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .database import insert_many
+from .models import ActionType, Game, PlayerGameAggregate
+
+# Counter bumped for every stat of an action type, with or without details
+TOTAL_METRICS = {
+    ActionType.SERVING: "total_serves",
+    ActionType.SERVE_RECEIVE: "total_receive_attempts",
+    ActionType.ATTACK: "total_attacks",
+    ActionType.BLOCK: "block_attempts",
+    ActionType.DIG: "dig_attempts",
+    ActionType.SET: "total_sets",
+}
+
+# Boolean detail column -> counter, per action type
+FLAG_METRICS = {
+    ActionType.SERVING: {"is_missed": "missed_serves", "is_ace": "aces"},
+    ActionType.SERVE_RECEIVE: {"is_good_pass": "good_passes", "is_error": "receive_errors"},
+    ActionType.ATTACK: {"is_kill": "kills", "is_error": "attack_errors", "is_blocked": "attacks_blocked"},
+    ActionType.BLOCK: {"is_stuff": "stuff_blocks", "is_touch": "block_touches"},
+    ActionType.DIG: {"is_successful": "successful_digs", "led_to_kill": "digs_to_kills"},
+    ActionType.SET: {"is_error": "set_errors", "is_killable": "killable_sets"},
+}
+
+# Enum detail column -> histogram, per action type
+HISTOGRAM_METRICS = {
+    ActionType.SERVING: {"serve_type": "serve_types"},
+    ActionType.SERVE_RECEIVE: {"pass_rating": "pass_ratings"},
+    ActionType.ATTACK: {"attack_direction": "attack_directions", "attack_type": "attack_types"},
+    ActionType.BLOCK: {},
+    ActionType.DIG: {"dig_quality": "dig_qualities"},
+    ActionType.SET: {"set_type": "set_types"},
+}
+
+
+def stat_metrics(action_type, details):
+    """Metric names a single stat contributes to; details is a dict of detail column values or None"""
+    metrics = [TOTAL_METRICS[action_type]]
+    if details:
+        for column, metric in FLAG_METRICS[action_type].items():
+            if details.get(column):
+                metrics.append(metric)
+        for column, histogram in HISTOGRAM_METRICS[action_type].items():
+            value = details.get(column)
+            if value is not None:
+                metrics.append(f"{histogram}:{getattr(value, 'value', value)}")
+    return metrics
+
+
+def count_metrics(stats):
+    """Counter keyed by (player_id, game_id, metric) for (player_id, game_id, action_type, details) tuples"""
+    counts = Counter()
+    for player_id, game_id, action_type, details in stats:
+        for metric in stat_metrics(action_type, details):
+            counts[(player_id, game_id, metric)] += 1
+    return counts
+
+
+async def apply_stat_deltas(db, stats, sign=1):
+    """Add (sign=1) or remove (sign=-1) the given stats from the aggregate counters"""
+    counts = count_metrics(stats)
+    if not counts:
+        return
+    table = PlayerGameAggregate.__table__
+    upsert = sqlite_insert(table)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[table.c.player_id, table.c.game_id, table.c.metric],
+        set_={"count": table.c.count + upsert.excluded.count}
+    )
+    await insert_many(db, table, [
+        {"player_id": player_id, "game_id": game_id, "metric": metric, "count": sign * count}
+        for (player_id, game_id, metric), count in counts.items()
+    ], statement=upsert)
+    if sign < 0:
+        game_ids = {game_id for _, game_id, _ in counts}
+        await db.execute(delete(table).where(table.c.game_id.in_(game_ids), table.c.count <= 0))
+
+
+def summary_from_metrics(metric_rows):
+    """Fold (metric, count) rows into PlayerGameStats counter and histogram fields"""
+    summary = {}
+    for metric, count in metric_rows:
+        field, _, bucket = metric.partition(":")
+        if bucket:
+            summary.setdefault(field, {})[bucket] = count
+        else:
+            summary[field] = count
+    return summary
+
+
+async def player_game_summaries(db, game_id, player_id=None):
+    """Summary fields per player for a game, read straight from the aggregate table"""
+    query = select(
+        PlayerGameAggregate.player_id, PlayerGameAggregate.metric, PlayerGameAggregate.count
+    ).where(PlayerGameAggregate.game_id == game_id)
+    if player_id is not None:
+        query = query.where(PlayerGameAggregate.player_id == player_id)
+    result = await db.execute(query)
+    rows_by_player = {}
+    for row_player_id, metric, count in result.all():
+        rows_by_player.setdefault(row_player_id, []).append((metric, count))
+    return {pid: summary_from_metrics(rows) for pid, rows in rows_by_player.items()}
+
+
+def season_summaries(conn, start_date=None, end_date=None):
+    """Summary fields per player summed over games in an inclusive date range, plus games played.
+
+    Runs on a sync connection; each player's dict has a "games" count next to
+    the usual PlayerGameStats counter and histogram fields.
+    """
+    table = PlayerGameAggregate.__table__
+    conditions = []
+    if start_date is not None:
+        conditions.append(Game.date >= start_date)
+    if end_date is not None:
+        conditions.append(Game.date <= end_date)
+    metrics = conn.execute(
+        select(table.c.player_id, table.c.metric, func.sum(table.c.count))
+        .join(Game, Game.id == table.c.game_id).where(*conditions)
+        .group_by(table.c.player_id, table.c.metric)
+    )
+    rows_by_player = {}
+    for player_id, metric, count in metrics:
+        rows_by_player.setdefault(player_id, []).append((metric, count))
+    games = dict(conn.execute(
+        select(table.c.player_id, func.count(func.distinct(table.c.game_id)))
+        .join(Game, Game.id == table.c.game_id).where(*conditions)
+        .group_by(table.c.player_id)
+    ).all())
+    return {
+        player_id: {"games": games.get(player_id, 0), **summary_from_metrics(rows)}
+        for player_id, rows in rows_by_player.items()
+    }
@@ -0,0 +1,94 @@
+"""Storage settings, read from BVB_* environment variables.
+
+BVB_STORAGE_PROFILE picks a set of SQLite pragmas: "tuned" (the default)
+enables WAL and the other settings below for concurrent scorer writes next
+to read-heavy pages; "default" leaves SQLite's own defaults in place. Any
+single pragma can still be overridden with its own variable.
+"""
+import os
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_str(name, default):
+    value = os.environ.get(name)
+    return value if value not in (None, "") else default
+
+
+# SQLite file shared by the sync (CLI) and async (FastAPI) engines
+DATABASE_PATH = env_str("BVB_DATABASE_PATH", "./bvb_stats.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
+
+# PRAGMA values applied to every new connection, per profile
+STORAGE_PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # Negative means KiB, so 64 MiB
+        "busy_timeout": 5000,  # Milliseconds
+    },
+}
+
+STORAGE_PROFILE = env_str("BVB_STORAGE_PROFILE", "tuned")
+if STORAGE_PROFILE not in STORAGE_PROFILES:
+    raise ValueError(f"BVB_STORAGE_PROFILE must be one of: {', '.join(STORAGE_PROFILES)}")
+
+SQLITE_PRAGMAS = dict(STORAGE_PROFILES[STORAGE_PROFILE])
+for _pragma in ("journal_mode", "synchronous", "mmap_size", "cache_size", "busy_timeout"):
+    _override = os.environ.get(f"BVB_SQLITE_{_pragma.upper()}")
+    if _override:
+        SQLITE_PRAGMAS[_pragma] = _override
+
+# Stat layout: "normalized" keeps base_stats plus one detail table per action
+# type; "compact" stores each stat as a single compact_stats row
+STAT_STORAGE_ENGINES = ("normalized", "compact")
+STAT_STORAGE = env_str("BVB_STAT_STORAGE", "normalized")
+if STAT_STORAGE not in STAT_STORAGE_ENGINES:
+    raise ValueError(f"BVB_STAT_STORAGE must be one of: {', '.join(STAT_STORAGE_ENGINES)}")
+
+# Async connection pool; aiosqlite would otherwise open a fresh connection
+# (and thread) for every session
+DB_POOL_SIZE = env_int("BVB_DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = env_int("BVB_DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = env_int("BVB_DB_POOL_TIMEOUT", 30)
+
+# Re-validate stat JSON against StatResponse before sending it; the encoder's
+# output is trusted, so this is only worth the cost while developing
+VALIDATE_RESPONSES = env_str("BVB_VALIDATE_RESPONSES", "0") == "1"
+
+# Per-route latency, SQL statement counts and response sizes at /api/_metrics,
+# plus a Server-Timing header on every response
+METRICS_ENABLED = env_str("BVB_METRICS", "1") == "1"
+
+# In-process cache of serialized read responses, dropped by the write paths
+RESPONSE_CACHE_ENABLED = env_str("BVB_RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_MAX_BYTES = env_int("BVB_RESPONSE_CACHE_MB", 64) * 1024 * 1024
+
+# Write-behind mode for POST /api/games/{id}/stats: acknowledge once the stat is
+# in the append log and group-commit to SQLite every interval or batch size
+WRITE_BEHIND_ENABLED = env_str("BVB_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_LOG_PATH = env_str("BVB_WRITE_BEHIND_LOG", f"{DATABASE_PATH}.pending.ndjson")
+# Acknowledged stats that could not be committed (e.g. their game was deleted meanwhile)
+WRITE_BEHIND_REJECTED_PATH = env_str("BVB_WRITE_BEHIND_REJECTED", f"{DATABASE_PATH}.rejected.ndjson")
+WRITE_BEHIND_INTERVAL_MS = env_int("BVB_WRITE_BEHIND_INTERVAL_MS", 50)
+WRITE_BEHIND_MAX_BATCH = env_int("BVB_WRITE_BEHIND_MAX_BATCH", 500)
+# fsync each append; without it the log survives a process crash but not power loss
+WRITE_BEHIND_FSYNC = env_str("BVB_WRITE_BEHIND_FSYNC", "0") == "1"
+
+# Background jobs (rebuilds, file exports and imports, season reports): how many
+# run at once, the worker processes that execute them, and where their files go
+JOB_CONCURRENCY = env_int("BVB_JOB_CONCURRENCY", 1)
+JOB_PROCESSES = env_int("BVB_JOB_PROCESSES", 1)
+JOB_DIR = env_str("BVB_JOB_DIR", f"{DATABASE_PATH}.jobs")
+
+# Multi-worker mode (app/serve.py): worker processes behind one port, and the
+# Unix socket of the hub that relays cache invalidations and live events
+# between them; unset for a single process
+WORKERS = env_int("BVB_WORKERS", os.cpu_count() or 1)
+BUS_SOCKET = env_str("BVB_BUS_SOCKET", None)
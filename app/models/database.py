@@ -1,19 +1,39 @@
-from sqlalchemy import create_engine
+from operator import itemgetter
+
+from sqlalchemy import Boolean, Enum, create_engine, event, insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = "sqlite:///./bvb_stats.db"
-ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./bvb_stats.db"
+from .config import DATABASE_URL, ASYNC_DATABASE_URL, SQLITE_PRAGMAS
+from .config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT
 
 # Sync engine for migrations and CLI tools
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Async engine for FastAPI
-async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args={"check_same_thread": False})
+# Async engine for FastAPI, with pooled connections so pragmas are applied once per connection
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+)
 AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the configured storage profile to each new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+event.listen(engine, "connect", apply_sqlite_pragmas)
+event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
 Base = declarative_base()
 
 # Dependency for getting async DB session
@@ -23,3 +43,47 @@ async def get_db():
         yield async_session
     finally:
         await async_session.close()
+
+def _memoized(process):
+    cache = {}
+    def memoized(value):
+        try:
+            return cache[value]
+        except KeyError:
+            cache[value] = result = process(value)
+            return result
+    return memoized
+
+async def insert_many(db, table, rows, statement=None):
+    """executemany of row dicts that all have the same keys, bound straight through the DBAPI.
+
+    Core's executemany rebuilds and re-processes a parameter dict per row,
+    which costs several times SQLite's own insert for narrow rows; here the
+    statement (default: a plain INSERT into table) is compiled once and each
+    row becomes a tuple.
+    """
+    if not rows:
+        return
+    conn = await db.connection()
+    statement = insert(table) if statement is None else statement
+    compiled = statement.compile(dialect=conn.dialect, column_keys=list(rows[0]))
+    # Parameter order of the compiled statement, which follows the table's column order
+    names = compiled.positiontup
+    processors = []
+    for i, name in enumerate(names):
+        column_type = table.c[name].type
+        process = column_type.bind_processor(conn.dialect)
+        if process is not None and isinstance(column_type, (Enum, Boolean)):
+            # Few distinct values, each checked and converted per row: process each once
+            process = _memoized(process)
+        if process is not None:
+            processors.append((i, process))
+    values = itemgetter(*names) if len(names) > 1 else (lambda row: (row[names[0]],))
+    params = [values(row) for row in rows]
+    if processors:
+        params = [list(row) for row in params]
+        for row in params:
+            for i, process in processors:
+                row[i] = process(row[i])
+        params = [tuple(row) for row in params]
+    await conn.exec_driver_sql(compiled.string, params)
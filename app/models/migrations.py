@@ -0,0 +1,142 @@
+"""Versioned, in-place schema migrations for existing bvb_stats.db files.
+
+The schema version is kept in SQLite's ``PRAGMA user_version``. Tables that do
+not exist yet are created by ``Base.metadata.create_all`` and nullable columns
+missing from existing tables are added; each migration step then brings an
+older database up to date without dropping any data. Steps must be idempotent
+so they are safe on a freshly created database too.
+"""
+import json
+
+from sqlalchemy import insert, literal, select
+
+from .models import epoch_millis, Game, GameParticipant, StatChange, CompactStat, BaseStat, ServeStat, ReceiveStat, AttackStat, BlockStat, DigStat, SetStat
+from .database import Base
+from .stat_store import STAT_STORES, rebuild_aggregates, rebuild_rallies, rebuild_rollups
+
+
+def _store_enums_by_name(conn):
+    """Rewrite enum columns written by value (e.g. 'float') to the enum name SQLAlchemy reads back"""
+    for model in (BaseStat, ServeStat, ReceiveStat, AttackStat, BlockStat, DigStat, SetStat):
+        table = model.__table__
+        for column in table.columns:
+            enum_class = getattr(column.type, "enum_class", None)
+            if enum_class is None:
+                continue
+            for member in enum_class:
+                if str(member.value) == member.name:
+                    continue
+                conn.execute(table.update().where(column == str(member.value)).values({column.name: member}))
+
+
+def _create_base_stats_indexes(conn):
+    """Add the composite lookup indexes on base_stats"""
+    for index in BaseStat.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _backfill_aggregates(conn):
+    """Count existing stats into player_game_aggregates; they predate compact_stats, so read base_stats"""
+    rebuild_aggregates(conn, STAT_STORES["normalized"])
+
+
+def _backfill_game_participants(conn):
+    """Copy the JSON team1/team2 lists of existing games into game_participants"""
+    table = GameParticipant.__table__
+    done = set(conn.execute(select(table.c.game_id).distinct()).scalars())
+    rows = []
+    for game_id, team1, team2 in conn.execute(select(Game.id, Game.team1, Game.team2)):
+        if game_id in done:
+            continue
+        for team, players in ((1, team1), (2, team2)):
+            for position, player_id in enumerate(json.loads(players or "[]")):
+                rows.append({"game_id": game_id, "team": team, "position": position, "player_id": player_id})
+    if rows:
+        conn.execute(insert(table), rows)
+
+
+def _backfill_stat_changes(conn):
+    """Log an insert for every existing stat so a delta feed from 0 sees the whole game"""
+    table = StatChange.__table__
+    if conn.execute(select(table.c.seq).limit(1)).first() is not None:
+        return
+    conn.execute(insert(table).from_select(
+        ["game_id", "stat_id", "op"],
+        select(BaseStat.game_id, BaseStat.id, literal("insert")).order_by(BaseStat.id)
+    ))
+
+
+def _store_timestamps_as_epoch_millis(conn):
+    """Convert ISO text timestamps to integer epoch millis and index set/rally numbers"""
+    for table in (BaseStat.__table__, CompactStat.__table__):
+        columns = {row[1]: row[2] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+        if columns["timestamp"].upper() != "INTEGER":
+            # SQLite can't change a column's type: fill a new one, then swap it in.
+            # The old column can only be dropped once nothing indexes it.
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{table.name}_game_timestamp")
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN timestamp_ms INTEGER")
+            rows = conn.exec_driver_sql(f"SELECT id, timestamp FROM {table.name} WHERE timestamp IS NOT NULL").all()
+            updates = [(epoch_millis(timestamp), stat_id) for stat_id, timestamp in rows]
+            if updates:
+                conn.exec_driver_sql(f"UPDATE {table.name} SET timestamp_ms = ? WHERE id = ?", updates)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} DROP COLUMN timestamp")
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME COLUMN timestamp_ms TO timestamp")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _backfill_rallies(conn):
+    """Reconstruct the rallies of existing games from their stats"""
+    rebuild_rallies(conn)
+
+
+def _backfill_rollups(conn):
+    """Count existing stats into the stat cube's game and day rollups"""
+    rebuild_rollups(conn)
+
+
+# (version, description, step) in the order they must run
+MIGRATIONS = [
+    (1, "Store detail enums by name", _store_enums_by_name),
+    (2, "Index base_stats by game, player and action type", _create_base_stats_indexes),
+    (3, "Backfill player_game_aggregates from existing stats", _backfill_aggregates),
+    (4, "Normalize game teams into game_participants", _backfill_game_participants),
+    (5, "Start the stat change log from existing stats", _backfill_stat_changes),
+    (6, "Store stat timestamps as epoch millis and index set/rally numbers", _store_timestamps_as_epoch_millis),
+    (7, "Reconstruct rallies from existing stats", _backfill_rallies),
+    (8, "Backfill stat cube rollups from existing stats", _backfill_rollups),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def add_missing_columns(conn):
+    """ALTER TABLE ADD COLUMN for nullable model columns an existing table lacks"""
+    for table in Base.metadata.sorted_tables:
+        existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+        for column in table.columns:
+            if column.name in existing or not column.nullable or column.primary_key:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+
+def get_schema_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_schema_version(conn, version):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def upgrade_schema(conn):
+    """Create missing tables and columns, then apply every migration newer than the stored version"""
+    Base.metadata.create_all(conn)
+    add_missing_columns(conn)
+    version = get_schema_version(conn)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"Applying migration {number}: {description}")
+        step(conn)
+        set_schema_version(conn, number)
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum, Float, Boolean
+from sqlalchemy import Column, Integer, SmallInteger, String, Date, ForeignKey, Enum, Float, Boolean, Index, PrimaryKeyConstraint
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declared_attr
 import enum
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 
 from .database import Base
 
@@ -48,6 +50,70 @@ class DigQuality(enum.Enum):
     PLAYABLE = "playable"
     POOR = "poor"
 
+@lru_cache(maxsize=None)
+def enum_code(member):
+    """Small-int code of an enum member: its 1-based position in the enum"""
+    return list(type(member)).index(member) + 1
+
+@lru_cache(maxsize=None)
+def enum_member(enum_class, code):
+    return list(enum_class)[code - 1]
+
+class EnumCode(TypeDecorator):
+    """Enum column stored as a small-int code instead of the member name"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else enum_code(self.enum_class(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else enum_member(self.enum_class, value)
+
+def epoch_millis(value):
+    """Milliseconds since the epoch for a datetime, ISO string or epoch-millis number.
+
+    Naive datetimes are taken as server local time, which is what the server
+    used to stamp stats with. Returns None for unparseable strings.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None else int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip())
+        except ValueError:
+            try:
+                return int(float(value))
+            except ValueError:
+                return None
+    return int(value.astimezone(timezone.utc).timestamp() * 1000)
+
+def format_timestamp(value):
+    """ISO 8601 UTC text with milliseconds, the same shape as JavaScript's toISOString()"""
+    return value.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+class EpochMillis(TypeDecorator):
+    """Datetime column stored as integer milliseconds since the epoch, read back as aware UTC"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return epoch_millis(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # ISO text from before migration 6
+            value = epoch_millis(value)
+            if value is None:
+                return None
+        return datetime.fromtimestamp(value // 1000, timezone.utc) + timedelta(milliseconds=value % 1000)
+
 # Base Game Models
 class Game(Base):
     __tablename__ = "games"
@@ -59,6 +125,38 @@ class Game(Base):
     
     # Relationships
     base_stats = relationship("BaseStat", back_populates="game")
+    # Indexed copy of team1/team2; loaded with one IN query per batch of games
+    participants = relationship(
+        "GameParticipant",
+        back_populates="game",
+        order_by="(GameParticipant.team, GameParticipant.position)",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+    
+    @property
+    def team1_ids(self):
+        return [p.player_id for p in self.participants if p.team == 1]
+    
+    @property
+    def team2_ids(self):
+        return [p.player_id for p in self.participants if p.team == 2]
+
+# One row per player per game, so "games a player appeared in" is an index lookup
+class GameParticipant(Base):
+    __tablename__ = "game_participants"
+
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    team = Column(Integer, primary_key=True)  # 1 or 2
+    position = Column(Integer, primary_key=True)  # Order within the team
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
+    
+    __table_args__ = (
+        Index("ix_game_participants_player_game", "player_id", "game_id"),
+    )
+    
+    # Relationships
+    game = relationship("Game", back_populates="participants")
 
 class Player(Base):
     __tablename__ = "players"
@@ -77,7 +175,20 @@ class BaseStat(Base):
     game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
     player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
     action_type = Column(Enum(ActionType), nullable=False)
-    timestamp = Column(String)  # ISO datetime string
+    timestamp = Column(EpochMillis)
+    set_number = Column(Integer)  # 1-based set within the game
+    rally_number = Column(Integer)  # 1-based rally within the set; every rally scores a point
+    
+    __table_args__ = (
+        # Per-game stat listing ordered by time, and time-window scans
+        Index("ix_base_stats_game_timestamp", "game_id", "timestamp"),
+        # Stats of one set or rally
+        Index("ix_base_stats_game_set_rally", "game_id", "set_number", "rally_number"),
+        # Per-player totals by category
+        Index("ix_base_stats_player_action", "player_id", "action_type"),
+        # Per-player, per-game summaries
+        Index("ix_base_stats_game_player_action", "game_id", "player_id", "action_type"),
+    )
     
     # Relationships
     game = relationship("Game", back_populates="base_stats")
@@ -167,3 +278,194 @@ class SetStat(Base):
     
     # Relationship back to base stat
     base_stat = relationship("BaseStat", back_populates="set_stat")
+
+
+# Single-row stat layout used when BVB_STAT_STORAGE=compact. Boolean details are
+# packed into flags and enum details become small-int codes; which bit and code
+# slot holds which detail depends on action_type (see stat_store.COMPACT_LAYOUTS).
+class CompactStat(Base):
+    __tablename__ = "compact_stats"
+
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
+    action_type = Column(EnumCode(ActionType), nullable=False)
+    timestamp = Column(EpochMillis)
+    set_number = Column(Integer)
+    rally_number = Column(Integer)
+    flags = Column(SmallInteger, nullable=False, default=0)  # Boolean details, plus a details-present bit
+    code1 = Column(SmallInteger)  # First enum detail, e.g. serve_type or attack_type
+    code2 = Column(SmallInteger)  # Second enum detail, e.g. opponent_pass_quality or attack_direction
+    serve_target = Column(String)  # Zone 1-6
+    
+    __table_args__ = (
+        Index("ix_compact_stats_game_timestamp", "game_id", "timestamp"),
+        Index("ix_compact_stats_game_set_rally", "game_id", "set_number", "rally_number"),
+        Index("ix_compact_stats_player_action", "player_id", "action_type"),
+        Index("ix_compact_stats_game_player_action", "game_id", "player_id", "action_type"),
+    )
+
+
+# Append-only log of stat inserts and deletes. seq never repeats, so clients can
+# ask for everything after the last seq they saw and receive deletes as tombstones.
+class StatChange(Base):
+    __tablename__ = "stat_changes"
+
+    seq = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+    stat_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "insert" or "delete"
+    
+    __table_args__ = (
+        Index("ix_stat_changes_game_seq", "game_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+# Highest write-behind log sequence committed to the stat tables. Updated in the
+# same transaction as each group commit so crash recovery never replays twice.
+class WriteBehindState(Base):
+    __tablename__ = "write_behind_state"
+
+    id = Column(Integer, primary_key=True)
+    applied_seq = Column(Integer, nullable=False, default=0)
+
+# One row per bulk-imported file, keyed by content hash. records_done advances in
+# the same transaction as each batch, so an interrupted import resumes after it.
+class ImportRun(Base):
+    __tablename__ = "import_runs"
+
+    id = Column(Integer, primary_key=True)
+    source_hash = Column(String, nullable=False, unique=True)  # SHA-1 of the file
+    source_name = Column(String)
+    status = Column(String, nullable=False, default="running")  # "running" or "done"
+    records_done = Column(Integer, nullable=False, default=0)  # Records read, including rejected ones
+    stats_imported = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+
+# Game created for each game key of an imported file
+class ImportGame(Base):
+    __tablename__ = "import_games"
+
+    run_id = Column(Integer, ForeignKey("import_runs.id"), primary_key=True)
+    source_game = Column(String, primary_key=True)  # The file's game_id, or its game_date without one
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+
+# Per-player, per-game counters maintained alongside every stat insert and delete.
+# One row per metric, named after the PlayerGameStats field it feeds; histogram
+# buckets are stored as "<field>:<enum value>", e.g. "attack_directions:line".
+class PlayerGameAggregate(Base):
+    __tablename__ = "player_game_aggregates"
+
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False, index=True)
+    metric = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint("player_id", "game_id", "metric"),
+    )
+
+# Rallies reconstructed from each game's stats in (timestamp, id) order; see rallies.py.
+# A write rebuilds a game's rallies from just before the first stat it changed.
+class Rally(Base):
+    __tablename__ = "rallies"
+
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)  # 1-based position within the game
+    set_number = Column(Integer)  # As logged on the rally's stats, if at all
+    rally_number = Column(Integer)
+    first_stat_id = Column(Integer, nullable=False)
+    start_timestamp = Column(EpochMillis)  # Timestamp of first_stat_id
+    end_timestamp = Column(EpochMillis)
+    touches = Column(Integer, nullable=False)
+    serving_team = Column(Integer)  # 1 or 2; None when neither a serve nor a pass was logged
+    server_id = Column(Integer)
+    passer_id = Column(Integer)  # Player who received the serve
+    pass_rating = Column(Integer)  # PassRating value, 0-3
+    winning_team = Column(Integer)  # None while the rally's end is unknown
+    outcome = Column(String)  # How it ended, see rallies.OUTCOMES
+    ending_player_id = Column(Integer)  # Player whose touch ended it
+    first_ball_kill = Column(Boolean, nullable=False, default=False)  # Receiving team killed its first attack
+    
+    __table_args__ = (
+        Index("ix_rallies_server", "server_id"),
+        Index("ix_rallies_passer", "passer_id"),
+    )
+
+# Each run of consecutive touches by one team within a rally
+class RallyPossession(Base):
+    __tablename__ = "rally_possessions"
+
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    rally_seq = Column(Integer, primary_key=True)
+    number = Column(Integer, primary_key=True)  # 1-based within the rally; the serve is not a possession
+    team = Column(Integer, nullable=False)
+    phase = Column(String, nullable=False)  # "reception" (first ball after the serve) or "transition"
+    first_contact_id = Column(Integer)  # Passer, digger or blocker who started it
+    attacker_id = Column(Integer)
+    result = Column(String)  # "kill", "error" or "blocked"; None if the attack was kept in play or none was logged
+    
+    __table_args__ = (
+        Index("ix_rally_possessions_attacker", "attacker_id"),
+    )
+
+# Stat counts grouped by everything the cube can pivot on except the stat's own
+# time and rally, at player/game and player/day grain. Keys use the compact_stats
+# encoding (see stat_store.COMPACT_LAYOUTS) with 0 and "" standing in for missing
+# codes and targets, as NULLs would never collide on upsert. Maintained alongside
+# every stat insert and delete; see rollups.py.
+class StatRollup(Base):
+    __tablename__ = "stat_rollups"
+
+    action_type = Column(EnumCode(ActionType), nullable=False)
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False, index=True)
+    flags = Column(SmallInteger, nullable=False)
+    code1 = Column(SmallInteger, nullable=False)
+    code2 = Column(SmallInteger, nullable=False)
+    serve_target = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint("action_type", "player_id", "game_id", "flags", "code1", "code2", "serve_target"),
+    )
+
+# StatRollup merged over each player's games on the same date
+class StatDayRollup(Base):
+    __tablename__ = "stat_day_rollups"
+
+    action_type = Column(EnumCode(ActionType), nullable=False)
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
+    day = Column(Date, nullable=False, index=True)  # The game date
+    flags = Column(SmallInteger, nullable=False)
+    code1 = Column(SmallInteger, nullable=False)
+    code2 = Column(SmallInteger, nullable=False)
+    serve_target = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint("action_type", "player_id", "day", "flags", "code1", "code2", "serve_target"),
+    )
+
+# Background jobs run by jobs.JobRunner. The row is the job's durable state: the
+# runner records status, progress and the outcome here, and a running job polls
+# cancel_requested between steps.
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # See jobs.JOB_KINDS
+    params = Column(String, nullable=False, default="{}")  # JSON
+    status = Column(String, nullable=False, default="queued")  # "queued", "running", "done", "failed" or "cancelled"
+    progress_done = Column(Integer, nullable=False, default=0)
+    progress_total = Column(Integer)  # None while unknown
+    result = Column(String)  # JSON, once done
+    error = Column(String)  # Why it failed
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(EpochMillis)
+    started_at = Column(EpochMillis)
+    finished_at = Column(EpochMillis)
+    
+    __table_args__ = (
+        Index("ix_jobs_status", "status"),
+    )
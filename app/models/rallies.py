@@ -0,0 +1,511 @@
+"""Rallies and possessions reconstructed from each game's ordered stat stream.
+
+A game's stats, in (timestamp, id) order, are cut into rallies in one pass.
+Stats that carry set and rally numbers are grouped by them; otherwise each
+serve starts a new rally. Within a rally, every change of team on the ball
+starts a possession. The receiving team's first possession is "reception"
+(first ball) and every later one is "transition".
+
+The first touch that decides a rally fixes its winner and outcome (OUTCOMES):
+an ace, a missed serve, a kill, an error, a stuff block or a failed dig. A
+rally logged without one goes to whichever team serves the next rally of the
+same set, because the team that wins a rally serves the next one.
+
+Teams come from game_participants. The results live in the rallies and
+rally_possessions tables. stat_store rebuilds a game's rallies starting just
+before the first stat a write changed, inside the write's transaction.
+Derived metrics are read back with rally_metrics().
+"""
+from sqlalchemy import case, delete, func, select, tuple_
+
+from .database import insert_many
+from .models import ActionType, GameParticipant, Rally, RallyPossession
+from .models import epoch_millis, format_timestamp
+
+RECEPTION = "reception"
+TRANSITION = "transition"
+
+# How a rally ended; "next_serve" means no deciding touch was logged and the
+# winner is the team that served next
+OUTCOMES = (
+    "ace", "service_error", "reception_error", "set_error", "kill", "attack_error", "blocked", "dig_error",
+    "next_serve",
+)
+
+# Detail columns the replay reads, per action type
+TOUCH_DETAILS = {
+    ActionType.SERVING: ("is_ace", "is_missed", "opponent_pass_quality"),
+    ActionType.SERVE_RECEIVE: ("is_error", "pass_rating"),
+    ActionType.ATTACK: ("is_kill", "is_error", "is_blocked"),
+    ActionType.BLOCK: ("is_stuff",),
+    ActionType.DIG: ("is_successful",),
+    ActionType.SET: ("is_error",),
+}
+
+# Accepted values of rally_metrics(by=...)
+METRIC_GROUPS = ("player", "team")
+
+
+class Possession:
+    __slots__ = ("team", "phase", "first_contact_id", "attacker_id", "result")
+
+    def __init__(self, team, phase, first_contact_id):
+        self.team = team
+        self.phase = phase
+        self.first_contact_id = first_contact_id
+        self.attacker_id = None
+        self.result = None
+
+
+class RallyRecord:
+    """One rally being replayed touch by touch"""
+    __slots__ = (
+        "set_number", "rally_number", "first_stat_id", "start_timestamp", "end_timestamp", "touches",
+        "serving_team", "server_id", "passer_id", "pass_rating", "winning_team", "outcome", "ending_player_id",
+        "possessions",
+    )
+
+    def __init__(self, stat_id, timestamp, set_number, rally_number):
+        self.set_number = set_number
+        self.rally_number = rally_number
+        self.first_stat_id = stat_id
+        self.start_timestamp = timestamp
+        self.end_timestamp = timestamp
+        self.touches = 0
+        self.serving_team = None
+        self.server_id = None
+        self.passer_id = None
+        self.pass_rating = None
+        self.winning_team = None
+        self.outcome = None
+        self.ending_player_id = None
+        self.possessions = []
+
+    @property
+    def first_ball_kill(self):
+        if not self.possessions:
+            return False
+        first = self.possessions[0]
+        return first.phase == RECEPTION and first.result == "kill"
+
+    def starts_new(self, action_type, set_number, rally_number):
+        """Whether a touch belongs to the next rally rather than this one"""
+        if None not in (set_number, rally_number, self.set_number, self.rally_number):
+            return (set_number, rally_number) != (self.set_number, self.rally_number)
+        if action_type is ActionType.SERVING:
+            return True
+        # A second pass, or one after the rally was decided other than by an ace the
+        # receiver touched, means the next serve wasn't logged
+        return action_type is ActionType.SERVE_RECEIVE and (
+            self.passer_id is not None or self.winning_team is not None and self.outcome != "ace"
+        )
+
+    def add(self, player_id, team, action_type, timestamp, set_number, rally_number, details):
+        """Replay one touch; team is None for a player who isn't a participant of the game"""
+        self.touches += 1
+        if timestamp is not None:
+            self.end_timestamp = timestamp
+        if self.set_number is None and self.rally_number is None:
+            self.set_number, self.rally_number = set_number, rally_number
+        details = details or {}
+
+        if action_type is ActionType.SERVING:
+            if self.server_id is None:
+                self.server_id = player_id
+                self.serving_team = team
+            quality = details.get("opponent_pass_quality")
+            if quality is not None and self.pass_rating is None:
+                self.pass_rating = quality.value
+            if team is not None and self.winning_team is None:
+                if details.get("is_missed"):
+                    self._end(3 - team, "service_error", player_id)
+                elif details.get("is_ace"):
+                    self._end(team, "ace", player_id)
+            return
+        if team is None:
+            return
+
+        if action_type is ActionType.SERVE_RECEIVE and self.passer_id is None:
+            # Also kept for an ace the receiver touched, which counts against the passer
+            self.passer_id = player_id
+            rating = details.get("pass_rating")
+            if rating is not None:
+                self.pass_rating = rating.value
+            if self.serving_team is None:
+                self.serving_team = 3 - team
+        if self.winning_team is not None:
+            return
+
+        current = self.possessions[-1] if self.possessions else None
+        attacked = current is not None and current.team != team and current.attacker_id is not None
+        if action_type is ActionType.DIG and details.get("is_successful") is False:
+            if attacked and current.result is None:
+                current.result = "kill"
+            self._end(3 - team, "dig_error", player_id)
+            return
+        if action_type is ActionType.BLOCK and details.get("is_stuff"):
+            if attacked and current.result is None:
+                current.result = "blocked"
+            self._end(team, "blocked", player_id)
+            return
+
+        if current is None or current.team != team or current.attacker_id is not None:
+            if current is None and self.serving_team is None:
+                self.serving_team = 3 - team
+            phase = RECEPTION if current is None and team != self.serving_team else TRANSITION
+            current = Possession(team, phase, player_id)
+            self.possessions.append(current)
+
+        if action_type is ActionType.SERVE_RECEIVE and details.get("is_error"):
+            self._end(3 - team, "reception_error", player_id)
+        elif action_type is ActionType.SET and details.get("is_error"):
+            self._end(3 - team, "set_error", player_id)
+        elif action_type is ActionType.ATTACK:
+            current.attacker_id = player_id
+            if details.get("is_kill"):
+                current.result = "kill"
+                self._end(team, "kill", player_id)
+            elif details.get("is_error"):
+                current.result = "error"
+                self._end(3 - team, "attack_error", player_id)
+            elif details.get("is_blocked"):
+                current.result = "blocked"
+                self._end(3 - team, "blocked", player_id)
+
+    def finish(self, next_rally):
+        """Settle a rally without a deciding touch from who serves the next one in the same set"""
+        if self.winning_team is None and next_rally.serving_team is not None \
+                and next_rally.set_number == self.set_number:
+            self.winning_team = next_rally.serving_team
+            self.outcome = "next_serve"
+
+    def _end(self, winning_team, outcome, player_id):
+        self.winning_team = winning_team
+        self.outcome = outcome
+        self.ending_player_id = player_id
+
+
+def reconstruct_rallies(touches, teams):
+    """RallyRecords of one game, in order, replayed in a single pass over its touches.
+
+    touches are (stat_id, player_id, action_type, timestamp, set_number,
+    rally_number, details) tuples in (timestamp, id) order, where details
+    holds at least the TOUCH_DETAILS values (or is None); teams maps player
+    ids to 1 or 2.
+    Each rally is yielded once the next one has started, since its winner
+    may depend on who serves next.
+    """
+    rally = previous = None
+    for stat_id, player_id, action_type, timestamp, set_number, rally_number, details in touches:
+        if rally is None or rally.starts_new(action_type, set_number, rally_number):
+            previous, rally = rally, RallyRecord(stat_id, timestamp, set_number, rally_number)
+        rally.add(player_id, teams.get(player_id), action_type, timestamp, set_number, rally_number, details)
+        if previous is not None:
+            previous.finish(rally)
+            yield previous
+            previous = None
+    if rally is not None:
+        yield rally
+
+
+def rally_rows(game_id, first_seq, rallies):
+    """(rallies rows, rally_possessions rows) for RallyRecords numbered from first_seq"""
+    rows = []
+    possession_rows = []
+    for seq, rally in enumerate(rallies, start=first_seq):
+        rows.append({
+            "game_id": game_id,
+            "seq": seq,
+            "set_number": rally.set_number,
+            "rally_number": rally.rally_number,
+            "first_stat_id": rally.first_stat_id,
+            "start_timestamp": rally.start_timestamp,
+            "end_timestamp": rally.end_timestamp,
+            "touches": rally.touches,
+            "serving_team": rally.serving_team,
+            "server_id": rally.server_id,
+            "passer_id": rally.passer_id,
+            "pass_rating": rally.pass_rating,
+            "winning_team": rally.winning_team,
+            "outcome": rally.outcome,
+            "ending_player_id": rally.ending_player_id,
+            "first_ball_kill": rally.first_ball_kill,
+        })
+        for number, possession in enumerate(rally.possessions, start=1):
+            possession_rows.append({
+                "game_id": game_id,
+                "rally_seq": seq,
+                "number": number,
+                "team": possession.team,
+                "phase": possession.phase,
+                "first_contact_id": possession.first_contact_id,
+                "attacker_id": possession.attacker_id,
+                "result": possession.result,
+            })
+    return rows, possession_rows
+
+
+def teams_query(game_ids=None):
+    """Select (game_id, player_id, team) from game_participants"""
+    query = select(GameParticipant.game_id, GameParticipant.player_id, GameParticipant.team)
+    if game_ids is not None:
+        query = query.where(GameParticipant.game_id.in_(game_ids))
+    return query
+
+
+def teams_by_game(rows):
+    """game_id -> {player_id: team} from teams_query() rows"""
+    teams = {}
+    for game_id, player_id, team in rows:
+        teams.setdefault(game_id, {})[player_id] = team
+    return teams
+
+
+async def restart_point(db, game_id, key):
+    """Where to rebuild a game's rallies from after a change at key, an (epoch millis, stat id) pair.
+
+    Returns (first seq, (epoch millis, stat id) of its first stat) for the
+    rally before the one holding key, since that rally's winner may come from
+    the next serve. (1, None) means the whole game, e.g. when key is None.
+    """
+    if key is None:
+        return 1, None
+    result = await db.execute(
+        select(Rally.seq, Rally.start_timestamp, Rally.first_stat_id)
+        .where(Rally.game_id == game_id, tuple_(Rally.start_timestamp, Rally.first_stat_id) <= tuple_(*key))
+        .order_by(Rally.seq.desc())
+        .limit(2)
+    )
+    rows = result.all()
+    if not rows:
+        return 1, None
+    seq, start_timestamp, first_stat_id = rows[-1]
+    # Row-value comparisons bind their operands untyped, so compare in epoch millis
+    return seq, (epoch_millis(start_timestamp), first_stat_id)
+
+
+async def replace_rallies(db, game_id, first_seq, touches, teams):
+    """Replace a game's rallies from first_seq on with those replayed from touches, without committing"""
+    for table in (RallyPossession.__table__, Rally.__table__):
+        seq_column = table.c.rally_seq if table is RallyPossession.__table__ else table.c.seq
+        await db.execute(delete(table).where(table.c.game_id == game_id, seq_column >= first_seq))
+    rows, possession_rows = rally_rows(game_id, first_seq, reconstruct_rallies(touches, teams))
+    await insert_many(db, Rally.__table__, rows)
+    await insert_many(db, RallyPossession.__table__, possession_rows)
+
+
+async def game_rallies(db, game_id):
+    """A game's rallies in order, each with its possessions"""
+    result = await db.execute(
+        select(RallyPossession).where(RallyPossession.game_id == game_id)
+        .order_by(RallyPossession.rally_seq, RallyPossession.number)
+    )
+    possessions = {}
+    for possession in result.scalars():
+        possessions.setdefault(possession.rally_seq, []).append({
+            "team": possession.team,
+            "phase": possession.phase,
+            "first_contact_id": possession.first_contact_id,
+            "attacker_id": possession.attacker_id,
+            "result": possession.result,
+        })
+    result = await db.execute(select(Rally).where(Rally.game_id == game_id).order_by(Rally.seq))
+    return [
+        {
+            "seq": rally.seq,
+            "set_number": rally.set_number,
+            "rally_number": rally.rally_number,
+            "start": None if rally.start_timestamp is None else format_timestamp(rally.start_timestamp),
+            "end": None if rally.end_timestamp is None else format_timestamp(rally.end_timestamp),
+            "touches": rally.touches,
+            "serving_team": rally.serving_team,
+            "server_id": rally.server_id,
+            "passer_id": rally.passer_id,
+            "pass_rating": rally.pass_rating,
+            "winning_team": rally.winning_team,
+            "outcome": rally.outcome,
+            "ending_player_id": rally.ending_player_id,
+            "first_ball_kill": rally.first_ball_kill,
+            "possessions": possessions.get(rally.seq, []),
+        }
+        for rally in result.scalars()
+    ]
+
+
+def _count(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _rate(part, whole):
+    return part / whole if whole else None
+
+
+class _Totals:
+    """Counters of one player or team, folded from the grouped queries"""
+
+    def __init__(self):
+        self.serves = self.points_won = self.aces = self.service_errors = 0
+        self.pass_ratings = {}
+        self.attacks = {RECEPTION: [0, 0, 0, 0], TRANSITION: [0, 0, 0, 0]}
+
+    def add_serves(self, serves, points_won, aces, service_errors):
+        self.serves += serves
+        self.points_won += points_won
+        self.aces += aces
+        self.service_errors += service_errors
+
+    def add_receptions(self, pass_rating, receptions, side_outs, first_ball_side_outs):
+        counts = self.pass_ratings.setdefault(pass_rating, [0, 0, 0])
+        counts[0] += receptions
+        counts[1] += side_outs
+        counts[2] += first_ball_side_outs
+
+    def add_attacks(self, phase, attempts, kills, errors, blocked):
+        counts = self.attacks[phase]
+        for i, value in enumerate((attempts, kills, errors, blocked)):
+            counts[i] += value
+
+    def result(self, key):
+        receptions, side_outs, first_ball = (sum(counts[i] for counts in self.pass_ratings.values()) for i in range(3))
+        result = {
+            "key": key,
+            "serving": {
+                "serves": self.serves,
+                "points_won": self.points_won,
+                "point_rate": _rate(self.points_won, self.serves),
+                "aces": self.aces,
+                "service_errors": self.service_errors,
+            },
+            "receiving": {
+                "receptions": receptions,
+                "side_outs": side_outs,
+                "side_out_rate": _rate(side_outs, receptions),
+                "first_ball_side_outs": first_ball,
+                "first_ball_side_out_rate": _rate(first_ball, receptions),
+                # Rallies without a rated pass fall under "none"
+                "by_pass_rating": {
+                    "none" if rating is None else str(rating): {
+                        "receptions": counts[0],
+                        "side_outs": counts[1],
+                        "side_out_rate": _rate(counts[1], counts[0]),
+                    }
+                    for rating, counts in sorted(self.pass_ratings.items(), key=lambda item: (item[0] is None, item[0]))
+                },
+            },
+        }
+        for phase, (attempts, kills, errors, blocked) in self.attacks.items():
+            result[f"{'first_ball' if phase == RECEPTION else phase}_attack"] = {
+                "attempts": attempts,
+                "kills": kills,
+                "errors": errors,
+                "blocked": blocked,
+                "kill_rate": _rate(kills, attempts),
+                # Hitting efficiency: (kills - errors - blocked) / attempts
+                "efficiency": _rate(kills - errors - blocked, attempts),
+            }
+        return result
+
+
+async def rally_metrics(db, by="player", player_ids=None, game_ids=None):
+    """Serving, side-out, first-ball and transition metrics from the rallies tables.
+
+    by="player" groups by player id; by="team" groups by the pair of players
+    that made up a team, across every game they played together. A player's
+    serves are rallies they served, their receptions rallies where they took
+    the serve, and their attacks the first-ball or transition attacks they
+    hit; a team's serves and receptions are every rally it served or
+    received. Serving and receiving only count rallies with a known winner;
+    attacks count whether or not their rally was decided.
+    """
+    if by not in METRIC_GROUPS:
+        raise ValueError(f"by must be one of: {', '.join(METRIC_GROUPS)}")
+    if by == "team" and player_ids:
+        # Only the games those players took part in
+        result = await db.execute(
+            select(GameParticipant.game_id).where(GameParticipant.player_id.in_(player_ids)).distinct()
+        )
+        game_ids = [game_id for game_id in result.scalars() if game_ids is None or game_id in game_ids]
+        if not game_ids:
+            return {"by": by, "groups": []}
+
+    side_out = Rally.winning_team != Rally.serving_team
+    serving = [
+        func.count(), _count(Rally.winning_team == Rally.serving_team),
+        _count(Rally.outcome == "ace"), _count(Rally.outcome == "service_error"),
+    ]
+    receiving = [func.count(), _count(side_out), _count(side_out & (Rally.first_ball_kill == True))]
+    attacking = [
+        func.count(), _count(RallyPossession.result == "kill"), _count(RallyPossession.result == "error"),
+        _count(RallyPossession.result == "blocked"),
+    ]
+
+    def scoped(query, model, player_column=None):
+        if game_ids:
+            query = query.where(model.game_id.in_(game_ids))
+        if player_column is not None:
+            query = query.where(player_column.isnot(None))
+            if player_ids:
+                query = query.where(player_column.in_(player_ids))
+        return query
+
+    def rallies(*columns, player_column=None):
+        query = select(*columns).where(Rally.winning_team.isnot(None), Rally.serving_team.isnot(None))
+        return scoped(query, Rally, player_column)
+
+    def possessions(*columns):
+        # An attack's result is known whether or not its rally has been decided
+        return scoped(select(*columns), RallyPossession, RallyPossession.attacker_id)
+
+    totals = {}
+    if by == "player":
+        result = await db.execute(
+            rallies(Rally.server_id, *serving, player_column=Rally.server_id).group_by(Rally.server_id)
+        )
+        for player_id, *counts in result.all():
+            totals.setdefault(player_id, _Totals()).add_serves(*counts)
+        result = await db.execute(
+            rallies(Rally.passer_id, Rally.pass_rating, *receiving, player_column=Rally.passer_id)
+            .group_by(Rally.passer_id, Rally.pass_rating)
+        )
+        for player_id, pass_rating, *counts in result.all():
+            totals.setdefault(player_id, _Totals()).add_receptions(pass_rating, *counts)
+        result = await db.execute(
+            possessions(RallyPossession.attacker_id, RallyPossession.phase, *attacking)
+            .group_by(RallyPossession.attacker_id, RallyPossession.phase)
+        )
+        for player_id, phase, *counts in result.all():
+            totals.setdefault(player_id, _Totals()).add_attacks(phase, *counts)
+        return {"by": by, "groups": [totals[player_id].result(player_id) for player_id in sorted(totals)]}
+
+    # Count per game and team, then fold each game's team into its pair of players
+    result = await db.execute(teams_query(game_ids))
+    players = {}
+    for game_id, player_id, team in result.all():
+        players.setdefault((game_id, team), []).append(player_id)
+    pairs = {key: tuple(sorted(team_players)) for key, team_players in players.items()}
+
+    def team_totals(game_id, team):
+        pair = pairs.get((game_id, team))
+        return _Totals() if pair is None else totals.setdefault(pair, _Totals())
+
+    result = await db.execute(
+        rallies(Rally.game_id, Rally.serving_team, *serving).group_by(Rally.game_id, Rally.serving_team)
+    )
+    for game_id, team, *counts in result.all():
+        team_totals(game_id, team).add_serves(*counts)
+    result = await db.execute(
+        rallies(Rally.game_id, 3 - Rally.serving_team, Rally.pass_rating, *receiving)
+        .group_by(Rally.game_id, Rally.serving_team, Rally.pass_rating)
+    )
+    for game_id, team, pass_rating, *counts in result.all():
+        team_totals(game_id, team).add_receptions(pass_rating, *counts)
+    result = await db.execute(
+        possessions(RallyPossession.game_id, RallyPossession.team, RallyPossession.phase, *attacking)
+        .group_by(RallyPossession.game_id, RallyPossession.team, RallyPossession.phase)
+    )
+    for game_id, team, phase, *counts in result.all():
+        team_totals(game_id, team).add_attacks(phase, *counts)
+
+    if player_ids:
+        totals = {pair: counts for pair, counts in totals.items() if set(pair) & set(player_ids)}
+    return {"by": by, "groups": [totals[pair].result(list(pair)) for pair in sorted(totals)]}
@@ -0,0 +1,64 @@
+"""Incrementally maintained stat rollups behind the stat cube (see app/cube.py).
+
+Every stat is counted once in stat_rollups under its action type, player,
+game and detail key, and once in stat_day_rollups with the game's date in
+place of the game. The detail key is the stat's compact_stats encoding
+(flags, code1, code2, serve_target), so one rollup row stands for all stats
+with exactly those details and any detail can be grouped or filtered on
+later. Like the aggregates, counts move by +1/-1 inside the same transaction
+as the write.
+"""
+from collections import Counter
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .database import insert_many
+from .models import Game, StatDayRollup, StatRollup
+
+# Detail key columns shared by both grains
+DETAIL_KEY_COLUMNS = ("flags", "code1", "code2", "serve_target")
+
+# Rollup model -> its primary key columns, in the order count_rollups builds keys
+ROLLUP_KEYS = {
+    StatRollup: ("action_type", "player_id", "game_id") + DETAIL_KEY_COLUMNS,
+    StatDayRollup: ("action_type", "player_id", "day") + DETAIL_KEY_COLUMNS,
+}
+
+
+def detail_key(row):
+    """(flags, code1, code2, serve_target) of a compact_stats row dict, with 0 and "" for missing values"""
+    return (row["flags"], row["code1"] or 0, row["code2"] or 0, row["serve_target"] or "")
+
+
+def count_rollups(stats, game_dates):
+    """Counters keyed like ROLLUP_KEYS for (player_id, game_id, action_type, detail_key) tuples"""
+    counts = {StatRollup: Counter(), StatDayRollup: Counter()}
+    for player_id, game_id, action_type, key in stats:
+        counts[StatRollup][(action_type, player_id, game_id) + key] += 1
+        counts[StatDayRollup][(action_type, player_id, game_dates[game_id]) + key] += 1
+    return counts
+
+
+async def apply_rollup_deltas(db, stats, sign=1):
+    """Add (sign=1) or remove (sign=-1) (player_id, game_id, action_type, detail_key) stats from both rollups"""
+    game_ids = {game_id for _, game_id, _, _ in stats}
+    if not game_ids:
+        return
+    result = await db.execute(select(Game.id, Game.date).where(Game.id.in_(game_ids)))
+    counts = count_rollups(stats, dict(result.all()))
+    for model, model_counts in counts.items():
+        table = model.__table__
+        names = ROLLUP_KEYS[model]
+        upsert = sqlite_insert(table)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c[name] for name in names],
+            set_={"count": table.c.count + upsert.excluded.count}
+        )
+        await insert_many(db, table, [
+            dict(zip(names, key), count=sign * count) for key, count in model_counts.items()
+        ], statement=upsert)
+        if sign < 0:
+            # The grain column, game_id or day, is third in every key
+            grain = table.c[names[2]]
+            await db.execute(delete(table).where(grain.in_({key[2] for key in model_counts}), table.c.count <= 0))
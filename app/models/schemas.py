@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional, List, Union
-from datetime import date
+from typing import Optional, List, Literal, Union
+from datetime import date, datetime
 from enum import Enum
 
 # Enum definitions to match SQLAlchemy models
@@ -78,13 +78,17 @@ class BaseStatBase(BaseModel):
     game_id: int
     player_id: int
     action_type: ActionType
-    timestamp: str  # ISO datetime string
+    timestamp: datetime  # ISO 8601; times without an offset are server local time
+    set_number: Optional[int] = None
+    rally_number: Optional[int] = None
 
 class BaseStatCreate(BaseStatBase):
     pass
 
 class BaseStat(BaseStatBase):
     id: int
+    # Legacy rows whose timestamp could not be parsed have none
+    timestamp: Optional[datetime] = None
     player_name: Optional[str] = None
     
     class Config:
@@ -106,6 +110,8 @@ class ServeStat(ServeStatBase):
     
     class Config:
         orm_mode = True
+        # Reject other detail types' fields so StatResponse.details picks the right model
+        extra = "forbid"
 
 # Receive Stats
 class ReceiveStatBase(BaseModel):
@@ -121,6 +127,7 @@ class ReceiveStat(ReceiveStatBase):
     
     class Config:
         orm_mode = True
+        extra = "forbid"
 
 # Attack Stats
 class AttackStatBase(BaseModel):
@@ -138,6 +145,7 @@ class AttackStat(AttackStatBase):
     
     class Config:
         orm_mode = True
+        extra = "forbid"
 
 # Block Stats
 class BlockStatBase(BaseModel):
@@ -152,6 +160,7 @@ class BlockStat(BlockStatBase):
     
     class Config:
         orm_mode = True
+        extra = "forbid"
 
 # Dig Stats
 class DigStatBase(BaseModel):
@@ -167,6 +176,7 @@ class DigStat(DigStatBase):
     
     class Config:
         orm_mode = True
+        extra = "forbid"
 
 # Set Stats
 class SetStatBase(BaseModel):
@@ -182,6 +192,7 @@ class SetStat(SetStatBase):
     
     class Config:
         orm_mode = True
+        extra = "forbid"
 
 # Combined Stat Response Model
 class StatResponse(BaseModel):
@@ -245,3 +256,20 @@ class CreateStatRequest(BaseModel):
     block_stat: Optional[BlockStatCreate] = None
     dig_stat: Optional[DigStatCreate] = None
     set_stat: Optional[SetStatCreate] = None
+
+# Background jobs
+class CreateJobRequest(BaseModel):
+    kind: str
+    params: dict = {}
+
+class ExportJobParams(BaseModel):
+    format: Literal["csv", "ndjson"] = "csv"
+    game_id: List[int] = []
+    player_id: List[int] = []
+    action_type: Optional[ActionType] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+class SeasonReportJobParams(BaseModel):
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
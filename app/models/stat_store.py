@@ -0,0 +1,970 @@
+"""Shared read/write helpers for stats, whichever layout stores them.
+
+BVB_STAT_STORAGE picks the layout: "normalized" keeps base_stats plus one
+detail table per action type, "compact" keeps a single compact_stats row per
+stat with the boolean details packed into a bitfield and the enum details as
+small-int codes. Routers only go through the helpers below and ``stat_table``,
+whose BASE_COLUMNS exist in both.
+"""
+import enum
+import heapq
+import json
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import Boolean, Column, Enum, Integer, MetaData, Table, and_, case, delete, func, insert, literal, null
+from sqlalchemy import select, tuple_, type_coerce
+
+from .config import STAT_STORAGE, VALIDATE_RESPONSES
+from .models import BaseStat, CompactStat, ActionType, PlayerGameAggregate, StatChange, enum_code, enum_member
+from .models import Game, Rally, RallyPossession, StatDayRollup, StatRollup, epoch_millis, format_timestamp
+from .aggregates import apply_stat_deltas, count_metrics
+from .rollups import DETAIL_KEY_COLUMNS, apply_rollup_deltas, detail_key
+from .rallies import TOUCH_DETAILS, rally_rows, reconstruct_rallies, replace_rallies, restart_point
+from .rallies import teams_by_game, teams_query
+from .database import insert_many
+from .models import ServeStat, ReceiveStat, AttackStat, BlockStat, DigStat, SetStat
+from .schemas import StatResponse
+
+# Columns shared by both layouts; every stats_query() row starts with these, in this order
+BASE_COLUMNS = ("id", "game_id", "player_id", "action_type", "timestamp", "set_number", "rally_number")
+
+# Base columns of encoded_stats_query() rows, which then carry flags, code1, code2 and serve_target
+ENCODED_BASE_COLUMNS = ("id", "game_id", "player_id", "set_number", "rally_number")
+
+# Stats between progress callbacks of the full rebuilds
+PROGRESS_EVERY = 10000
+
+# Detail table for each action type
+DETAIL_MODELS = {
+    ActionType.SERVING: ServeStat,
+    ActionType.SERVE_RECEIVE: ReceiveStat,
+    ActionType.ATTACK: AttackStat,
+    ActionType.BLOCK: BlockStat,
+    ActionType.DIG: DigStat,
+    ActionType.SET: SetStat,
+}
+DETAIL_ACTIONS = {model.__table__: action_type for action_type, model in DETAIL_MODELS.items()}
+
+# CreateStatRequest field carrying the details for each action type
+DETAIL_FIELDS = {
+    ActionType.SERVING: "serve_stat",
+    ActionType.SERVE_RECEIVE: "receive_stat",
+    ActionType.ATTACK: "attack_stat",
+    ActionType.BLOCK: "block_stat",
+    ActionType.DIG: "dig_stat",
+    ActionType.SET: "set_stat",
+}
+
+
+def _touch_base_columns(table):
+    # Timestamps stay epoch millis: the replay only orders by them and stores them again
+    return [
+        type_coerce(table.c.timestamp, Integer).label("timestamp") if name == "timestamp" else table.c[name]
+        for name in BASE_COLUMNS
+    ]
+
+
+class NormalizedStatStore:
+    """base_stats plus one detail table per action type"""
+    name = "normalized"
+    table = BaseStat.__table__
+    tables = [BaseStat.__table__] + [model.__table__ for model in DETAIL_MODELS.values()]
+
+    def __init__(self):
+        # Column layout of the flattened stats query: the base columns followed by every
+        # detail table's columns (stat_id first), so each row carries its own details
+        self.columns = [self.table.c[name] for name in BASE_COLUMNS]
+        self.detail_offsets = {}
+        for action_type, model in DETAIL_MODELS.items():
+            self.detail_offsets[action_type] = (len(self.columns), [column.name for column in model.__table__.columns])
+            self.columns.extend(model.__table__.columns)
+        # Narrower layout for rally replay: the base columns and only the details it reads
+        self.touch_columns = _touch_base_columns(self.table)
+        self.touch_offsets = {}
+        for action_type, names in TOUCH_DETAILS.items():
+            self.touch_offsets[action_type] = (len(self.touch_columns), names)
+            self.touch_columns.extend(DETAIL_MODELS[action_type].__table__.c[name] for name in names)
+
+    def stats_query(self):
+        """Select base stats outer-joined to all six detail tables in one statement"""
+        return self.join_details(select(*self.columns))
+
+    def join_details(self, query, models=None):
+        """Outer-join detail tables onto a query over base_stats"""
+        for model in models or DETAIL_MODELS.values():
+            query = query.outerjoin(model, model.stat_id == BaseStat.id)
+        return query
+
+    def touches_query(self):
+        return self.join_details(select(*self.touch_columns))
+
+    def touch(self, row):
+        offset, names = self.touch_offsets[row[3]]
+        return (row[0], row[2], row[3], row[4], row[5], row[6], {name: row[offset + i] for i, name in enumerate(names)})
+
+    def row_details(self, row):
+        offset, names = self.detail_offsets[row[3]]
+        # stat_id is NULL when the stat was logged without details
+        if row[offset] is None:
+            return None
+        return {name: row[offset + i] for i, name in enumerate(names)}
+
+    def flag(self, column):
+        # Outer-joined detail columns are NULL on other action types
+        return column == True
+
+    def equals(self, column, member):
+        return column == member
+
+    def stat_row(self, base_row, action_type, values):
+        return base_row
+
+    def detail_rows(self, stat_id, action_type, values):
+        if values is None:
+            return []
+        model = DETAIL_MODELS[action_type]
+        return [(model.__table__, dict(values, stat_id=stat_id))]
+
+    def _encoded_details(self, action_type, flags):
+        """compact_stats flags, codes and serve_target computed in SQL from an action type's detail table"""
+        model = DETAIL_MODELS[action_type]
+        codes = {name: null() for name in COMPACT_CODE_COLUMNS}
+        serve_target = null()
+        for name, (kind, slot) in COMPACT_LAYOUTS[action_type].items():
+            column = model.__table__.c[name]
+            if kind == "flag":
+                flags = flags + case((self.flag(column), slot), else_=0)
+            elif kind == "code":
+                codes[slot] = case(*((column == member, enum_code(member)) for member in column.type.enum_class))
+            else:
+                serve_target = column
+        return flags, list(codes.values()), serve_target
+
+    def encoded_detail_queries(self):
+        # One scan per detail table, computing the compact_stats encoding in SQL
+        queries = []
+        for action_type, model in DETAIL_MODELS.items():
+            flags, codes, _ = self._encoded_details(action_type, literal(DETAILS_PRESENT))
+            queries.append(select(model.stat_id, flags, *codes))
+        return queries
+
+    def encoded_stats_query(self, action_type):
+        model = DETAIL_MODELS[action_type]
+        # Outer-joined, so the details-present bit is only set where a detail row exists
+        present = case((model.stat_id.is_not(None), DETAILS_PRESENT), else_=0)
+        flags, codes, serve_target = self._encoded_details(action_type, present)
+        return (
+            select(*(self.table.c[name] for name in ENCODED_BASE_COLUMNS),
+                   flags.label("flags"), codes[0].label("code1"), codes[1].label("code2"),
+                   serve_target.label("serve_target"))
+            .outerjoin(model, model.stat_id == BaseStat.id)
+            .where(self.table.c.action_type == action_type)
+        )
+
+    def delete_statements(self, stat_id, action_type):
+        model = DETAIL_MODELS[action_type]
+        return [
+            delete(model.__table__).where(model.stat_id == stat_id),
+            delete(BaseStat.__table__).where(BaseStat.id == stat_id),
+        ]
+
+
+# Set in compact_stats.flags whenever the stat was logged with details
+DETAILS_PRESENT = 0x80
+COMPACT_CODE_COLUMNS = ("code1", "code2")
+
+# Where each detail lives in a compact_stats row, per action type and in detail
+# table column order: ("flag", bit) for booleans, ("code", column) for enums
+# and ("text", column) for plain strings
+COMPACT_LAYOUTS = {}
+for _action_type, _model in DETAIL_MODELS.items():
+    _layout = COMPACT_LAYOUTS[_action_type] = {}
+    _bits = _codes = 0
+    for _column in _model.__table__.columns:
+        if _column.name == "stat_id":
+            continue
+        if isinstance(_column.type, Boolean):
+            _layout[_column.name] = ("flag", 1 << _bits)
+            _bits += 1
+        elif isinstance(_column.type, Enum):
+            _layout[_column.name] = ("code", COMPACT_CODE_COLUMNS[_codes])
+            _codes += 1
+        else:
+            _layout[_column.name] = ("text", _column.name)
+
+
+class CompactStatStore:
+    """One compact_stats row per stat; see COMPACT_LAYOUTS for the encoding"""
+    name = "compact"
+    table = CompactStat.__table__
+    tables = [CompactStat.__table__]
+
+    def __init__(self):
+        self.columns = [
+            self.table.c[name] for name in BASE_COLUMNS + ("flags", "code1", "code2", "serve_target")
+        ]
+        self.positions = {column.name: i for i, column in enumerate(self.columns)}
+
+    def stats_query(self):
+        return select(*self.columns)
+
+    def join_details(self, query, models=None):
+        # Details are already on the row
+        return query
+
+    def touches_query(self):
+        return select(*_touch_base_columns(self.table), *self.columns[len(BASE_COLUMNS):])
+
+    def touch(self, row):
+        return (row[0], row[2], row[3], row[4], row[5], row[6], self.row_details(row))
+
+    def row_details(self, row):
+        flags = row[self.positions["flags"]]
+        if not flags & DETAILS_PRESENT:
+            return None
+        details = {"stat_id": row[0]}
+        for name, (kind, slot) in COMPACT_LAYOUTS[row[3]].items():
+            if kind == "flag":
+                details[name] = bool(flags & slot)
+            elif kind == "code":
+                code = row[self.positions[slot]]
+                enum_class = DETAIL_MODELS[row[3]].__table__.c[name].type.enum_class
+                details[name] = None if code is None else enum_member(enum_class, code)
+            else:
+                details[name] = row[self.positions[slot]]
+        return details
+
+    def _slot(self, column):
+        action_type = DETAIL_ACTIONS[column.table]
+        return action_type, COMPACT_LAYOUTS[action_type][column.name][1]
+
+    def flag(self, column):
+        action_type, bit = self._slot(column)
+        return and_(CompactStat.action_type == action_type, CompactStat.flags.op("&")(bit) != 0)
+
+    def equals(self, column, member):
+        action_type, code_column = self._slot(column)
+        return and_(CompactStat.action_type == action_type, self.table.c[code_column] == enum_code(member))
+
+    def stat_row(self, base_row, action_type, values):
+        row = dict(base_row, flags=0, code1=None, code2=None, serve_target=None)
+        if values is None:
+            return row
+        row["flags"] = DETAILS_PRESENT
+        for name, (kind, slot) in COMPACT_LAYOUTS[action_type].items():
+            value = values.get(name)
+            if kind == "flag":
+                if value:
+                    row["flags"] |= slot
+            elif kind == "code":
+                row[slot] = None if value is None else enum_code(value)
+            else:
+                row[slot] = value
+        return row
+
+    def encoded_detail_queries(self):
+        return [
+            select(CompactStat.id, CompactStat.flags, CompactStat.code1, CompactStat.code2)
+            .where(CompactStat.flags != 0)
+        ]
+
+    def encoded_stats_query(self, action_type):
+        return (
+            select(*(self.table.c[name] for name in ENCODED_BASE_COLUMNS + ("flags", "code1", "code2", "serve_target")))
+            .where(self.table.c.action_type == action_type)
+        )
+
+    def detail_rows(self, stat_id, action_type, values):
+        return []
+
+    def delete_statements(self, stat_id, action_type):
+        return [delete(CompactStat.__table__).where(CompactStat.id == stat_id)]
+
+
+STAT_STORES = {store.name: store for store in (NormalizedStatStore(), CompactStatStore())}
+store = STAT_STORES[STAT_STORAGE]
+
+# Table holding one row per stat in the configured layout
+stat_table = store.table
+
+
+def stats_query():
+    """Select stats with their details, one row per stat, in the configured layout"""
+    return store.stats_query()
+
+
+def touches_query():
+    """Select stats as rally engine touches (see stat_touch), narrower than stats_query()"""
+    return store.touches_query()
+
+
+def stat_touch(row):
+    """(stat_id, player_id, action_type, timestamp, set_number, rally_number, details) for a touches_query() row"""
+    return store.touch(row)
+
+
+def encoded_detail_queries():
+    """Selects of (stat_id, flags, code1, code2) covering every stat with details, whatever the layout.
+
+    Flags and codes use the compact_stats encoding described by COMPACT_LAYOUTS;
+    stats missing from every result have no details. Each query scans one
+    table, so they are cheap to run over the whole database.
+    """
+    return store.encoded_detail_queries()
+
+
+def encoded_stats_query(action_type):
+    """Select one action type's stats as ENCODED_BASE_COLUMNS plus compact_stats flags, codes and serve_target.
+
+    The same encoding whatever the layout, computed in SQL for the normalized
+    one; codes and serve_target are NULL where the detail was not recorded.
+    """
+    return store.encoded_stats_query(action_type)
+
+
+def join_details(query, models=None):
+    """Make detail columns of ``models`` (default: all) usable in a query over stat_table"""
+    return store.join_details(query, models)
+
+
+def detail_flag(column):
+    """SQL condition that a boolean detail column, e.g. AttackStat.is_kill, is set"""
+    return store.flag(column)
+
+
+def detail_equals(column, member):
+    """SQL condition that an enum detail column, e.g. AttackStat.attack_direction, equals member"""
+    return store.equals(column, member)
+
+
+def row_details(row):
+    """Detail values of a stats_query() row with model enums, or None if the stat has no details"""
+    return store.row_details(row)
+
+
+def serialize_stat_row(row):
+    """Build a StatResponse-shaped dict from one row of stats_query()"""
+    action_type = row[3]
+    timestamp = row[4]
+    stat_response = {
+        "base": {
+            "id": row[0],
+            "game_id": row[1],
+            "player_id": row[2],
+            "action_type": action_type.value,
+            "timestamp": None if timestamp is None else format_timestamp(timestamp),
+            "set_number": row[5],
+            "rally_number": row[6],
+            "player_name": None
+        },
+        "details": None
+    }
+    details = row_details(row)
+    if details is not None:
+        stat_response["details"] = {
+            name: value.value if isinstance(value, enum.Enum) else value
+            for name, value in details.items()
+        }
+    return stat_response
+
+
+def _json_value(value):
+    if isinstance(value, enum.Enum):
+        value = value.value
+    elif isinstance(value, datetime):
+        value = format_timestamp(value)
+    return json.dumps(value)
+
+
+def _detail_encoder(model):
+    """Build a details-dict -> JSON text function for one detail table, once"""
+    fields = []
+    for column in model.__table__.columns:
+        enum_class = getattr(column.type, "enum_class", None)
+        if enum_class is not None:
+            # Pre-rendered JSON for every member, so encoding is a dict lookup
+            literals = {member: json.dumps(member.value) for member in enum_class}
+            literals[None] = "null"
+            encode = literals.__getitem__
+        elif isinstance(column.type, Boolean):
+            encode = {True: "true", False: "false", None: "null", 1: "true", 0: "false"}.__getitem__
+        else:
+            encode = _json_value
+        fields.append((f'{json.dumps(column.name)}:', column.name, encode))
+
+    def encode_details(details):
+        return "{" + ",".join(prefix + encode(details[name]) for prefix, name, encode in fields) + "}"
+    return encode_details
+
+
+DETAIL_ENCODERS = {action_type: _detail_encoder(model) for action_type, model in DETAIL_MODELS.items()}
+ACTION_TYPE_JSON = {action_type: json.dumps(action_type.value) for action_type in ActionType}
+
+_stat_response_adapter = TypeAdapter(StatResponse)
+_stat_response_list_adapter = TypeAdapter(List[StatResponse])
+
+
+def _encode_stat_row(row):
+    details = row_details(row)
+    return (
+        f'{{"base":{{"id":{row[0]},"game_id":{row[1]},"player_id":{row[2]},'
+        f'"action_type":{ACTION_TYPE_JSON[row[3]]},"timestamp":{_json_value(row[4])},'
+        f'"set_number":{_json_value(row[5])},"rally_number":{_json_value(row[6])},"player_name":null}},'
+        f'"details":{"null" if details is None else DETAIL_ENCODERS[row[3]](details)}}}'
+    )
+
+
+def encode_stat_row(row):
+    """StatResponse JSON bytes for one stats_query() row, without building intermediate dicts.
+
+    The output is trusted and not re-validated unless BVB_VALIDATE_RESPONSES=1.
+    """
+    body = _encode_stat_row(row).encode()
+    if VALIDATE_RESPONSES:
+        _stat_response_adapter.validate_json(body)
+    return body
+
+
+def encode_stat_rows(rows):
+    """JSON array bytes of StatResponses for stats_query() rows"""
+    body = ("[" + ",".join(_encode_stat_row(row) for row in rows) + "]").encode()
+    if VALIDATE_RESPONSES:
+        _stat_response_list_adapter.validate_json(body)
+    return body
+
+
+def detail_values(model, detail_data):
+    """Column values for a detail row, with schema enums mapped onto the model's enums"""
+    values = {}
+    for key, value in detail_data.dict().items():
+        if isinstance(value, enum.Enum):
+            value = model.__table__.c[key].type.enum_class(value.value)
+        values[key] = value
+    return values
+
+
+async def insert_stats(db, game_id, stat_requests, timestamp=None):
+    """Bulk insert CreateStatRequests in the configured layout.
+
+    Issues one multi-row INSERT for the stat rows and, for the normalized
+    layout, one per detail table that is present, bumps the player/game
+    aggregates and appends to the change log, without committing. Each stat
+    keeps its own client timestamp unless ``timestamp`` is given. Returns the
+    new stat ids in request order.
+    """
+    stats = []
+    for stat_request in stat_requests:
+        base_stat_data = stat_request.base_stat
+        action_type = ActionType(base_stat_data.action_type.value)
+        detail_data = getattr(stat_request, DETAIL_FIELDS[action_type])
+        values = None
+        if detail_data is not None:
+            values = detail_values(DETAIL_MODELS[action_type], detail_data)
+        base_row = {
+            "game_id": game_id,
+            "player_id": base_stat_data.player_id,
+            "action_type": action_type,
+            "timestamp": timestamp if timestamp is not None else base_stat_data.timestamp,
+            "set_number": base_stat_data.set_number,
+            "rally_number": base_stat_data.rally_number,
+        }
+        stats.append((base_row, action_type, values))
+    return await insert_stat_rows(db, stats)
+
+
+async def insert_stat_rows(db, stats, deferred=False):
+    """Bulk insert (base_row, action_type, values) stats, the core of insert_stats.
+
+    base_row holds every BASE_COLUMNS value except id, and values the detail
+    column values with model enums (None for a stat without details). Stats
+    may belong to different games. Returns the new stat ids in order.
+
+    ``deferred=True`` only bumps the aggregates, leaving the rollups, rallies
+    and change log of these stats to a later finish_games() call. That is for
+    bulk loads into games nobody reads yet, where rebuilding those once is
+    cheaper than keeping them current row by row.
+    """
+    if not stats:
+        return []
+    rows = [store.stat_row(base_row, action_type, values) for base_row, action_type, values in stats]
+
+    # Inserting the first row takes SQLite's write lock for the rest of the
+    # transaction, so the following ids are ours to assign explicitly. This keeps
+    # the remaining rows in one executemany instead of one RETURNING per row.
+    result = await db.execute(insert(stat_table).returning(stat_table.c.id), rows[0])
+    first_id = result.scalar_one()
+    stat_ids = list(range(first_id, first_id + len(rows)))
+    if len(rows) > 1:
+        for stat_id, row in zip(stat_ids[1:], rows[1:]):
+            row["id"] = stat_id
+        await insert_many(db, stat_table, rows[1:])
+
+    # Group detail rows by table so each table gets a single executemany
+    for table, table_rows in _detail_rows_by_table(zip(stat_ids, stats)).items():
+        await insert_many(db, table, table_rows)
+
+    await apply_stat_deltas(db, [
+        (base_row["player_id"], base_row["game_id"], action_type, values) for base_row, action_type, values in stats
+    ], sign=1)
+    if deferred:
+        return stat_ids
+    await apply_rollup_deltas(db, [
+        (base_row["player_id"], base_row["game_id"], action_type, _detail_key(action_type, values))
+        for base_row, action_type, values in stats
+    ], sign=1)
+    await insert_many(db, StatChange.__table__, [
+        {"game_id": base_row["game_id"], "stat_id": stat_id, "op": "insert"}
+        for stat_id, (base_row, _, _) in zip(stat_ids, stats)
+    ])
+    await update_rallies(db, inserted=[
+        (base_row["game_id"], (
+            stat_id, base_row["player_id"], action_type, base_row["timestamp"],
+            base_row["set_number"], base_row["rally_number"], values,
+        ))
+        for stat_id, (base_row, action_type, values) in zip(stat_ids, stats)
+    ])
+
+    return stat_ids
+
+
+
+def _detail_key(action_type, values):
+    """Rollup detail key of a stat: its compact_stats encoding, whatever the configured layout"""
+    return detail_key(STAT_STORES["compact"].stat_row({}, action_type, values))
+
+
+def _detail_rows_by_table(stats, target=None):
+    """Detail rows for (stat_id, (base_row, action_type, values)) pairs, grouped by table"""
+    target = target or store
+    detail_rows = {}
+    for stat_id, (base_row, action_type, values) in stats:
+        for table, row in target.detail_rows(stat_id, action_type, values):
+            detail_rows.setdefault(table, []).append(row)
+    return detail_rows
+
+
+async def delete_stat(db, game_id, stat_id):
+    """Delete one stat and its details, remove it from the aggregates and log a tombstone, without committing.
+
+    Returns the deleted stat's stats_query() row, or None if it does not exist.
+    """
+    result = await db.execute(
+        stats_query().where(stat_table.c.game_id == game_id, stat_table.c.id == stat_id)
+    )
+    row = result.first()
+    if row is None:
+        return None
+
+    action_type = row[3]
+    for statement in store.delete_statements(stat_id, action_type):
+        await db.execute(statement)
+    details = row_details(row)
+    await apply_stat_deltas(db, [(row[2], game_id, action_type, details)], sign=-1)
+    await apply_rollup_deltas(db, [(row[2], game_id, action_type, _detail_key(action_type, details))], sign=-1)
+    await db.execute(insert(StatChange.__table__).values(game_id=game_id, stat_id=stat_id, op="delete"))
+    await update_rallies(db, deleted=[(game_id, row[4], stat_id)])
+    return row
+
+
+def _touch_key(touch):
+    # (timestamp, id) order with missing timestamps first, as SQLite sorts them
+    millis = epoch_millis(touch[3])
+    return (float("-inf") if millis is None else millis, touch[0])
+
+
+async def update_rallies(db, deleted=(), inserted=()):
+    """Rebuild the rallies of each changed game from just before its earliest change, without committing.
+
+    deleted are (game_id, timestamp, stat_id) of deleted stats. inserted are
+    (game_id, touch) pairs for stats just inserted with ids above every
+    existing one, as insert_stat_rows assigns them; they are replayed from
+    memory instead of read back. A live game only appends, so this re-reads
+    its last rally or two.
+    """
+    earliest = {}
+    new_touches = {}
+    for game_id, touch in inserted:
+        new_touches.setdefault(game_id, []).append(touch)
+    changes = [(game_id, _touch_key(touch)) for game_id, touch in inserted]
+    changes += [(game_id, _touch_key((stat_id, None, None, timestamp))) for game_id, timestamp, stat_id in deleted]
+    for game_id, key in changes:
+        if game_id not in earliest or key < earliest[game_id]:
+            earliest[game_id] = key
+    if not earliest:
+        return
+    first_new_id = min((touch[0] for _, touch in inserted), default=None)
+    result = await db.execute(teams_query(list(earliest)))
+    teams = teams_by_game(result.all())
+    for game_id, key in earliest.items():
+        # Stats without a timestamp come first, so a change among them means the whole game
+        first_seq, start = await restart_point(db, game_id, None if key[0] == float("-inf") else key)
+        query = (
+            touches_query()
+            .where(stat_table.c.game_id == game_id)
+            .order_by(stat_table.c.timestamp, stat_table.c.id)
+        )
+        if start is not None:
+            query = query.where(tuple_(stat_table.c.timestamp, stat_table.c.id) >= tuple_(*start))
+        if first_new_id is not None:
+            query = query.where(stat_table.c.id < first_new_id)
+        result = await db.execute(query)
+        touches = [stat_touch(row) for row in result.all()]
+        if game_id in new_touches:
+            touches = heapq.merge(touches, sorted(new_touches[game_id], key=_touch_key), key=_touch_key)
+        await replace_rallies(db, game_id, first_seq, touches, teams.get(game_id, {}))
+
+
+async def latest_change_seq(db, game_id=None):
+    """Newest change sequence number for a game (or all games), 0 if nothing was ever logged"""
+    query = select(func.max(StatChange.seq))
+    if game_id is not None:
+        query = query.where(StatChange.game_id == game_id)
+    result = await db.execute(query)
+    return result.scalar() or 0
+
+
+async def net_stat_changes(db, since, game_id=None):
+    """Collapse the change log after seq ``since`` into each stat's final state.
+
+    Covers one game, or every game when ``game_id`` is None. Returns
+    (cursor, inserted_ids, deleted_ids) where cursor is the newest seq seen.
+    """
+    query = select(StatChange.seq, StatChange.stat_id, StatChange.op).where(StatChange.seq > since)
+    if game_id is not None:
+        query = query.where(StatChange.game_id == game_id)
+    result = await db.execute(query.order_by(StatChange.seq))
+    cursor = since
+    last_op = {}
+    for seq, stat_id, op in result.all():
+        cursor = seq
+        last_op[stat_id] = op
+    inserted_ids = [stat_id for stat_id, op in last_op.items() if op == "insert"]
+    deleted_ids = [stat_id for stat_id, op in last_op.items() if op == "delete"]
+    return cursor, inserted_ids, deleted_ids
+
+
+async def stat_changes_since(db, game_id, since):
+    """Net changes to a game's stats after change sequence ``since``.
+
+    Returns (cursor, rows, deleted_ids): stats_query() rows for stats inserted
+    and still present, ids of stats deleted since, and the newest seq seen.
+    """
+    cursor, inserted_ids, deleted_ids = await net_stat_changes(db, since, game_id)
+    rows = []
+    if inserted_ids:
+        result = await db.execute(
+            stats_query().where(stat_table.c.id.in_(inserted_ids)).order_by(stat_table.c.id)
+        )
+        rows = result.all()
+    return cursor, rows, deleted_ids
+
+
+def _stat_count(conn, source):
+    return conn.execute(select(func.count()).select_from(source.table)).scalar()
+
+
+def _with_progress(rows, progress, total, every=PROGRESS_EVERY):
+    done = 0
+    for done, row in enumerate(rows, start=1):
+        if done % every == 0:
+            progress(done, total)
+        yield row
+    progress(done, total)
+
+
+def rebuild_aggregates(conn, source=None, progress=None):
+    """Recompute player_game_aggregates from raw stats on a sync connection.
+
+    Reads the configured layout unless another ``source`` store is given.
+    Returns the (player_id, game_id, metric) keys whose stored count disagreed
+    with the recomputed one, then replaces the table contents with the
+    recomputed counts. ``progress``, if given, is called with (stats read,
+    total stats) along the way; an exception from it aborts the rebuild.
+    """
+    source = source or store
+    rows = conn.execute(source.stats_query())
+    if progress is not None:
+        rows = _with_progress(rows, progress, _stat_count(conn, source))
+    recomputed = count_metrics((row[2], row[1], row[3], source.row_details(row)) for row in rows)
+    table = PlayerGameAggregate.__table__
+    stored = {
+        (player_id, game_id, metric): count
+        for player_id, game_id, metric, count in conn.execute(
+            select(table.c.player_id, table.c.game_id, table.c.metric, table.c.count)
+        )
+    }
+    mismatches = sorted(
+        key for key in set(recomputed) | set(stored)
+        if recomputed.get(key, 0) != stored.get(key, 0)
+    )
+
+    conn.execute(delete(table))
+    if recomputed:
+        conn.execute(insert(table), [
+            {"player_id": player_id, "game_id": game_id, "metric": metric, "count": count}
+            for (player_id, game_id, metric), count in recomputed.items()
+        ])
+    return mismatches
+
+
+def _staging_table(conn, table):
+    """An empty TEMP table with the columns of ``table``, private to this connection"""
+    name = f"rebuild_{table.name}"
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS temp.{name}")
+    staging = Table(name, MetaData(), *(Column(column.name, column.type) for column in table.columns),
+                    prefixes=["TEMPORARY"])
+    staging.create(conn)
+    return staging
+
+
+def rebuild_online(engine, tables, fill, refill):
+    """Rebuild derived ``tables`` while stats keep being written, for background jobs.
+
+    ``fill(conn, targets)`` computes every row into TEMP copies of the tables
+    (``targets`` maps each table to its copy). That only reads the live
+    tables, so SQLite's write lock stays free meanwhile. A short write
+    transaction then swaps the copies in and calls ``refill(conn, game_ids)``
+    for the games whose stats changed after the fill started. Both steps
+    share one connection, as TEMP tables are private to it. Returns what
+    ``fill`` returned.
+    """
+    with engine.connect() as conn:
+        targets = {}
+        try:
+            with conn.begin():
+                since = conn.execute(select(func.max(StatChange.seq))).scalar() or 0
+                for table in tables:
+                    targets[table] = _staging_table(conn, table)
+                result = fill(conn, targets)
+            with conn.begin():
+                # Writing first takes the write lock before the change log is read
+                for table, staging in targets.items():
+                    conn.execute(delete(table))
+                    conn.execute(insert(table).from_select([column.name for column in staging.columns], select(staging)))
+                game_ids = conn.execute(
+                    select(StatChange.game_id).where(StatChange.seq > since).distinct()
+                ).scalars().all()
+                if game_ids:
+                    refill(conn, game_ids)
+        finally:
+            for staging in targets.values():
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS temp.{staging.name}")
+            conn.commit()
+    return result
+
+
+def _fill_rollups(conn, source, games, days, game_ids=None, progress=None):
+    # Game rollup rows of ``game_ids`` (default: all), then day rollup rows of those games' days
+    steps = len(ActionType) + 1
+    for action_type in ActionType:
+        query = source.encoded_stats_query(action_type)
+        if game_ids is not None:
+            query = query.where(source.table.c.game_id.in_(game_ids))
+        stats = query.subquery()
+        key = [
+            stats.c.player_id, stats.c.game_id, stats.c.flags, func.coalesce(stats.c.code1, 0),
+            func.coalesce(stats.c.code2, 0), func.coalesce(stats.c.serve_target, ""),
+        ]
+        conn.execute(insert(games).from_select(
+            ["action_type", "player_id", "game_id", *DETAIL_KEY_COLUMNS, "count"],
+            select(literal(enum_code(action_type)), *key, func.count()).group_by(*key)
+        ))
+        if progress is not None:
+            progress(enum_code(action_type), steps)
+    key = [games.c.action_type, games.c.player_id, Game.date] + [games.c[name] for name in DETAIL_KEY_COLUMNS]
+    query = select(*key, func.sum(games.c.count)).join(Game, Game.id == games.c.game_id)
+    if game_ids is not None:
+        query = query.where(Game.date.in_(select(Game.date).where(Game.id.in_(game_ids))))
+    conn.execute(insert(days).from_select(
+        ["action_type", "player_id", "day", *DETAIL_KEY_COLUMNS, "count"], query.group_by(*key)
+    ))
+    if progress is not None:
+        progress(steps, steps)
+    return tuple(conn.execute(select(func.count()).select_from(table)).scalar() for table in (games, days))
+
+
+def rebuild_rollups(conn, source=None, progress=None):
+    """Recompute both stat rollups from raw stats on a sync connection.
+
+    Groups the configured layout (or ``source``) in SQL, one action type at a
+    time, then folds the game rollup into days. Returns the number of
+    (game rollup, day rollup) rows written. ``progress`` is called with
+    (steps done, total steps) after each of those.
+    """
+    source = source or store
+    games = StatRollup.__table__
+    days = StatDayRollup.__table__
+    conn.execute(delete(days))
+    conn.execute(delete(games))
+    return _fill_rollups(conn, source, games, days, progress=progress)
+
+
+def rebuild_rollups_online(engine, source=None, progress=None):
+    """rebuild_rollups() through rebuild_online(), holding the write lock only for the swap"""
+    source = source or store
+    games = StatRollup.__table__
+    days = StatDayRollup.__table__
+
+    def fill(conn, targets):
+        return _fill_rollups(conn, source, targets[games], targets[days], progress=progress)
+
+    def refill(conn, game_ids):
+        refill_rollups(conn, game_ids, source)
+
+    return rebuild_online(engine, [games, days], fill, refill)
+
+
+def refill_rollups(conn, game_ids, source=None):
+    """Recompute the game rollups of ``game_ids`` and the day rollups of their dates on a sync connection"""
+    source = source or store
+    games = StatRollup.__table__
+    days = StatDayRollup.__table__
+    conn.execute(delete(days).where(days.c.day.in_(select(Game.date).where(Game.id.in_(game_ids)))))
+    conn.execute(delete(games).where(games.c.game_id.in_(game_ids)))
+    _fill_rollups(conn, source, games, days, game_ids=game_ids)
+
+
+def _fill_rallies(conn, source, rallies, possessions, game_ids=None, batch_size=5000, progress=None):
+    # Replays the stats of ``game_ids`` (default: all) into the given rally and possession tables
+    total = _stat_count(conn, source) if progress is not None else None
+    teams = teams_by_game(conn.execute(teams_query(game_ids)))
+    query = source.touches_query()
+    if game_ids is not None:
+        query = query.where(source.table.c.game_id.in_(game_ids))
+    stats = conn.execute(
+        query.order_by(source.table.c.game_id, source.table.c.timestamp, source.table.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+    games = rally_count = stats_read = 0
+    pending = {rallies: [], possessions: []}
+
+    def flush():
+        for table, rows in pending.items():
+            if rows:
+                conn.execute(insert(table), rows)
+                rows.clear()
+        if progress is not None:
+            progress(stats_read, total)
+
+    for game_id, rows in groupby(stats, key=itemgetter(1)):
+        game_rows, possession_rows = rally_rows(
+            game_id, 1, reconstruct_rallies((source.touch(row) for row in rows), teams.get(game_id, {}))
+        )
+        games += 1
+        rally_count += len(game_rows)
+        stats_read += sum(row["touches"] for row in game_rows)
+        pending[rallies].extend(game_rows)
+        pending[possessions].extend(possession_rows)
+        if len(pending[rallies]) >= batch_size:
+            flush()
+    flush()
+    return games, rally_count
+
+
+def rebuild_rallies(conn, source=None, batch_size=5000, progress=None):
+    """Recompute every game's rallies from raw stats on a sync connection.
+
+    Streams the configured layout (or ``source``) once in game and time
+    order, replaying one game at a time. Returns (games, rallies) counts.
+    ``progress`` is called with (stats read, total stats) after each batch
+    of rallies is written.
+    """
+    source = source or store
+    conn.execute(delete(RallyPossession.__table__))
+    conn.execute(delete(Rally.__table__))
+    return _fill_rallies(conn, source, Rally.__table__, RallyPossession.__table__,
+                         batch_size=batch_size, progress=progress)
+
+
+def rebuild_rallies_online(engine, source=None, batch_size=5000, progress=None):
+    """rebuild_rallies() through rebuild_online(), holding the write lock only for the swap"""
+    source = source or store
+    rallies = Rally.__table__
+    possessions = RallyPossession.__table__
+
+    def fill(conn, targets):
+        return _fill_rallies(conn, source, targets[rallies], targets[possessions],
+                             batch_size=batch_size, progress=progress)
+
+    def refill(conn, game_ids):
+        refill_rallies(conn, game_ids, source, batch_size)
+
+    return rebuild_online(engine, [rallies, possessions], fill, refill)
+
+
+def refill_rallies(conn, game_ids, source=None, batch_size=5000):
+    """Recompute the rallies of ``game_ids`` on a sync connection; returns (games, rallies) counts"""
+    source = source or store
+    rallies = Rally.__table__
+    possessions = RallyPossession.__table__
+    conn.execute(delete(possessions).where(possessions.c.game_id.in_(game_ids)))
+    conn.execute(delete(rallies).where(rallies.c.game_id.in_(game_ids)))
+    return _fill_rallies(conn, source, rallies, possessions, game_ids=game_ids, batch_size=batch_size)
+
+
+def finish_games(conn, game_ids, source=None):
+    """Catch up after insert_stat_rows(deferred=True) into ``game_ids``, on a sync connection.
+
+    Recomputes the rollups and rallies of those games from their stats and
+    logs an insert for each of their stats the change log does not have yet,
+    all in the caller's transaction.
+    """
+    source = source or store
+    changes = StatChange.__table__
+    # Write first, so the write lock is held before anything is read
+    conn.execute(insert(changes).from_select(
+        ["game_id", "stat_id", "op"],
+        select(source.table.c.game_id, source.table.c.id, literal("insert"))
+        .where(
+            source.table.c.game_id.in_(game_ids),
+            source.table.c.id.not_in(select(changes.c.stat_id).where(changes.c.game_id.in_(game_ids))),
+        )
+        .order_by(source.table.c.id)
+    ))
+    refill_rollups(conn, game_ids, source)
+    refill_rallies(conn, game_ids, source)
+
+
+def convert_stat_storage(conn, target_name, batch_size=5000):
+    """Move every stat from the other layouts into ``target_name`` on a sync connection.
+
+    Ids are kept, so the change log and aggregates stay valid. Refuses to
+    merge into a target layout that already holds stats. Returns the number
+    of stats moved.
+    """
+    target = STAT_STORES[target_name]
+    moved = 0
+    for source in STAT_STORES.values():
+        if source is target or not conn.execute(select(func.count()).select_from(source.table)).scalar():
+            continue
+        if conn.execute(select(func.count()).select_from(target.table)).scalar():
+            raise ValueError(f"{target.table.name} already holds stats; refusing to merge {source.table.name} into it")
+
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                source.stats_query()
+                .where(source.table.c.id > last_id)
+                .order_by(source.table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            stats = []
+            for row in rows:
+                base_row = dict(zip(BASE_COLUMNS, row))
+                stats.append((row[0], (base_row, row[3], source.row_details(row))))
+            conn.execute(insert(target.table), [target.stat_row(*stat) for _, stat in stats])
+            for table, table_rows in _detail_rows_by_table(stats, target).items():
+                conn.execute(insert(table), table_rows)
+            moved += len(rows)
+            last_id = rows[-1][0]
+
+        # Detail tables reference base_stats, so clear them first
+        for table in reversed(source.tables):
+            conn.execute(delete(table))
+    return moved
@@ -0,0 +1,37 @@
+"""Opaque keyset cursors shared by the paginated list endpoints.
+
+A cursor encodes the sort key of the last item on a page; the next page
+continues strictly after it, so deep pages cost the same as the first one.
+"""
+import base64
+import json
+
+from fastapi import HTTPException
+
+# Response header carrying the cursor of the next page, absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """Decode a cursor into its list of key values, or raise a 400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def paginate(response, rows, limit, key):
+    """Trim a limit+1 fetch to one page and set the next-page cursor header"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(rows[-1]))
+    return rows
@@ -0,0 +1,200 @@
+"""Serialized JSON responses for read endpoints, invalidated by writes.
+
+Entries are keyed by path and query string and tagged with the resources
+they were built from: "games", "game:<id>", "game_stats:<id>", "players",
+"player:<id>" and "player_summary". Write paths call invalidate() with the
+tags they touched once their transaction has committed, which drops exactly
+the affected entries; nothing expires by time. Total size is capped, with
+least recently used entries evicted first.
+
+Every cached response carries a content-hash ETag and a Last-Modified time
+(the last invalidation of any of its tags), so clients revalidating with
+If-None-Match or If-Modified-Since get a bodiless 304.
+
+Under serve.py's multi-worker mode every invalidation is also sent to the
+other workers over the message bus (see bus.py). While a worker is cut off
+from the bus it could miss invalidations, so it empties its cache and
+answers every request fresh until it is back.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict, defaultdict
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+from .bus import worker_bus
+from .models.config import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_BYTES
+
+
+class CachedResponse:
+    __slots__ = ("body", "headers", "etag", "last_modified", "tags", "size")
+
+    def __init__(self, body, headers, etag, last_modified, tags):
+        self.body = body
+        self.headers = headers
+        self.etag = etag
+        self.last_modified = last_modified
+        self.tags = tags
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers.items())
+
+
+class ResponseCache:
+    def __init__(self, max_bytes, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        # False while invalidations from other workers may be getting lost
+        self.coherent = True
+        self.started = time.time()
+        self._entries = OrderedDict()
+        self._keys_by_tag = defaultdict(set)
+        self._versions = defaultdict(int)
+        self._modified = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(request):
+        return f"{request.url.path}?{request.url.query}"
+
+    def get(self, request):
+        """Response for a cached entry (a 304 if the client's copy is current), or None on a miss"""
+        if not (self.enabled and self.coherent):
+            return None
+        key = self.key(request)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._respond(request, entry)
+
+    def snapshot(self, tags):
+        """Tag versions to pass to put(); take it before reading the database"""
+        return tuple(self._versions[tag] for tag in tags)
+
+    def put(self, request, tags, snapshot, content, headers=None):
+        """Serialize content once, cache it unless a tag was invalidated since snapshot, and respond
+
+        content may already be JSON bytes from a dedicated encoder.
+        """
+        if isinstance(content, bytes):
+            body = content
+        else:
+            body = json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+        last_modified = max((self._modified.get(tag, self.started) for tag in tags), default=self.started)
+        entry = CachedResponse(
+            body,
+            {k: v for k, v in (headers or {}).items() if k.lower() not in ("content-length", "content-type")},
+            f'W/"{hashlib.sha1(body).hexdigest()}"',
+            int(last_modified),
+            tuple(tags),
+        )
+        # A write that committed while this response was being built may not be in it
+        if self.enabled and self.coherent and snapshot == self.snapshot(tags):
+            key = self.key(request)
+            self._discard(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            for tag in entry.tags:
+                self._keys_by_tag[tag].add(key)
+            while self.bytes > self.max_bytes and self._entries:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+        return self._respond(request, entry)
+
+    def invalidate(self, *tags, publish=True):
+        """Drop every entry built from any of the given resources, here and in the other workers"""
+        if publish:
+            worker_bus.publish({"type": "invalidate", "tags": tags})
+        now = time.time()
+        for tag in tags:
+            self._versions[tag] += 1
+            self._modified[tag] = now
+            for key in list(self._keys_by_tag.pop(tag, ())):
+                self._discard(key)
+                self.invalidations += 1
+
+    def clear(self, publish=True):
+        if publish:
+            worker_bus.publish({"type": "clear"})
+        for key in list(self._entries):
+            self._discard(key)
+
+    def set_coherent(self, coherent):
+        """Stop (False) or resume (True) caching; either way, what is cached now may be stale"""
+        self.coherent = coherent
+        self.clear(publish=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "coherent": self.coherent,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def _respond(self, request, entry):
+        headers = dict(entry.headers)
+        headers["ETag"] = entry.etag
+        headers["Last-Modified"] = formatdate(entry.last_modified, usegmt=True)
+        # Let clients keep the body but always revalidate
+        headers["Cache-Control"] = "no-cache"
+        if self._is_current(request, entry):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    @staticmethod
+    def _is_current(request, entry):
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or entry.etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return entry.last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, enabled=RESPONSE_CACHE_ENABLED)
+# A worker caches nothing until it first reaches the bus
+response_cache.coherent = not worker_bus.enabled
+worker_bus.on("invalidate", lambda message: response_cache.invalidate(*message["tags"], publish=False))
+worker_bus.on("clear", lambda message: response_cache.clear(publish=False))
+worker_bus.on_connection(response_cache.set_coherent)
+
+
+def stats_changed(game_id):
+    """Invalidate every cached response derived from a game's stats"""
+    response_cache.invalidate(f"game_stats:{game_id}", "player_summary")
@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from datetime import date
+
+from ..models.database import AsyncSessionLocal
+from ..models.models import ActionType
+from ..models.schemas import ActionType as ActionTypeSchema
+from ..stat_files import FORMATS, MEDIA_TYPES, encode_records, filtered_export_query
+
+router = APIRouter(
+    prefix="/api/export",
+    tags=["export"],
+)
+
+# Rows fetched from the server-side cursor and encoded per response chunk
+EXPORT_BATCH_SIZE = 2000
+
+
+@router.get("/stats")
+async def export_stats(
+    format: str = Query("csv", pattern=f"^({'|'.join(FORMATS)})$"),
+    game_id: Optional[List[int]] = Query(None),
+    player_id: Optional[List[int]] = Query(None),
+    action_type: Optional[ActionTypeSchema] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+):
+    """Stream every matching stat with its details as CSV or NDJSON (see stat_files for the fields)
+
+    start_date and end_date are inclusive and apply to the game date. Rows are
+    read through a server-side cursor and sent in chunks as they are encoded,
+    so memory use does not grow with the size of the export. For very large
+    exports, POST /api/jobs with kind "export" writes the file in a worker
+    process instead of encoding on the event loop.
+    """
+    query = filtered_export_query(
+        game_id, player_id, None if action_type is None else ActionType(action_type.value), start_date, end_date
+    )
+
+    async def record_stream():
+        # A session of its own: a request-scoped one may be closed before the stream ends
+        async with AsyncSessionLocal() as db:
+            conn = await db.connection()
+            result = await conn.stream(query)
+            header = True
+            async for rows in result.partitions(EXPORT_BATCH_SIZE):
+                yield encode_records(rows, format, header=header)
+                header = False
+            if header and format == "csv":
+                yield encode_records([], format, header=True)
+
+    return StreamingResponse(
+        record_stream(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="bvb_stats.{format}"'},
+    )
@@ -1,18 +1,27 @@
+import asyncio
 import json
-import enum
 
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from sqlalchemy import tuple_
+from typing import List, Optional
+from datetime import datetime, timezone
 
 from ..models.database import get_db
-from ..models.models import BaseStat, Game, ActionType, ServeType, AttackType, AttackDirection, SetType, PassRating, DigQuality
-from ..models.models import ServeStat, ReceiveStat, AttackStat, BlockStat, DigStat, SetStat
-from ..models.schemas import StatResponse, BaseStatCreate, ServeStatCreate, ReceiveStatCreate, AttackStatCreate
-from ..models.schemas import BlockStatCreate, DigStatCreate, SetStatCreate, CreateStatRequest
+from ..models.models import epoch_millis, Game, Player, ActionType
+from ..models.schemas import StatResponse, CreateStatRequest
+from ..models.schemas import ActionType as ActionTypeSchema
+from ..models.stat_store import stat_table, stats_query, serialize_stat_row, insert_stats, delete_stat
+from ..models.stat_store import encode_stat_row, encode_stat_rows
+from ..models.stat_store import latest_change_seq, stat_changes_since
+from ..models.rallies import game_rallies
+from ..pagination import decode_cursor, paginate
+from ..events import broker
+from ..write_behind import write_buffer
+from ..response_cache import response_cache, stats_changed
 
 router = APIRouter(
     prefix="/api/games",
@@ -20,217 +29,282 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# Response header carrying the game's latest change sequence, for ?since= polling
+CHANGE_CURSOR_HEADER = "X-Change-Cursor"
+
+# Idle seconds before an event stream sends a keep-alive comment
+STREAM_KEEPALIVE_SECONDS = 15
+
 @router.get("/{game_id}/stats", response_model=List[StatResponse])
-async def get_game_stats(game_id: int, db: AsyncSession = Depends(get_db)):
-    """Get all stats for a specific game"""
+async def get_game_stats(
+    game_id: int,
+    request: Request,
+    response: Response,
+    player_id: Optional[int] = None,
+    action_type: Optional[ActionTypeSchema] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    set_number: Optional[int] = None,
+    rally_number: Optional[int] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    cursor: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stats for a specific game, newest first, one page at a time
+
+    Follow the X-Next-Cursor response header to fetch the next page. The
+    X-Change-Cursor header holds the game's current change sequence; passing
+    it back as ?since= returns only what was inserted or deleted after it.
+    start_time/end_time and set_number/rally_number are index range scans.
+    """
+    # Pages are served from the response cache until a stat in this game changes;
+    # delta requests are cheap and cursor-specific, so they always hit the database
+    cache_tags = [f"game_stats:{game_id}"]
+    if since is None:
+        cached = response_cache.get(request)
+        if cached is not None:
+            return cached
+        snapshot = response_cache.snapshot(cache_tags)
+    
     # First verify the game exists
-    game_result = await db.execute(select(Game).where(Game.id == game_id))
-    game = game_result.scalars().first()
-    if game is None:
+    game_result = await db.execute(select(Game.id).where(Game.id == game_id))
+    if game_result.first() is None:
         raise HTTPException(status_code=404, detail="Game not found")
     
-    # Get all base stats for this game
-    try:
-        result = await db.execute(
-            select(BaseStat).where(BaseStat.game_id == game_id).order_by(BaseStat.timestamp.desc())
+    if since is not None:
+        # Delta feed: new stats plus tombstones for deleted ones
+        change_cursor, rows, deleted_ids = await stat_changes_since(db, game_id, since)
+        body = b'{"cursor":%d,"stats":%s,"deleted":%s}' % (
+            change_cursor, encode_stat_rows(rows), json.dumps(deleted_ids).encode()
         )
-        base_stats = result.scalars().all()
+        return Response(content=body, media_type="application/json")
+    
+    # Read the change sequence first so nothing committed after this listing is missed
+    response.headers[CHANGE_CURSOR_HEADER] = str(await latest_change_seq(db, game_id))
+    
+    query = (
+        stats_query()
+        .where(stat_table.c.game_id == game_id)
+        .order_by(stat_table.c.timestamp.desc(), stat_table.c.id.desc())
+        .limit(limit + 1)
+    )
+    if player_id is not None:
+        query = query.where(stat_table.c.player_id == player_id)
+    if action_type is not None:
+        query = query.where(stat_table.c.action_type == ActionType(action_type.value))
+    if start_time is not None:
+        query = query.where(stat_table.c.timestamp >= start_time)
+    if end_time is not None:
+        query = query.where(stat_table.c.timestamp < end_time)
+    if set_number is not None:
+        query = query.where(stat_table.c.set_number == set_number)
+    if rally_number is not None:
+        query = query.where(stat_table.c.rally_number == rally_number)
+    if cursor is not None:
+        cursor_timestamp, cursor_id = decode_cursor(cursor, 2)
+        query = query.where(tuple_(stat_table.c.timestamp, stat_table.c.id) < tuple_(cursor_timestamp, cursor_id))
+    
+    # Fetch the page of stats together with their details in a single round trip
+    try:
+        result = await db.execute(query)
+        rows = result.all()
     except Exception as e:
         # Handle any database errors
         print(f"Error fetching stats: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
     
-    # Build response objects with details based on action_type
-    response_stats = []
-    for base_stat in base_stats:
-        # Convert the base_stat to a dict with proper formatting
-        base_dict = {
-            "id": base_stat.id,
-            "game_id": base_stat.game_id,
-            "player_id": base_stat.player_id,
-            "action_type": base_stat.action_type.value if hasattr(base_stat.action_type, 'value') else base_stat.action_type,
-            "timestamp": base_stat.timestamp.isoformat() if hasattr(base_stat.timestamp, 'isoformat') else base_stat.timestamp
-        }
-        
-        # Create the response object
-        stat_response = {"base": base_dict, "details": None}
-        
-        # Get the corresponding detail stat based on action_type and convert to dict
-        action_type = base_stat.action_type
-        detail_stat = None
-        
-        # Compare using string value for more reliability
-        action_type_str = action_type.value if hasattr(action_type, 'value') else action_type
-        
-        if action_type_str == "serving" and base_stat.serve_stat:
-            detail_stat = base_stat.serve_stat
-        elif action_type_str == "serve_receive" and base_stat.receive_stat:
-            detail_stat = base_stat.receive_stat
-        elif action_type_str == "attack" and base_stat.attack_stat:
-            detail_stat = base_stat.attack_stat
-        elif action_type_str == "block" and base_stat.block_stat:
-            detail_stat = base_stat.block_stat
-        elif action_type_str == "dig" and base_stat.dig_stat:
-            detail_stat = base_stat.dig_stat
-        elif action_type_str == "set" and base_stat.set_stat:
-            detail_stat = base_stat.set_stat
-            
-        # Convert detail stat to dict if it exists
-        if detail_stat:
-            detail_dict = {}
-            for key, value in vars(detail_stat).items():
-                if not key.startswith('_'):
-                    # Handle special cases like enums
-                    if isinstance(value, enum.Enum):
-                        detail_dict[key] = value.value
-                    else:
-                        detail_dict[key] = value
-            stat_response["details"] = detail_dict
-        
-        response_stats.append(stat_response)
-    
-    return response_stats
+    # The cursor carries the timestamp as epoch millis, which is also what it binds as
+    rows = paginate(response, rows, limit, lambda row: (epoch_millis(row[4]), row[0]))
+    return response_cache.put(
+        request, cache_tags, snapshot, encode_stat_rows(rows), headers=response.headers
+    )
 
 
 @router.post("/{game_id}/stats", response_model=StatResponse)
 async def add_game_stat(game_id: int, stat_request: CreateStatRequest, db: AsyncSession = Depends(get_db)):
     """Add a new stat for a specific game"""
     # First verify the game exists
-    game_result = await db.execute(select(Game).where(Game.id == game_id))
-    game = game_result.scalars().first()
-    if game is None:
+    game_result = await db.execute(select(Game.id).where(Game.id == game_id))
+    if game_result.first() is None:
         raise HTTPException(status_code=404, detail="Game not found")
     
-    # Create the base stat with values from base_stat field
-    base_stat_data = stat_request.base_stat
+    # In write-behind mode the stat is acknowledged once it is in the append log;
+    # it reaches the database, the event stream and ?since= on the next group commit
+    if write_buffer.enabled:
+        log_seq = write_buffer.append(game_id, stat_request)
+        return JSONResponse(status_code=202, content={"status": "accepted", "log_seq": log_seq})
     
-    # Convert string action_type to enum value if needed
-    action_type = base_stat_data.action_type
-    if isinstance(action_type, str):
-        # Convert string to uppercase to match enum naming convention
-        action_type = ActionType[action_type.upper()]
+    # Stamp with the server time and write through the shared bulk insert path
+    stat_ids = await insert_stats(db, game_id, [stat_request], timestamp=datetime.now(timezone.utc))
+    await db.commit()
+    stats_changed(game_id)
     
-    base_stat = BaseStat(
-        game_id=game_id,
-        player_id=base_stat_data.player_id,
-        action_type=action_type,
-        timestamp=datetime.now()
-    )
-    db.add(base_stat)
-    await db.flush()
-    
-    # Create the detail stat based on action_type
-    # Already converted action_type to enum value above
-    detail_stat = None
-    
-    if action_type == ActionType.SERVING and stat_request.serve_stat:
-        # Create serve stat
-        detail_stat = ServeStat(stat_id=base_stat.id, **stat_request.serve_stat.dict())
-        db.add(detail_stat)
-        
-    elif action_type == ActionType.SERVE_RECEIVE and stat_request.receive_stat:
-        # Create receive stat
-        detail_stat = ReceiveStat(stat_id=base_stat.id, **stat_request.receive_stat.dict())
-        db.add(detail_stat)
-        
-    elif action_type == ActionType.ATTACK and stat_request.attack_stat:
-        # Create attack stat
-        detail_stat = AttackStat(stat_id=base_stat.id, **stat_request.attack_stat.dict())
-        db.add(detail_stat)
-        
-    elif action_type == ActionType.BLOCK and stat_request.block_stat:
-        # Create block stat
-        detail_stat = BlockStat(stat_id=base_stat.id, **stat_request.block_stat.dict())
-        db.add(detail_stat)
-        
-    elif action_type == ActionType.DIG and stat_request.dig_stat:
-        # Create dig stat
-        detail_stat = DigStat(stat_id=base_stat.id, **stat_request.dig_stat.dict())
-        db.add(detail_stat)
-        
-    elif action_type == ActionType.SET and stat_request.set_stat:
-        # Create set stat
-        detail_stat = SetStat(stat_id=base_stat.id, **stat_request.set_stat.dict())
-        db.add(detail_stat)
+    # Return the newly created stat with its details, and push it to live subscribers
+    result = await db.execute(stats_query().where(stat_table.c.id == stat_ids[0]))
+    row = result.one()
+    if broker.has_subscribers(game_id):
+        broker.publish(game_id, stats=[serialize_stat_row(row)])
+    return Response(content=encode_stat_row(row), media_type="application/json")
+
+
+@router.post("/{game_id}/stats/batch")
+async def add_game_stats_batch(game_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """Add many stats for a specific game in a single transaction
+
+    Accepts a JSON array of CreateStatRequest objects, or one object per line
+    when sent as application/x-ndjson. Each stat keeps its client timestamp so
+    replayed sessions stay in order. Invalid items are reported by index and
+    skipped; all valid items are written together.
+    """
+    # First verify the game exists
+    game_result = await db.execute(select(Game.id).where(Game.id == game_id))
+    if game_result.first() is None:
+        raise HTTPException(status_code=404, detail="Game not found")
     
-    await db.commit()
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        raw_items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                raw_items.append(json.loads(line))
+            except ValueError as e:
+                raw_items.append(e)
+    else:
+        try:
+            raw_items = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {str(e)}")
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of stats")
     
-    # Return the newly created stat
-    # Convert to a format that matches the StatResponse model
-    # First refresh the base_stat to get any database-generated values
-    await db.refresh(base_stat)
-    
-    # Create a dict with string properties instead of using the ORM objects directly
-    base_dict = {
-        "id": base_stat.id,
-        "game_id": base_stat.game_id,
-        "player_id": base_stat.player_id,
-        "action_type": base_stat.action_type.value if hasattr(base_stat.action_type, 'value') else base_stat.action_type,
-        "timestamp": base_stat.timestamp.isoformat() if hasattr(base_stat.timestamp, 'isoformat') else base_stat.timestamp
-    }
+    # Validate every item up front; errors are kept per index
+    results = []
+    valid = []
+    for index, raw_item in enumerate(raw_items):
+        if isinstance(raw_item, Exception):
+            results.append({"index": index, "error": f"Invalid JSON: {str(raw_item)}"})
+            continue
+        try:
+            stat_request = CreateStatRequest(**raw_item) if isinstance(raw_item, dict) else None
+        except ValidationError as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+        if stat_request is None:
+            results.append({"index": index, "error": "Expected a JSON object"})
+            continue
+        results.append({"index": index, "id": None})
+        valid.append((index, stat_request))
     
-    stat_response = {"base": base_dict}
+    # Reject stats for unknown players with a single lookup
+    player_ids = {stat_request.base_stat.player_id for _, stat_request in valid}
+    player_result = await db.execute(select(Player.id).where(Player.id.in_(player_ids)))
+    known_players = set(player_result.scalars().all())
+    to_insert = []
+    for index, stat_request in valid:
+        if stat_request.base_stat.player_id in known_players:
+            to_insert.append((index, stat_request))
+        else:
+            results[index] = {"index": index, "error": "Player not found"}
     
-    if detail_stat:
-        # Convert detail stat to dict so we can manipulate it
-        detail_dict = {}
-        for key, value in vars(detail_stat).items():
-            if not key.startswith('_'):
-                # Handle special cases like enums
-                if isinstance(value, enum.Enum):
-                    detail_dict[key] = value.value
-                else:
-                    detail_dict[key] = value
-        stat_response["details"] = detail_dict
+    stat_ids = await insert_stats(db, game_id, [stat_request for _, stat_request in to_insert])
+    await db.commit()
+    if stat_ids:
+        stats_changed(game_id)
+    for (index, _), stat_id in zip(to_insert, stat_ids):
+        results[index]["id"] = stat_id
+    
+    # Only read the new rows back when someone is listening
+    if stat_ids and broker.has_subscribers(game_id):
+        result = await db.execute(stats_query().where(stat_table.c.id.in_(stat_ids)).order_by(stat_table.c.id))
+        broker.publish(game_id, stats=[serialize_stat_row(row) for row in result.all()])
     
-    return stat_response
+    return {
+        "created": len(stat_ids),
+        "failed": len(results) - len(stat_ids),
+        "results": results
+    }
 
 
 @router.delete("/{game_id}/stats/{stat_id}", response_model=StatResponse)
 async def delete_game_stat(game_id: int, stat_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a stat for a specific game"""
     # First verify the game exists
-    game_result = await db.execute(select(Game).where(Game.id == game_id))
-    game = game_result.scalars().first()
-    if game is None:
+    game_result = await db.execute(select(Game.id).where(Game.id == game_id))
+    if game_result.first() is None:
         raise HTTPException(status_code=404, detail="Game not found")
     
-    # Get the base stat
-    result = await db.execute(
-        select(BaseStat).where(and_(BaseStat.game_id == game_id, BaseStat.id == stat_id))
-    )
-    base_stat = result.scalars().first()
-    if base_stat is None:
+    # Delete the base stat, its details and its aggregate counts together
+    row = await delete_stat(db, game_id, stat_id)
+    if row is None:
         raise HTTPException(status_code=404, detail="Stat not found")
-    
-    # Get the corresponding detail stat based on action_type
-    if base_stat.action_type == ActionType.SERVING and base_stat.serve_stat:
-        detail_stat = base_stat.serve_stat
-        db.delete(detail_stat)
-        
-    elif base_stat.action_type == ActionType.SERVE_RECEIVE and base_stat.receive_stat:
-        detail_stat = base_stat.receive_stat
-        db.delete(detail_stat)
-        
-    elif base_stat.action_type == ActionType.ATTACK and base_stat.attack_stat:
-        detail_stat = base_stat.attack_stat
-        db.delete(detail_stat)
-        
-    elif base_stat.action_type == ActionType.BLOCK and base_stat.block_stat:
-        detail_stat = base_stat.block_stat
-        db.delete(detail_stat)
-        
-    elif base_stat.action_type == ActionType.DIG and base_stat.dig_stat:
-        detail_stat = base_stat.dig_stat
-        db.delete(detail_stat)
-        
-    elif base_stat.action_type == ActionType.SET and base_stat.set_stat:
-        detail_stat = base_stat.set_stat
-        db.delete(detail_stat)
-    
-    db.delete(base_stat)
     await db.commit()
+    stats_changed(game_id)
+    broker.publish(game_id, deleted=[stat_id])
     
     # Return the deleted stat
-    stat_response = {"base": base_stat, "details": detail_stat}
-    return stat_response
+    return Response(content=encode_stat_row(row), media_type="application/json")
+
+
+@router.get("/{game_id}/rallies")
+async def get_game_rallies(game_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """A game's rallies in order, reconstructed from its stats, with their possessions
+
+    Kept up to date as stats are added or deleted. Each rally has its serving
+    and winning team, how it ended, the pass rating of the serve receive and
+    whether the receiving team killed its first attack.
+    """
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    cache_tags = [f"game_stats:{game_id}"]
+    snapshot = response_cache.snapshot(cache_tags)
+    
+    game_result = await db.execute(select(Game.id).where(Game.id == game_id))
+    if game_result.first() is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    return response_cache.put(request, cache_tags, snapshot, await game_rallies(db, game_id))
+
+
+@router.get("/{game_id}/stats/stream")
+async def stream_game_stats(game_id: int, db: AsyncSession = Depends(get_db)):
+    """Server-sent events for every stat added to or deleted from a game
+
+    Each event's data is {"stats": [...], "deleted": [...]}, the same shape as
+    the ?since= delta feed. An "overflow" event means this client fell behind
+    and lost events, and should resync through ?since=.
+    """
+    game_result = await db.execute(select(Game.id).where(Game.id == game_id))
+    if game_result.first() is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    # Don't hold a pooled connection for the lifetime of the stream
+    await db.close()
+    
+    subscription = broker.subscribe(game_id)
+    
+    async def event_stream():
+        reported_drops = 0
+        try:
+            yield b": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if subscription.dropped != reported_drops:
+                    reported_drops = subscription.dropped
+                    yield b"event: overflow\ndata: {}\n\n"
+                yield event
+        finally:
+            broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
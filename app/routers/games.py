@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List
+from sqlalchemy import tuple_
+from typing import List, Optional
+from datetime import date
 
 from ..models.database import get_db
-from ..models.models import Game
+from ..models.models import Game, GameParticipant
 from ..models.schemas import Game as GameSchema
 from ..models.schemas import GameCreate
+from ..pagination import decode_cursor, paginate
+from ..response_cache import response_cache
+from ..write_behind import write_buffer
 
 router = APIRouter(
     prefix="/api/games",
@@ -16,50 +21,76 @@ router = APIRouter(
 
 import json
 
+def game_schema(db_game):
+    """Build a GameSchema from a Game and its eager-loaded participants"""
+    return GameSchema(
+        id=db_game.id,
+        date=db_game.date,
+        team1=db_game.team1_ids,
+        team2=db_game.team2_ids
+    )
+
 @router.post("/", response_model=GameSchema)
 async def create_game(game: GameCreate, db: AsyncSession = Depends(get_db)):
     db_game = Game(
         date=game.date,
+        # The JSON columns are kept for older readers; game_participants is the source of truth
         team1=json.dumps(game.team1),
-        team2=json.dumps(game.team2)
+        team2=json.dumps(game.team2),
+        participants=[
+            GameParticipant(team=team, position=position, player_id=player_id)
+            for team, players in ((1, game.team1), (2, game.team2))
+            for position, player_id in enumerate(players)
+        ]
     )
     db.add(db_game)
     await db.commit()
-    await db.refresh(db_game)
-    # Return with team1/team2 as lists
-    return GameSchema(
-        id=db_game.id,
-        date=db_game.date,
-        team1=json.loads(db_game.team1),
-        team2=json.loads(db_game.team2)
-    )
+    # games_played on the leaderboard counts participants
+    response_cache.invalidate("games", "player_summary")
+    return game_schema(db_game)
 
 @router.get("/", response_model=List[GameSchema])
-async def read_games(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Game).order_by(Game.date.desc()))
-    games = result.scalars().all()
-    # Parse JSON fields for each game
-    return [
-        GameSchema(
-            id=g.id,
-            date=g.date,
-            team1=json.loads(g.team1),
-            team2=json.loads(g.team2)
-        ) for g in games
-    ]
+async def read_games(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Games newest first, one page at a time; follow X-Next-Cursor for the next page"""
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    snapshot = response_cache.snapshot(["games"])
+    
+    query = select(Game).order_by(Game.date.desc(), Game.id.desc()).limit(limit + 1)
+    if cursor is not None:
+        cursor_date, cursor_id = decode_cursor(cursor, 2)
+        try:
+            cursor_date = date.fromisoformat(cursor_date)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(Game.date, Game.id) < tuple_(cursor_date, cursor_id))
+    # Participants for the page arrive in a single selectin query
+    result = await db.execute(query)
+    games = paginate(response, result.scalars().all(), limit, lambda g: (g.date, g.id))
+    return response_cache.put(
+        request, ["games"], snapshot, [game_schema(g) for g in games], headers=response.headers
+    )
 
 @router.get("/{game_id}", response_model=GameSchema)
-async def read_game(game_id: int, db: AsyncSession = Depends(get_db)):
+async def read_game(game_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    cache_tags = [f"game:{game_id}"]
+    snapshot = response_cache.snapshot(cache_tags)
+    
     result = await db.execute(select(Game).where(Game.id == game_id))
     db_game = result.scalars().first()
     if db_game is None:
         raise HTTPException(status_code=404, detail="Game not found")
-    return GameSchema(
-        id=db_game.id,
-        date=db_game.date,
-        team1=json.loads(db_game.team1),
-        team2=json.loads(db_game.team2)
-    )
+    return response_cache.put(request, cache_tags, snapshot, game_schema(db_game))
 
 @router.delete("/{game_id}", response_model=GameSchema)
 async def delete_game(game_id: int, db: AsyncSession = Depends(get_db)):
@@ -67,6 +98,11 @@ async def delete_game(game_id: int, db: AsyncSession = Depends(get_db)):
     db_game = result.scalars().first()
     if db_game is None:
         raise HTTPException(status_code=404, detail="Game not found")
+    if write_buffer.enabled and write_buffer.has_pending(game_id):
+        # Its acknowledged stats are not committed yet and would be rejected once it is gone
+        raise HTTPException(status_code=409, detail="Game has buffered stats waiting to be committed")
+    deleted = game_schema(db_game)
     await db.delete(db_game)
     await db.commit()
-    return db_game
+    response_cache.invalidate("games", f"game:{game_id}", f"game_stats:{game_id}", "player_summary")
+    return deleted
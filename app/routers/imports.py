@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from typing import Optional
+
+from ..jobs import job_runner
+from ..models.config import JOB_DIR
+from ..models.database import get_db
+from ..models.models import ImportRun
+from ..stat_files import FORMATS, format_for
+from ..stat_import import import_stat_file
+
+router = APIRouter(
+    prefix="/api/import",
+    tags=["import"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.post("/stats")
+async def import_stats(
+    request: Request,
+    name: Optional[str] = None,
+    format: Optional[str] = Query(None, pattern=f"^({'|'.join(FORMATS)})$"),
+    background: bool = False,
+    db: AsyncSession = Depends(get_db),
+):
+    """Bulk-load a CSV or NDJSON stat file sent as the raw request body
+
+    The format comes from ?format=, the Content-Type (text/csv or
+    application/x-ndjson) or the extension of ?name=. Uploading the same file
+    again resumes an interrupted import and does nothing after a finished one.
+    Progress of a running import is at GET /api/import/stats/{run_id}.
+
+    With ?background=true the file is loaded by a background job instead and
+    the job is returned at once (202); follow it at GET /api/jobs/{id}.
+    """
+    file_format = format or format_for(name, request.headers.get("content-type"))
+    if file_format is None:
+        raise HTTPException(status_code=400, detail="Pass ?format=csv or ?format=ndjson")
+
+    # Spool to disk so the file can be hashed and read as a stream; a job's
+    # copy lives next to the job files until the job finishes
+    fd, path = tempfile.mkstemp(suffix=f".{file_format}", prefix="upload-", dir=JOB_DIR if background else None)
+    if background:
+        with os.fdopen(fd, "wb") as file:
+            async for chunk in request.stream():
+                file.write(chunk)
+        params = {"path": path, "format": file_format, "source_name": name or "upload"}
+        job = await job_runner.submit(db, "import", params)
+        return JSONResponse(status_code=202, content=job_runner.describe(job))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            async for chunk in request.stream():
+                file.write(chunk)
+        return await import_stat_file(path, file_format, source_name=name or "upload")
+    finally:
+        os.remove(path)
+
+
+@router.get("/stats/{run_id}")
+async def read_import(run_id: int, db: AsyncSession = Depends(get_db)):
+    """Progress of an import: records read so far, stats imported and records rejected"""
+    run = (await db.execute(select(ImportRun).where(ImportRun.id == run_id))).scalars().first()
+    if run is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return {
+        "run_id": run.id,
+        "source_name": run.source_name,
+        "status": run.status,
+        "records": run.records_done,
+        "stats_imported": run.stats_imported,
+        "errors": run.errors,
+    }
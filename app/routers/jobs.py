@@ -0,0 +1,106 @@
+import json
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from typing import Optional
+
+from ..jobs import FINISHED_STATUSES, STATUSES, check_params, job_file, job_runner
+from ..models.database import get_db
+from ..models.models import Job
+from ..models.schemas import CreateJobRequest
+from ..stat_files import MEDIA_TYPES
+
+router = APIRouter(
+    prefix="/api/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+async def get_job(db, job_id):
+    job = (await db.execute(select(Job).where(Job.id == job_id))).scalars().first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/", status_code=202)
+async def create_job(request: CreateJobRequest, db: AsyncSession = Depends(get_db)):
+    """Queue a background job and return it; poll GET /api/jobs/{id} for progress and the result
+
+    Kinds: rebuild_aggregates, rebuild_rallies and rebuild_rollups (no
+    params), export (format, game_id, player_id, action_type, start_date,
+    end_date as for GET /api/export) and season_report (start_date,
+    end_date). Imports run as jobs through POST /api/import/stats?background=true.
+    """
+    try:
+        params = check_params(request.kind, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = await job_runner.submit(db, request.kind, params)
+    return job_runner.describe(job)
+
+
+@router.get("/")
+async def read_jobs(
+    status: Optional[str] = Query(None, pattern=f"^({'|'.join(STATUSES)})$"),
+    kind: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """Jobs newest first, optionally only those with a status or kind"""
+    query = select(Job).order_by(Job.id.desc()).limit(limit)
+    if status is not None:
+        query = query.where(Job.status == status)
+    if kind is not None:
+        query = query.where(Job.kind == kind)
+    result = await db.execute(query)
+    return [job_runner.describe(job) for job in result.scalars().all()]
+
+
+@router.get("/{job_id}")
+async def read_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Status, progress and, once done, the result of a job"""
+    return job_runner.describe(await get_job(db, job_id))
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Cancel a queued job, or ask a running one to stop at its next progress report"""
+    await get_job(db, job_id)
+    if not await job_runner.cancel(db, job_id):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    job = await get_job(db, job_id)
+    await db.refresh(job)
+    return job_runner.describe(job)
+
+
+@router.get("/{job_id}/file")
+async def download_job_file(job_id: int, db: AsyncSession = Depends(get_db)):
+    """The file written by a finished export job"""
+    job = await get_job(db, job_id)
+    if job.kind != "export" or job.status != "done":
+        raise HTTPException(status_code=404, detail="Job has no file")
+    file_format = json.loads(job.params)["format"]
+    path = job_file(job.id, file_format)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Job file was deleted")
+    return FileResponse(path, media_type=MEDIA_TYPES[file_format], filename=f"bvb_stats_job{job.id}.{file_format}")
+
+
+@router.delete("/{job_id}")
+async def delete_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Forget a finished job and delete its file"""
+    job = await get_job(db, job_id)
+    if job.status not in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail="Cancel the job first")
+    if job.kind == "export":
+        path = job_file(job.id, json.loads(job.params)["format"])
+        if os.path.exists(path):
+            os.remove(path)
+    await db.delete(job)
+    await db.commit()
+    return job_runner.describe(job)
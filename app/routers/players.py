@@ -1,14 +1,21 @@
+
 from fastapi import APIRouter, Depends, HTTPException, status, Request, File, UploadFile
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List
+from typing import List, Optional
+from datetime import date
 from sqlalchemy import Integer
 
 from ..models.database import get_db
-from ..models.models import Player
+from ..models.models import Player, Game, GameParticipant, ServeType, AttackDirection, AttackType, SetType, PassRating, DigQuality
+from ..models.models import ServeStat, ReceiveStat, AttackStat, BlockStat, DigStat, SetStat
 from ..models.schemas import Player as PlayerSchema
-from ..models.schemas import PlayerCreate
+from ..models.schemas import PlayerCreate, ActionType as ActionTypeSchema
+from ..models.schemas import Game as GameSchema
+from ..models.stat_store import stat_table, join_details, detail_flag, detail_equals
+from .games import game_schema
+from ..response_cache import response_cache
 
 router = APIRouter(
     prefix="/api/players",
@@ -28,104 +35,236 @@ async def create_player(player: PlayerCreate, db: AsyncSession = Depends(get_db)
     db.add(db_player)
     await db.commit()
     await db.refresh(db_player)
+    response_cache.invalidate("players", "player_summary")
     return db_player
 
 @router.get("/", response_model=List[PlayerSchema])
-async def read_players(db: AsyncSession = Depends(get_db)):
+async def read_players(request: Request, db: AsyncSession = Depends(get_db)):
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    snapshot = response_cache.snapshot(["players"])
+    
     result = await db.execute(select(Player).order_by(Player.name))
     players = result.scalars().all()
-    return players
+    return response_cache.put(
+        request, ["players"], snapshot, [PlayerSchema(id=p.id, name=p.name) for p in players]
+    )
 
-from fastapi import Response
+from fastapi import Response, Query
 from sqlalchemy import func, select as sa_select, case
 from ..models.models import ActionType
 
+def _games_played():
+    """Correlated count of games the player took part in, via the game_participants index"""
+    return (
+        sa_select(func.count(func.distinct(GameParticipant.game_id)))
+        .where(GameParticipant.player_id == Player.id)
+        .correlate(Player)
+        .scalar_subquery()
+    )
+
+# Sortable summary columns and their default direction
+SUMMARY_SORTS = {
+    "name": "asc",
+    "games_played": "desc",
+    "total_kills": "desc",
+    "total_aces": "desc",
+}
+
 @router.get("/summary")
-async def player_summaries(db: AsyncSession = Depends(get_db)):
-    # Get basic stats per player
-    result = await db.execute(
-        sa_select(
-            Player.id,
-            Player.name
-            # TODO: Add stat summary fields from new normalized schema
-        )
-        .group_by(Player.id)
-        .order_by(Player.name)
+async def player_summaries(
+    request: Request,
+    sort: str = "name",
+    order: Optional[str] = Query(None, pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_db)
+):
+    """Leaderboard of every player with games played, kills and aces, in one grouped query"""
+    if sort not in SUMMARY_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SUMMARY_SORTS)}")
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    snapshot = response_cache.snapshot(["player_summary"])
+    
+    games_played = _games_played().label("games_played")
+    total_kills = func.coalesce(func.sum(case((detail_flag(AttackStat.is_kill), 1), else_=0)), 0).label("total_kills")
+    total_aces = func.coalesce(func.sum(case((detail_flag(ServeStat.is_ace), 1), else_=0)), 0).label("total_aces")
+    sort_columns = {
+        "name": Player.name,
+        "games_played": games_played,
+        "total_kills": total_kills,
+        "total_aces": total_aces,
+    }
+    sort_column = sort_columns[sort]
+    sort_column = sort_column.desc() if (order or SUMMARY_SORTS[sort]) == "desc" else sort_column.asc()
+    
+    query = (
+        sa_select(Player.id, Player.name, games_played, total_kills, total_aces)
+        .select_from(Player)
+        .outerjoin(stat_table, stat_table.c.player_id == Player.id)
     )
-    rows = result.all()
-    # TODO: Add games_played, total_kills, total_aces from normalized schema
-    return [
+    query = join_details(query, [AttackStat, ServeStat]).group_by(Player.id).order_by(sort_column, Player.name)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = (await db.execute(query)).all()
+    summaries = [
         {
             'id': r.id,
-            'name': r.name
+            'name': r.name,
+            'games_played': r.games_played,
+            'total_kills': r.total_kills,
+            'total_aces': r.total_aces
         } for r in rows
     ]
+    
+    # The ETag follows the content, so it only changes when the numbers do
+    return response_cache.put(request, ["player_summary"], snapshot, summaries)
 
 @router.get("/{player_id}", response_model=PlayerSchema)
-async def read_player(player_id: int, db: AsyncSession = Depends(get_db)):
+async def read_player(player_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    cache_tags = [f"player:{player_id}"]
+    snapshot = response_cache.snapshot(cache_tags)
+    
     result = await db.execute(select(Player).where(Player.id == player_id))
     db_player = result.scalars().first()
     if db_player is None:
         raise HTTPException(status_code=404, detail="Player not found")
-    return db_player
+    return response_cache.put(request, cache_tags, snapshot, PlayerSchema(id=db_player.id, name=db_player.name))
+
+@router.get("/{player_id}/games", response_model=List[GameSchema])
+async def player_games(player_id: int, db: AsyncSession = Depends(get_db)):
+    """Every game the player appeared in, newest first"""
+    result = await db.execute(select(Player.id).where(Player.id == player_id))
+    if result.first() is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    result = await db.execute(
+        select(Game)
+        .where(Game.id.in_(sa_select(GameParticipant.game_id).where(GameParticipant.player_id == player_id)))
+        .order_by(Game.date.desc(), Game.id.desc())
+    )
+    return [game_schema(g) for g in result.scalars().all()]
+
+def _count(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+def _enum_counts(prefix, column, enum_class):
+    return [(f"{prefix}_{member.value}", _count(detail_equals(column, member))) for member in enum_class]
+
+# (category, [(counter name, SQL aggregate)]) for GET /{player_id}/stats.
+# detail_flag/detail_equals only match stats of the detail's own action type,
+# so each aggregate needs no extra action_type check in either stat layout.
+PLAYER_STAT_MEASURES = [
+    ("serving", [
+        ("total_serves", _count(stat_table.c.action_type == ActionType.SERVING)),
+        ("missed_serves", _count(detail_flag(ServeStat.is_missed))),
+        ("aces", _count(detail_flag(ServeStat.is_ace))),
+    ] + _enum_counts("serve_type", ServeStat.serve_type, ServeType)),
+    ("serve_receive", [
+        ("total_receives", _count(stat_table.c.action_type == ActionType.SERVE_RECEIVE)),
+        ("good_passes", _count(detail_flag(ReceiveStat.is_good_pass))),
+        ("receive_errors", _count(detail_flag(ReceiveStat.is_error))),
+    ] + _enum_counts("pass_rating", ReceiveStat.pass_rating, PassRating)),
+    ("attack", [
+        ("total_attacks", _count(stat_table.c.action_type == ActionType.ATTACK)),
+        ("kills", _count(detail_flag(AttackStat.is_kill))),
+        ("attack_errors", _count(detail_flag(AttackStat.is_error))),
+        ("blocked", _count(detail_flag(AttackStat.is_blocked))),
+    ] + _enum_counts("direction", AttackStat.attack_direction, AttackDirection)
+      + _enum_counts("type", AttackStat.attack_type, AttackType)),
+    ("block", [
+        ("total_blocks", _count(stat_table.c.action_type == ActionType.BLOCK)),
+        ("stuff_blocks", _count(detail_flag(BlockStat.is_stuff))),
+        ("soft_touches", _count(detail_flag(BlockStat.is_touch))),
+    ]),
+    ("dig", [
+        ("total_digs", _count(stat_table.c.action_type == ActionType.DIG)),
+        ("successful_digs", _count(detail_flag(DigStat.is_successful))),
+        ("dig_led_to_kill", _count(detail_flag(DigStat.led_to_kill))),
+    ] + _enum_counts("dig_quality", DigStat.dig_quality, DigQuality)),
+    ("set", [
+        ("total_sets", _count(stat_table.c.action_type == ActionType.SET)),
+        ("set_errors", _count(detail_flag(SetStat.is_error))),
+        ("killable_sets", _count(detail_flag(SetStat.is_killable))),
+    ] + _enum_counts("set_type", SetStat.set_type, SetType)),
+]
+
+def _filter_player_stats(query, player_id, game_id, start_date, end_date, action_type):
+    """Push the optional stat filters down into the WHERE clause"""
+    query = query.where(stat_table.c.player_id == player_id)
+    if game_id is not None:
+        query = query.where(stat_table.c.game_id == game_id)
+    if action_type is not None:
+        query = query.where(stat_table.c.action_type == ActionType(action_type.value))
+    if start_date is not None:
+        query = query.where(Game.date >= start_date)
+    if end_date is not None:
+        query = query.where(Game.date <= end_date)
+    return query
 
 @router.get("/{player_id}/stats")
-async def player_stats(player_id: int, db: AsyncSession = Depends(get_db)):
-    # TODO: Rewrite player_stats endpoint for new normalized schema
-    stats = []
-    if not stats:
-        return {"categories": {}}
-    # Organize by action type
-    categories = {
-        "serving": {},
-        "serve_receive": {},
-        "attack": {},
-        "block": {},
-        "dig": {},
-        "set": {}
-    }
-    # Count stats by category
-    # TODO: Process stats from new normalized tables
-    for st in stats:
-        if st.action_type == ActionType.SERVING:
-            cat = categories["serving"]
-            cat["total_serves"] = cat.get("total_serves", 0) + 1
-            if st.is_missed_serve: cat["missed_serves"] = cat.get("missed_serves", 0) + 1
-            if st.is_ace: cat["aces"] = cat.get("aces", 0) + 1
-        elif st.action_type == ActionType.SERVE_RECEIVE:
-            cat = categories["serve_receive"]
-            cat["total_receives"] = cat.get("total_receives", 0) + 1
-            if st.is_good_pass: cat["good_passes"] = cat.get("good_passes", 0) + 1
-            if st.is_receive_error: cat["receive_errors"] = cat.get("receive_errors", 0) + 1
-        elif st.action_type == ActionType.ATTACK:
-            cat = categories["attack"]
-            cat["total_attacks"] = cat.get("total_attacks", 0) + 1
-            if st.is_kill: cat["kills"] = cat.get("kills", 0) + 1
-            if st.is_attack_error: cat["attack_errors"] = cat.get("attack_errors", 0) + 1
-            if st.is_blocked: cat["blocked"] = cat.get("blocked", 0) + 1
-            if st.attack_direction:
-                key = f"direction_{st.attack_direction.value}"
-                cat[key] = cat.get(key, 0) + 1
-            if st.attack_type:
-                key = f"type_{st.attack_type.value}"
-                cat[key] = cat.get(key, 0) + 1
-        elif st.action_type == ActionType.BLOCK:
-            cat = categories["block"]
-            cat["total_blocks"] = cat.get("total_blocks", 0) + 1
-            if st.is_stuff_block: cat["stuff_blocks"] = cat.get("stuff_blocks", 0) + 1
-            if st.is_soft_touch: cat["soft_touches"] = cat.get("soft_touches", 0) + 1
-        elif st.action_type == ActionType.DIG:
-            cat = categories["dig"]
-            cat["total_digs"] = cat.get("total_digs", 0) + 1
-            if st.is_successful_dig: cat["successful_digs"] = cat.get("successful_digs", 0) + 1
-            if st.dig_led_to_kill: cat["dig_led_to_kill"] = cat.get("dig_led_to_kill", 0) + 1
-        elif st.action_type == ActionType.SET:
-            cat = categories["set"]
-            cat["total_sets"] = cat.get("total_sets", 0) + 1
-            if st.is_set_error: cat["set_errors"] = cat.get("set_errors", 0) + 1
-            if st.is_killable_set: cat["killable_sets"] = cat.get("killable_sets", 0) + 1
-    # Remove empty categories
-    categories = {k: v for k, v in categories.items() if v}
+async def player_stats(
+    player_id: int,
+    game_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    action_type: Optional[ActionTypeSchema] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Per-category stat counters for a player, aggregated in a single SQL query"""
+    result = await db.execute(select(Player.id).where(Player.id == player_id))
+    if result.first() is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    
+    columns = [
+        aggregate.label(f"{category}__{name}")
+        for category, measures in PLAYER_STAT_MEASURES
+        for name, aggregate in measures
+    ]
+    query = sa_select(*columns).select_from(stat_table)
+    if start_date is not None or end_date is not None:
+        query = query.join(Game, Game.id == stat_table.c.game_id)
+    query = join_details(query)
+    query = _filter_player_stats(query, player_id, game_id, start_date, end_date, action_type)
+    row = (await db.execute(query)).one()
+    
+    # Keep only non-zero counters and drop empty categories
+    categories = {}
+    for category, measures in PLAYER_STAT_MEASURES:
+        counters = {}
+        for name, _ in measures:
+            value = getattr(row, f"{category}__{name}") or 0
+            if value:
+                counters[name] = value
+        if counters:
+            categories[category] = counters
+    
+    # Daily serving totals for the player page chart
+    if "serving" in categories:
+        serving_measures = dict(PLAYER_STAT_MEASURES[0][1])
+        daily_query = (
+            sa_select(
+                Game.date,
+                serving_measures["total_serves"].label("total_serves"),
+                serving_measures["missed_serves"].label("missed_serves"),
+                serving_measures["aces"].label("aces"),
+            )
+            .select_from(stat_table)
+            .join(Game, Game.id == stat_table.c.game_id)
+            .where(stat_table.c.action_type == ActionType.SERVING)
+            .group_by(Game.date)
+        )
+        daily_query = join_details(daily_query, [ServeStat])
+        daily_query = _filter_player_stats(daily_query, player_id, game_id, start_date, end_date, action_type)
+        categories["serving_by_date"] = {
+            r.date.isoformat(): {"total_serves": r.total_serves, "missed_serves": r.missed_serves, "aces": r.aces}
+            for r in (await db.execute(daily_query)).all()
+        }
+    
     return {"categories": categories}
 
 from fastapi import status
@@ -148,6 +287,7 @@ async def update_player(player_id: int, data: dict, db: AsyncSession = Depends(g
     db.add(db_player)
     await db.commit()
     await db.refresh(db_player)
+    response_cache.invalidate("players", f"player:{player_id}", "player_summary")
     return {"success": True}
 
 @router.delete("/{player_id}")
@@ -165,6 +305,7 @@ async def delete_player(player_id: int, db: AsyncSession = Depends(get_db)):
     #     raise HTTPException(status_code=409, detail="Cannot delete player in use (has stats)")
     await db.delete(db_player)
     await db.commit()
+    response_cache.invalidate("players", f"player:{player_id}", "player_summary")
     return {"success": True}
 
 @router.delete("/{player_id}", response_model=PlayerSchema)
@@ -175,4 +316,5 @@ async def delete_player(player_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Player not found")
     await db.delete(db_player)
     await db.commit()
+    response_cache.invalidate("players", f"player:{player_id}", "player_summary")
     return db_player
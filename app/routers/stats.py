@@ -1,21 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import and_, func
 from typing import List, Optional, Union, Dict, Any
+import json
+from datetime import date
 
 from ..models.database import get_db
 from ..models.models import Player, Game, ActionType  # Stat removed (normalized schema)
 from ..models.schemas import (
-
-
-
-
-
-
-
-    PlayerGameStats
+    Player as PlayerSchema,
+    PlayerGameStats,
+    ActionType as ActionTypeSchema
 )
+from ..models.aggregates import player_game_summaries
+from ..models.rallies import rally_metrics
+from ..analytics import analytics
+from ..cube import stat_cube
+from ..response_cache import response_cache
+from .games import game_schema
 
 router = APIRouter(
     prefix="/api/stats",
@@ -98,12 +101,131 @@ router = APIRouter(
         
 # Rest of function commented out for normalized schema migration
 
-# TODO: Implement player game summary endpoint using normalized schema (BaseStat + detail tables)
-# @router.get("/summary/player/{player_id}/game/{game_id}", response_model=Dict[str, Any])
-# async def get_player_game_summary(player_id: int, game_id: int, db: AsyncSession = Depends(get_db)):
-#     # Query using BaseStat and detail tables to build a comprehensive summary
-#     pass
-# Rest of function removed for schema migration
+@router.get("/summary/player/{player_id}/game/{game_id}", response_model=PlayerGameStats)
+async def get_player_game_summary(player_id: int, game_id: int, db: AsyncSession = Depends(get_db)):
+    """Summary of one player's stats in one game, read from the incremental aggregates"""
+    player = (await db.execute(select(Player).where(Player.id == player_id))).scalars().first()
+    if player is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    game = (await db.execute(select(Game).where(Game.id == game_id))).scalars().first()
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    summaries = await player_game_summaries(db, game_id, player_id=player_id)
+    return PlayerGameStats(
+        player=PlayerSchema(id=player.id, name=player.name),
+        game=game_schema(game),
+        **summaries.get(player_id, {})
+    )
+
+@router.get("/summary/game/{game_id}", response_model=List[PlayerGameStats])
+async def get_game_summary(game_id: int, db: AsyncSession = Depends(get_db)):
+    """Summaries for every player with stats in a game, read from the incremental aggregates"""
+    game = (await db.execute(select(Game).where(Game.id == game_id))).scalars().first()
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    
+    summaries = await player_game_summaries(db, game_id)
+    result = await db.execute(select(Player).where(Player.id.in_(summaries.keys())).order_by(Player.name))
+    game_response = game_schema(game)
+    return [
+        PlayerGameStats(player=PlayerSchema(id=p.id, name=p.name), game=game_response, **summaries[p.id])
+        for p in result.scalars().all()
+    ]
+
+@router.get("/analytics/{action_type}")
+async def stat_analytics(
+    action_type: ActionTypeSchema,
+    by: Optional[str] = None,
+    player_id: Optional[List[int]] = Query(None),
+    game_id: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """Cross-game detail counts and rates for one action type, e.g. attack efficiency by direction.
+
+    Answered from the in-memory columnar copy of all stats; repeat player_id or
+    game_id to filter on several.
+    """
+    await analytics.refresh(db)
+    try:
+        return analytics.breakdown(ActionType(action_type.value), by, player_ids=player_id, game_ids=game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/rallies")
+async def rally_summary(
+    request: Request,
+    by: str = "player",
+    player_id: Optional[List[int]] = Query(None),
+    game_id: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """Side-out, first-ball, transition and serving metrics per player or per team.
+
+    Read from the reconstructed rallies; by=team groups by pair of partners
+    across their games. Receiving metrics are also broken down by pass
+    rating. Repeat player_id or game_id to filter on several.
+    """
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    snapshot = response_cache.snapshot(["player_summary"])
+    try:
+        metrics = await rally_metrics(db, by, player_ids=player_id, game_ids=game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return response_cache.put(request, ["player_summary"], snapshot, metrics)
+
+def _names(values):
+    """Flatten repeated and comma-separated query values"""
+    return [name.strip() for value in values or [] for name in value.split(",") if name.strip()]
+
+@router.get("/cube")
+async def cube(
+    request: Request,
+    action_type: ActionTypeSchema,
+    dimension: Optional[List[str]] = Query(None),
+    measure: Optional[List[str]] = Query(None),
+    filter: Optional[List[str]] = Query(None),
+    player_id: Optional[List[int]] = Query(None),
+    game_id: Optional[List[int]] = Query(None),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    source: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Pivot one action type's stats, e.g. kills by player, attack_direction, attack_type and month.
+
+    dimension and measure take repeated or comma-separated names; filter takes
+    name:value pairs, repeatable, where values of the same name are alternatives
+    (filter=attack_type:hard&filter=attack_type:roll). start_date and
+    end_date bound the game date. Answered from the smallest precomputed
+    rollup that has every dimension used, else from the raw stats; the
+    response names the source, and source= forces one.
+    """
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    snapshot = response_cache.snapshot(["player_summary"])
+    filters = {}
+    for text in filter or []:
+        name, separator, value = text.partition(":")
+        if not separator:
+            raise HTTPException(status_code=400, detail=f"filter must be name:value, got {text!r}")
+        filters.setdefault(name.strip(), []).append(value)
+    if player_id:
+        filters.setdefault("player_id", []).extend(player_id)
+    if game_id:
+        filters.setdefault("game_id", []).extend(game_id)
+    try:
+        result = await stat_cube(
+            db, ActionType(action_type.value), by=_names(dimension), measure_names=_names(measure),
+            filters=filters, start_date=start_date, end_date=end_date, source=source
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Plain JSON types only, so skip jsonable_encoder's walk over every cell
+    return response_cache.put(request, ["player_summary"], snapshot, json.dumps(result, separators=(",", ":")).encode())
 
 # TODO: Implement delete stat endpoint using BaseStat and detail tables
 # @router.delete("/{stat_id}", response_model=StatResponse)
@@ -0,0 +1,56 @@
+"""Production server: several uvicorn worker processes on one port, sharing the SQLite file.
+
+From the repository root:
+
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+
+The supervisor applies pending migrations once, starts the message hub the
+workers use to keep their caches and live streams coherent (see bus.py) on
+BVB_BUS_SOCKET, then hands over to uvicorn's process manager. Reads scale
+with the number of workers; writes still take turns on SQLite's single
+write lock. Background jobs run in whichever worker holds the runner lock
+(see jobs.py). Write-behind mode keeps one append log per database and needs
+a single worker.
+"""
+import argparse
+import os
+
+import uvicorn
+
+from .bus import run_hub_thread
+from .models.config import DATABASE_PATH, WORKERS, WRITE_BEHIND_ENABLED
+from .models.database import engine
+from .models.migrations import upgrade_schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the server with several worker processes")
+    parser.add_argument("--workers", type=int, default=WORKERS, help=f"worker processes (default {WORKERS})")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if WRITE_BEHIND_ENABLED and args.workers > 1:
+        parser.error("BVB_WRITE_BEHIND=1 needs --workers 1")
+
+    # Once here, rather than racing in every worker's startup
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+    engine.dispose()
+
+    socket_path = None
+    if args.workers > 1:
+        # The workers read it from the environment they inherit
+        socket_path = os.path.abspath(os.environ.get("BVB_BUS_SOCKET") or f"{DATABASE_PATH}.bus.sock")
+        os.environ["BVB_BUS_SOCKET"] = socket_path
+        run_hub_thread(socket_path)
+    try:
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    main()
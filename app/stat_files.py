@@ -0,0 +1,153 @@
+"""Flat CSV/NDJSON stat records, as written by /api/export and read by the bulk importer.
+
+Each record is one stat: its base columns, the game's date, the player's
+name and team, then every detail field of every action type. Fields that do
+not apply to the stat's action type are empty (CSV) or null (NDJSON). Names
+and teams are included so a file can be loaded into another database, where
+ids differ.
+"""
+import csv
+import enum
+import io
+import json
+import os
+from datetime import datetime
+from itertools import compress
+
+from sqlalchemy import and_
+
+from .models.models import Game, GameParticipant, Player, format_timestamp
+from .models.stat_store import DETAIL_MODELS, stat_table, stats_query, row_details
+
+# Base fields, then each detail field once in detail table order; is_error is
+# shared by receive, attack and set stats
+DETAIL_FIELDS = list(dict.fromkeys(
+    column.name
+    for model in DETAIL_MODELS.values()
+    for column in model.__table__.columns
+    if column.name != "stat_id"
+))
+STAT_FIELDS = [
+    "stat_id", "game_id", "game_date", "player_id", "player_name", "team",
+    "action_type", "timestamp", "set_number", "rally_number",
+] + DETAIL_FIELDS
+
+FIELD_POSITIONS = {name: i for i, name in enumerate(STAT_FIELDS)}
+
+FORMATS = ("csv", "ndjson")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+def format_for(name, content_type=None):
+    """Format of a stat file from its content type or file name extension, or None"""
+    if content_type:
+        if "csv" in content_type:
+            return "csv"
+        if "ndjson" in content_type or "jsonl" in content_type:
+            return "ndjson"
+    return EXTENSIONS.get(os.path.splitext(name or "")[1].lower())
+
+
+def export_query():
+    """stats_query() plus each stat's game date, player name and team, which follow the usual columns"""
+    return (
+        stats_query()
+        .add_columns(Game.date, Player.name, GameParticipant.team)
+        .join(Game, Game.id == stat_table.c.game_id)
+        .join(Player, Player.id == stat_table.c.player_id)
+        .outerjoin(GameParticipant, and_(
+            GameParticipant.game_id == stat_table.c.game_id,
+            GameParticipant.player_id == stat_table.c.player_id,
+        ))
+    )
+
+
+def filtered_export_query(game_ids=None, player_ids=None, action_type=None, start_date=None, end_date=None):
+    """export_query() in stat id order, narrowed to games, players, an ActionType and inclusive game dates"""
+    query = export_query().order_by(stat_table.c.id)
+    if game_ids:
+        query = query.where(stat_table.c.game_id.in_(game_ids))
+    if player_ids:
+        query = query.where(stat_table.c.player_id.in_(player_ids))
+    if action_type is not None:
+        query = query.where(stat_table.c.action_type == action_type)
+    if start_date is not None:
+        query = query.where(Game.date >= start_date)
+    if end_date is not None:
+        query = query.where(Game.date <= end_date)
+    return query
+
+
+def _value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return format_timestamp(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def stat_values(row):
+    """Values of STAT_FIELDS, in order, for one export_query() row"""
+    game_date, player_name, team = row[-3:]
+    timestamp = row[4]
+    values = [
+        row[0], row[1], _value(game_date), row[2], player_name, team,
+        row[3].value, None if timestamp is None else format_timestamp(timestamp), row[5], row[6],
+    ]
+    values.extend([None] * len(DETAIL_FIELDS))
+    details = row_details(row)
+    if details is not None:
+        for name, value in details.items():
+            if name != "stat_id":
+                values[FIELD_POSITIONS[name]] = _value(value)
+    return values
+
+
+def stat_record(row):
+    """Flat dict of STAT_FIELDS for one export_query() row"""
+    return dict(zip(STAT_FIELDS, stat_values(row)))
+
+
+def encode_records(rows, format, header=False):
+    """Encode a batch of export_query() rows as CSV or NDJSON bytes"""
+    if format == "ndjson":
+        return "".join(json.dumps(stat_record(row), separators=(",", ":")) + "\n" for row in rows).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(STAT_FIELDS)
+    for row in rows:
+        # csv writes None as an empty field and booleans as True/False
+        writer.writerow(stat_values(row))
+    return buffer.getvalue().encode()
+
+
+def read_records(file, format):
+    """Yield a dict per record of a binary stat file, or the ValueError for an unreadable one.
+
+    Only the columns present in the file appear in each dict, and empty CSV
+    fields are left out, so record.get() reads them as None like JSON nulls.
+    """
+    if format == "ndjson":
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON: {str(e)}")
+                continue
+            yield record if isinstance(record, dict) else ValueError("Expected a JSON object")
+        return
+    reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    for values in reader:
+        if not values:
+            continue
+        yield dict(compress(zip(header, values), values))
@@ -0,0 +1,410 @@
+"""Bulk import of stat files in the /api/export format (see stat_files).
+
+Only action_type, player_name and a game_id or game_date column are
+required; other columns may be missing. Player names are resolved through
+an in-memory map of the players table, creating players that don't exist
+yet. Each distinct game of a file (its game_id column, or its game_date
+when there is none) becomes a new Game, with the players of each team
+column as participants.
+
+Records are loaded in transactions of IMPORT_BATCH_SIZE through the same
+bulk insert as the batch endpoint, which keeps the aggregates current. The
+games are new and nobody reads them yet, so their rollups, rallies and
+change log entries are computed once when the file is done (finish_games in
+stat_store) instead of row by row. Each transaction also advances an
+import_runs row keyed by the file's SHA-1: running an interrupted import
+again on the same file skips what was committed, and a finished file is not
+loaded twice.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from datetime import date
+from functools import lru_cache
+
+from sqlalchemy import Boolean, bindparam, insert, select, update
+
+from .models.database import AsyncSessionLocal, insert_many
+from .models.models import ActionType, Game, GameParticipant, ImportGame, ImportRun, Player, epoch_millis
+from .models.stat_store import DETAIL_MODELS, finish_games, insert_stat_rows
+from .response_cache import response_cache, stats_changed
+from .stat_files import read_records
+
+# Records per transaction
+IMPORT_BATCH_SIZE = 20000
+
+# Rejected records reported back with their error; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Values per IN (...) list; SQLite caps the number of bound parameters per statement
+IN_CHUNK_SIZE = 900
+
+TRUE_TEXT = {"true", "t", "yes", "y", "1"}
+FALSE_TEXT = {"false", "f", "no", "n", "0"}
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_TEXT:
+        return True
+    if text in FALSE_TEXT:
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def _enum_parser(enum_class):
+    # Values arrive as text from CSV and as text or numbers from NDJSON
+    members = {str(member.value): member for member in enum_class}
+
+    def parse(value):
+        try:
+            return members[str(value).strip()]
+        except KeyError:
+            raise ValueError(f"not one of {', '.join(members)}: {value!r}")
+    return parse
+
+
+def _detail_parsers(model):
+    parsers = []
+    for column in model.__table__.columns:
+        if column.name == "stat_id":
+            continue
+        enum_class = getattr(column.type, "enum_class", None)
+        if enum_class is not None:
+            parse = _enum_parser(enum_class)
+        elif isinstance(column.type, Boolean):
+            parse = _parse_bool
+        else:
+            parse = str
+        # Booleans default to False like the detail schemas, everything else to None
+        default = False if isinstance(column.type, Boolean) else None
+        parsers.append((column.name, parse, default))
+    return parsers
+
+
+DETAIL_PARSERS = {action_type: _detail_parsers(model) for action_type, model in DETAIL_MODELS.items()}
+DETAIL_NAMES = {action_type: [name for name, _, _ in parsers] for action_type, parsers in DETAIL_PARSERS.items()}
+
+
+ACTION_TYPES = {action_type.value: action_type for action_type in ActionType}
+
+
+def _optional_int(record, name):
+    value = record.get(name)
+    try:
+        return None if value is None else int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text):
+    # Every record of a game repeats its date
+    return date.fromisoformat(text)
+
+
+@lru_cache(maxsize=4096)
+def _parse_details(action_type, raw, raw_types):
+    # Detail values for the raw detail fields of an action type, or None. Files
+    # repeat a few combinations, so results are shared: callers must not modify
+    # them. raw_types only keeps JSON's 1, 1.0 and true apart in the cache key
+    if all(value is None for value in raw):
+        # A stat has details when any detail field of its action type is filled in
+        return None
+    values = {}
+    for (name, parse, default), value in zip(DETAIL_PARSERS[action_type], raw):
+        try:
+            values[name] = default if value is None else parse(value)
+        except ValueError as e:
+            raise ValueError(f"Invalid {name}: {str(e)}")
+    return values
+
+
+def parse_record(record):
+    """(game key, game date, player name, team, base_row, action_type, values) for one record, or ValueError"""
+    action_type = ACTION_TYPES.get(record.get("action_type"))
+    if action_type is None:
+        raise ValueError(f"Invalid action_type: {record.get('action_type')!r}")
+    player_name = record.get("player_name")
+    if player_name is None or not str(player_name).strip():
+        raise ValueError("Missing player_name")
+    game_key = record.get("game_id")
+    if game_key is None:
+        game_key = record.get("game_date")
+    if game_key is None:
+        raise ValueError("Needs a game_id or game_date")
+
+    timestamp = record.get("timestamp")
+    if timestamp is not None:
+        timestamp = epoch_millis(timestamp)
+        if timestamp is None:
+            raise ValueError(f"Invalid timestamp: {record.get('timestamp')!r}")
+    game_date = record.get("game_date")
+    if game_date is not None:
+        try:
+            game_date = _parse_date(str(game_date))
+        except ValueError:
+            raise ValueError(f"Invalid game_date: {game_date!r}")
+    team = _optional_int(record, "team")
+    base_row = {
+        "player_id": None,
+        "game_id": None,
+        "action_type": action_type,
+        "timestamp": timestamp,
+        "set_number": _optional_int(record, "set_number"),
+        "rally_number": _optional_int(record, "rally_number"),
+    }
+
+    raw = tuple(map(record.get, DETAIL_NAMES[action_type]))
+    try:
+        values = _parse_details(action_type, raw, tuple(map(type, raw)))
+    except TypeError:
+        # A JSON list or object can't be part of the cache key
+        values = _parse_details.__wrapped__(action_type, raw, None)
+    return str(game_key).strip(), game_date, str(player_name).strip(), team, base_row, action_type, values
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StatImport:
+    """State of one file's import: the run row and the player, game and participant maps"""
+
+    def __init__(self, run):
+        self.run = run
+        self.resumed_from = run.records_done
+        self.players = {}
+        self.games = {}
+        self.teams = {}
+        self.participants = set()
+        self.players_created = 0
+        self.games_created = 0
+        self.error_samples = []
+
+    async def load(self, db):
+        """Fill the maps from the database, including games created by an earlier attempt at this file"""
+        result = await db.execute(select(Player.name, Player.id))
+        self.players = dict(result.all())
+        result = await db.execute(
+            select(ImportGame.source_game, ImportGame.game_id).where(ImportGame.run_id == self.run.id)
+        )
+        self.games = dict(result.all())
+        self.teams = {game_id: {1: [], 2: []} for game_id in self.games.values()}
+        if self.games:
+            result = await db.execute(
+                select(GameParticipant.game_id, GameParticipant.team, GameParticipant.player_id)
+                .where(GameParticipant.game_id.in_(self.games.values()))
+                .order_by(GameParticipant.game_id, GameParticipant.team, GameParticipant.position)
+            )
+            for game_id, team, player_id in result.all():
+                self.teams[game_id].setdefault(team, []).append(player_id)
+                self.participants.add((game_id, player_id))
+
+    async def import_batch(self, db, results):
+        """Load a parse_batch() result in the open transaction"""
+        parsed = []
+        for number, result in results:
+            if isinstance(result, ValueError):
+                self.run.errors += 1
+                if len(self.error_samples) < MAX_REPORTED_ERRORS:
+                    self.error_samples.append({"record": number, "error": str(result)})
+            else:
+                parsed.append(result)
+
+        await self._create_players(db, {player_name for _, _, player_name, _, _, _, _ in parsed})
+        await self._create_games(db, {game_key: game_date for game_key, game_date, *_ in parsed})
+
+        stats = []
+        new_participants = {}
+        for game_key, _, player_name, team, base_row, action_type, values in parsed:
+            game_id = self.games[game_key]
+            player_id = self.players[player_name]
+            base_row["game_id"] = game_id
+            base_row["player_id"] = player_id
+            stats.append((base_row, action_type, values))
+            if team in (1, 2) and (game_id, player_id) not in self.participants:
+                self.participants.add((game_id, player_id))
+                new_participants[(game_id, player_id)] = team
+        await self._add_participants(db, new_participants)
+
+        await insert_stat_rows(db, stats, deferred=True)
+        # Flushed with the batch, so a resumed import starts right after it
+        self.run.records_done += len(results)
+        self.run.stats_imported += len(stats)
+        return {base_row["game_id"] for base_row, _, _ in stats}
+
+    async def finish(self, db):
+        """Catch up the rollups, rallies and change log of every game of the run, in the open transaction"""
+        game_ids = sorted(self.games.values())
+        conn = await db.connection()
+        for start in range(0, len(game_ids), IN_CHUNK_SIZE):
+            await conn.run_sync(finish_games, game_ids[start:start + IN_CHUNK_SIZE])
+        return game_ids
+
+    async def _create_players(self, db, names):
+        new_names = sorted(names - self.players.keys())
+        if not new_names:
+            return
+        await db.execute(insert(Player.__table__), [{"name": name} for name in new_names])
+        for start in range(0, len(new_names), IN_CHUNK_SIZE):
+            chunk = new_names[start:start + IN_CHUNK_SIZE]
+            result = await db.execute(select(Player.name, Player.id).where(Player.name.in_(chunk)))
+            self.players.update(result.all())
+        self.players_created += len(new_names)
+
+    async def _create_games(self, db, game_dates):
+        new_games = [(game_key, game_date) for game_key, game_date in game_dates.items() if game_key not in self.games]
+        if not new_games:
+            return
+        rows = [
+            {"date": game_date or date.today(), "team1": "[]", "team2": "[]"}
+            for _, game_date in new_games
+        ]
+        # Ids follow the first one, as in insert_stat_rows: the write lock is ours
+        result = await db.execute(insert(Game.__table__).returning(Game.id), rows[0])
+        first_id = result.scalar_one()
+        for game_id, row in enumerate(rows[1:], start=first_id + 1):
+            row["id"] = game_id
+        await insert_many(db, Game.__table__, rows[1:])
+
+        import_rows = []
+        for game_id, (game_key, _) in enumerate(new_games, start=first_id):
+            import_rows.append({"run_id": self.run.id, "source_game": game_key, "game_id": game_id})
+            self.games[game_key] = game_id
+            self.teams[game_id] = {1: [], 2: []}
+        await insert_many(db, ImportGame.__table__, import_rows)
+        self.games_created += len(new_games)
+
+    async def _add_participants(self, db, new_participants):
+        if not new_participants:
+            return
+        rows = []
+        for (game_id, player_id), team in new_participants.items():
+            players = self.teams[game_id].setdefault(team, [])
+            rows.append({"game_id": game_id, "team": team, "position": len(players), "player_id": player_id})
+            players.append(player_id)
+        await insert_many(db, GameParticipant.__table__, rows)
+        # Keep the JSON team columns older readers use in step with game_participants
+        table = Game.__table__
+        await db.execute(
+            update(table).where(table.c.id == bindparam("game_id")).values(
+                team1=bindparam("team1"), team2=bindparam("team2")
+            ),
+            [
+                {"game_id": game_id, "team1": json.dumps(self.teams[game_id].get(1, [])),
+                 "team2": json.dumps(self.teams[game_id].get(2, []))}
+                for game_id in {game_id for game_id, _ in new_participants}
+            ],
+        )
+
+    def summary(self, started):
+        elapsed = time.perf_counter() - started
+        imported = self.run.records_done - self.resumed_from
+        return {
+            "run_id": self.run.id,
+            "source_name": self.run.source_name,
+            "status": self.run.status,
+            "records": self.run.records_done,
+            "resumed_from": self.resumed_from,
+            "stats_imported": self.run.stats_imported,
+            "errors": self.run.errors,
+            "error_samples": self.error_samples,
+            "players_created": self.players_created,
+            "games_created": self.games_created,
+            "seconds": round(elapsed, 3),
+            "records_per_second": round(imported / elapsed) if elapsed else None,
+        }
+
+
+async def import_stat_file(path, format, source_name=None, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Import a CSV or NDJSON stat file, resuming an earlier interrupted run of the same file.
+
+    ``progress`` is called with the summary dict and the ids of the games the
+    batch wrote to after every committed batch. Returns the final summary.
+    """
+    started = time.perf_counter()
+    source_hash = file_hash(path)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(ImportRun).where(ImportRun.source_hash == source_hash))
+        run = result.scalars().first()
+        if run is None:
+            run = ImportRun(source_hash=source_hash, source_name=source_name or path, status="running",
+                            records_done=0, stats_imported=0, errors=0)
+            db.add(run)
+            await db.commit()
+        state = StatImport(run)
+        if run.status == "done":
+            return state.summary(started)
+        await state.load(db)
+
+        with open(path, "rb") as file:
+            batches = record_batches(file, format, run.records_done, batch_size)
+            # Read and parse each batch in a worker thread while the previous one is
+            # being inserted; SQLite releases the GIL while it works
+            parsing = asyncio.create_task(asyncio.to_thread(parse_batch, batches))
+            while True:
+                results = await parsing
+                if results is None:
+                    break
+                parsing = asyncio.create_task(asyncio.to_thread(parse_batch, batches))
+                try:
+                    await _commit_batch(db, state, results, started, progress)
+                except BaseException:
+                    # Don't close the file under a running parse
+                    await asyncio.gather(parsing, return_exceptions=True)
+                    raise
+
+        game_ids = await state.finish(db)
+        run.status = "done"
+        await db.commit()
+        for game_id in game_ids:
+            stats_changed(game_id)
+        return state.summary(started)
+
+
+def record_batches(file, format, skip, batch_size):
+    """Lists of up to batch_size (record number, record) pairs, after the first ``skip`` records"""
+    batch = []
+    for number, record in enumerate(read_records(file, format), start=1):
+        if number <= skip:
+            continue
+        batch.append((number, record))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_batch(batches):
+    """Parse the next batch into (record number, parse_record() result or ValueError) pairs, None at the end"""
+    batch = next(batches, None)
+    if batch is None:
+        return None
+    results = []
+    for number, record in batch:
+        try:
+            if isinstance(record, Exception):
+                raise record
+            results.append((number, parse_record(record)))
+        except ValueError as e:
+            results.append((number, e))
+    return results
+
+
+async def _commit_batch(db, state, results, started, progress):
+    game_ids = await state.import_batch(db, results)
+    await db.commit()
+    response_cache.invalidate("games", "players")
+    for game_id in game_ids:
+        stats_changed(game_id)
+    if progress is not None:
+        progress(state.summary(started), game_ids)
@@ -10,7 +10,61 @@ document.addEventListener('DOMContentLoaded', async () => {
   // Fetch game and player info
   const game = await fetch(`/api/games/${gameId}`).then(r => r.json());
   const players = await fetch('/api/players').then(r => r.json());
-  let stats = await fetch(`/api/games/${gameId}/stats`).then(r => r.json()).catch(() => []);
+  // Change sequence of the last delta seen, used to poll for other scorers' entries
+  let changeCursor = null;
+  let stats = await fetchAllStats().catch(() => []);
+
+  // Stats are served one page at a time; follow the cursor header to the last page
+  async function fetchAllStats() {
+    const all = [];
+    let cursor = null;
+    do {
+      const query = cursor ? `?limit=5000&cursor=${encodeURIComponent(cursor)}` : '?limit=5000';
+      const resp = await fetch(`/api/games/${gameId}/stats${query}`);
+      if (!resp.ok) throw new Error('Failed to load stats');
+      if (changeCursor === null) changeCursor = resp.headers.get('X-Change-Cursor');
+      all.push(...await resp.json());
+      cursor = resp.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return all;
+  }
+
+  const statId = stat => (stat.base || stat).id;
+
+  // Merge a {stats, deleted} change set into the local list
+  function applyChanges(delta) {
+    if (delta.stats.length === 0 && delta.deleted.length === 0) return;
+    const changedIds = new Set([...delta.deleted, ...delta.stats.map(statId)]);
+    stats = stats.filter(s => !changedIds.has(statId(s))).concat(delta.stats);
+    renderStatHistory();
+    document.getElementById('undo-btn').disabled = stats.length === 0;
+  }
+
+  // Fetch everything added or deleted since the last cursor
+  async function pollChanges() {
+    if (changeCursor === null) return;
+    try {
+      const resp = await fetch(`/api/games/${gameId}/stats?since=${changeCursor}`);
+      if (!resp.ok) return;
+      const delta = await resp.json();
+      changeCursor = delta.cursor;
+      applyChanges(delta);
+    } catch (error) {
+      console.error('Error polling stat changes:', error);
+    }
+  }
+
+  // Live updates are pushed over server-sent events; polling is the fallback
+  // when the stream is unavailable or reports that events were dropped
+  if (window.EventSource) {
+    const events = new EventSource(`/api/games/${gameId}/stats/stream`);
+    events.onmessage = e => applyChanges(JSON.parse(e.data));
+    events.addEventListener('overflow', pollChanges);
+    events.onerror = pollChanges;
+    setInterval(pollChanges, 30000);
+  } else {
+    setInterval(pollChanges, 2000);
+  }
 
   // Render game meta
   document.getElementById('game-meta').innerHTML = `<strong>Date:</strong> ${game.date} <br><strong>Score:</strong> ${game.score || '0-0'}`;
@@ -163,8 +217,11 @@ document.addEventListener('DOMContentLoaded', async () => {
             body: JSON.stringify(statPayload)
           });
           if (!response.ok) throw new Error('Failed to save stat');
+          // 202 means the server buffered the stat; it arrives over the event stream once committed
+          if (response.status === 202) return;
           // Add to stats array
           const newStat = await response.json();
+          stats = stats.filter(s => statId(s) !== statId(newStat));
           stats.push(newStat);
           // Update history
           renderStatHistory();
@@ -314,18 +371,18 @@ document.addEventListener('DOMContentLoaded', async () => {
     try {
       // Get the latest stat
       const latestStat = stats.reduce((latest, stat) => {
-        return new Date(stat.timestamp) > new Date(latest.timestamp) ? stat : latest;
+        return statId(stat) > statId(latest) ? stat : latest;
       }, stats[0]);
       
       // Delete from API
-      const response = await fetch(`/api/games/${gameId}/stats/${latestStat.id}`, {
+      const response = await fetch(`/api/games/${gameId}/stats/${statId(latestStat)}`, {
         method: 'DELETE'
       });
       
       if (!response.ok) throw new Error('Failed to delete stat');
       
       // Remove from stats array
-      stats = stats.filter(s => s.id !== latestStat.id);
+      stats = stats.filter(s => statId(s) !== statId(latestStat));
       
       // Update history
       renderStatHistory();
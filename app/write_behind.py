@@ -0,0 +1,231 @@
+"""Optional write-behind buffer for high-rate stat entry.
+
+When enabled, POST /api/games/{id}/stats acknowledges a stat as soon as it is
+appended to an on-disk NDJSON log. A background task group-commits buffered
+stats to the configured stat tables every few milliseconds or every N records,
+whichever comes first. Committed stats reach clients through the
+live event stream and the ?since= delta feed like any other insert.
+
+Each group commit also records the highest log sequence it applied, in the
+same transaction. On startup the log is replayed from that point, so a crash
+between append and commit loses nothing and replays nothing twice.
+
+A group that fails to commit for a reason other than the database being busy
+is retried one stat at a time. Stats that still fail, such as a stat whose
+game was deleted before it was flushed, are moved to a rejected-stats file
+with the error, so they cannot hold up the stats acknowledged after them.
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from .events import broker
+from .response_cache import stats_changed
+from .models.config import WRITE_BEHIND_ENABLED, WRITE_BEHIND_LOG_PATH, WRITE_BEHIND_INTERVAL_MS
+from .models.config import WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_FSYNC, WRITE_BEHIND_REJECTED_PATH
+from .models.database import AsyncSessionLocal
+from .models.models import WriteBehindState
+from .models.schemas import CreateStatRequest
+from .models.stat_store import insert_stats, stat_table, stats_query, serialize_stat_row
+
+
+class StatWriteBuffer:
+    def __init__(self, log_path, interval_ms, max_batch, fsync=False, enabled=True, rejected_path=None):
+        self.log_path = log_path
+        self.rejected_path = rejected_path or f"{log_path}.rejected"
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.enabled = enabled
+        self._fd = None
+        self._next_seq = 1
+        self._pending = []
+        # Highest sequence committed or rejected by this process
+        self._done_seq = 0
+        self.rejected = 0
+        self._wakeup = None
+        self._stopping = False
+        self._task = None
+
+    async def start(self):
+        """Replay anything left in the log by a previous run, then start group-committing"""
+        applied_seq = await self._applied_seq()
+        leftover = []
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as log:
+                for line in log:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append was never acknowledged
+                        continue
+                    self._next_seq = max(self._next_seq, record["seq"] + 1)
+                    if record["seq"] > applied_seq:
+                        leftover.append(record)
+        self._next_seq = max(self._next_seq, applied_seq + 1)
+        if leftover:
+            print(f"Replaying {len(leftover)} buffered stats from {self.log_path}")
+            for i in range(0, len(leftover), self.max_batch):
+                await self._commit_or_reject(leftover[i:i + self.max_batch])
+
+        self._fd = os.open(self.log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Drain every buffered stat to the database and close the log"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            if not self._pending:
+                os.truncate(self.log_path, 0)
+
+    def append(self, game_id, stat_request):
+        """Durably log a stat and return its log sequence; the database write happens later"""
+        seq = self._next_seq
+        self._next_seq += 1
+        # Stamp with the server time now, as add_game_stat does when writing directly
+        stat_request.base_stat.timestamp = datetime.now(timezone.utc)
+        record = {"seq": seq, "game_id": game_id, "request": stat_request.dict()}
+        os.write(self._fd, (json.dumps(record, default=str) + "\n").encode())
+        if self.fsync:
+            os.fsync(self._fd)
+        self._pending.append(record)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return seq
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def has_pending(self, game_id):
+        return any(record["game_id"] == game_id for record in self._pending)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending:
+                try:
+                    await self._commit_next()
+                except OperationalError as e:
+                    # Keep the stats buffered and retry on the next tick; on shutdown
+                    # they stay in the log and are replayed on the next start
+                    print(f"Error committing buffered stats: {type(e).__name__}: {e}")
+                    if self._stopping:
+                        return
+                    continue
+                if len(self._pending) >= self.max_batch:
+                    self._wakeup.set()
+                continue
+            if self._stopping:
+                return
+
+    async def _commit_next(self):
+        batch = self._pending[:self.max_batch]
+        try:
+            await self._commit_or_reject(batch)
+        finally:
+            # A busy database can interrupt the one-by-one retry; the stats it
+            # already committed or rejected must not be inserted again
+            done = sum(1 for record in batch if record["seq"] <= self._done_seq)
+            del self._pending[:done]
+        if not self._pending:
+            # Everything logged so far is committed, so the log can start over
+            os.ftruncate(self._fd, 0)
+
+    async def _commit_or_reject(self, records):
+        """Commit a group, falling back to one stat at a time and rejecting those that still fail
+
+        A busy or unreachable database (OperationalError) is raised instead,
+        since every stat would fail the same way.
+        """
+        try:
+            await self._commit(records)
+            self._done_seq = records[-1]["seq"]
+            return
+        except OperationalError:
+            raise
+        except Exception as e:
+            print(f"Error committing {len(records)} buffered stats, retrying one by one: {type(e).__name__}: {e}")
+        for record in records:
+            try:
+                await self._commit([record])
+            except OperationalError:
+                raise
+            except Exception as e:
+                print(f"Rejected buffered stat {record['seq']} for game {record['game_id']}: {type(e).__name__}: {e}")
+                self._reject(record, e)
+                self._done_seq = record["seq"]
+                await self._mark_applied(record["seq"])
+                continue
+            self._done_seq = record["seq"]
+
+    def _reject(self, record, error):
+        with open(self.rejected_path, "a") as rejected:
+            rejected.write(json.dumps({**record, "error": f"{type(error).__name__}: {error}"}, default=str) + "\n")
+            if self.fsync:
+                rejected.flush()
+                os.fsync(rejected.fileno())
+        self.rejected += 1
+
+    async def _mark_applied(self, seq):
+        async with AsyncSessionLocal() as db:
+            await self._set_applied_seq(db, seq)
+            await db.commit()
+
+    async def _set_applied_seq(self, db, seq):
+        state = await db.get(WriteBehindState, 1)
+        if state is None:
+            state = WriteBehindState(id=1, applied_seq=0)
+            db.add(state)
+        state.applied_seq = max(state.applied_seq, seq)
+
+    async def _applied_seq(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(WriteBehindState.applied_seq).where(WriteBehindState.id == 1))
+            return result.scalar() or 0
+
+    async def _commit(self, records):
+        """Insert a group of log records in one transaction and publish them"""
+        by_game = {}
+        for record in records:
+            by_game.setdefault(record["game_id"], []).append(CreateStatRequest(**record["request"]))
+
+        async with AsyncSessionLocal() as db:
+            inserted = {}
+            for game_id, stat_requests in by_game.items():
+                inserted[game_id] = await insert_stats(db, game_id, stat_requests)
+            await self._set_applied_seq(db, records[-1]["seq"])
+            await db.commit()
+
+            for game_id, stat_ids in inserted.items():
+                if stat_ids:
+                    stats_changed(game_id)
+                if stat_ids and broker.has_subscribers(game_id):
+                    result = await db.execute(stats_query().where(stat_table.c.id.in_(stat_ids)).order_by(stat_table.c.id))
+                    broker.publish(game_id, stats=[serialize_stat_row(row) for row in result.all()])
+
+
+write_buffer = StatWriteBuffer(
+    WRITE_BEHIND_LOG_PATH,
+    WRITE_BEHIND_INTERVAL_MS,
+    WRITE_BEHIND_MAX_BATCH,
+    fsync=WRITE_BEHIND_FSYNC,
+    enabled=WRITE_BEHIND_ENABLED,
+    rejected_path=WRITE_BEHIND_REJECTED_PATH,
+)
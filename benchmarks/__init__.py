@@ -0,0 +1 @@
+"""Reproducible load tests and benchmarks for the stat tracker; see run.py."""
@@ -0,0 +1,73 @@
+"""Compare two benchmark result files metric by metric.
+
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json [--filter p99]
+
+Every numeric value present in both files is listed with its relative
+change. Latencies, seconds and statement counts are better when lower;
+throughputs are better when higher.
+"""
+import argparse
+import json
+import sys
+
+# Metric names (last path component) where a larger number is an improvement
+HIGHER_IS_BETTER = ("throughput_rps", "per_second", "events_delivered")
+
+# Run details and dataset sizes, which are not measurements
+SKIPPED = {
+    "wall_seconds", "count", "scale", "concurrency", "seed", "cpu_count", "burst_size", "status",
+    "players", "games", "stats", "records", "rows", "bytes", "taps", "subscribers", "stats_posted",
+    "events_expected", "stats_committed", "analytics_rows", "bytes_mean", "rallies",
+    "game_rollup", "day_rollup",
+}
+
+
+def flatten(value, prefix=""):
+    """Dotted path -> number for every numeric leaf"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--filter", action="append", help="only metrics whose path contains this text (repeatable)")
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    for setting in ("scale", "concurrency", "seed"):
+        if old.get(setting) != new.get(setting):
+            print(f"warning: {setting} differs ({old.get(setting)} vs {new.get(setting)})", file=sys.stderr)
+
+    print(f"old: {old.get('commit', '?')[:8]} {old.get('subject', '')}")
+    print(f"new: {new.get('commit', '?')[:8]} {new.get('subject', '')}")
+    old_metrics = dict(flatten(old.get("scenarios", {})))
+    new_metrics = dict(flatten(new.get("scenarios", {})))
+    width = max((len(path) for path in new_metrics), default=0)
+    for path, new_value in new_metrics.items():
+        name = path.rsplit(".", 1)[-1]
+        if name in SKIPPED or ".statuses." in path or path not in old_metrics:
+            continue
+        if args.filter and not any(text in path for text in args.filter):
+            continue
+        old_value = old_metrics[path]
+        if old_value == new_value:
+            change = "="
+        elif old_value == 0:
+            change = "new"
+        else:
+            ratio = (new_value - old_value) / abs(old_value)
+            better = (ratio > 0) == any(marker in name for marker in HIGHER_IS_BETTER)
+            change = f"{ratio:+.1%} {'better' if better else 'worse'}"
+        print(f"{path:<{width}}  {old_value:>12}  {new_value:>12}  {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Seeded synthetic beach volleyball matches.
+
+A match is two teams of two playing best-of-three rally-scored sets to 21
+(15 in the third), won by two. Each rally is the touch sequence a scorer would
+log: a serve, the receiving team's pass, set and attack, then block, dig, set
+and attack transitions until a kill, an error or a stuff block ends it. The
+rates are rough tour averages, enough to give the detail tables realistic
+value distributions and the rally/set numbers realistic ranges.
+
+Everything comes from one random.Random(seed), so the same seed always yields
+the same players, games and touches.
+"""
+import csv
+import random
+from datetime import date, datetime, time, timedelta, timezone
+
+from app.stat_files import DETAIL_FIELDS
+
+SERVE_TYPES = (("float", 0.45), ("hybrid", 0.15), ("topspin", 0.15), ("jump", 0.25))
+SERVE_TARGETS = ("1", "2", "3", "4", "5", "6")
+PASS_RATINGS = ((0, 0.12), (1, 0.28), (2, 0.40), (3, 0.20))
+SET_TYPES = (("bump", 0.60), ("hand", 0.35), ("jump", 0.05))
+ATTACK_TYPES = (("hard", 0.60), ("roll", 0.20), ("tip", 0.20))
+ATTACK_DIRECTIONS = (("line", 0.30), ("angle", 0.35), ("cut", 0.25), ("jumbo", 0.10))
+DIG_QUALITIES = (("good", 0.35), ("playable", 0.45), ("poor", 0.20))
+
+# Sets needed to win a match, and the points needed to win each set
+SETS_TO_WIN = 2
+SET_POINTS = (21, 21, 15)
+
+# A rally still going after this many attacks ends on the next one
+MAX_ATTACKS_PER_RALLY = 12
+
+# Columns of the import files written by write_import_file
+IMPORT_FIELDS = [
+    "game_id", "game_date", "player_name", "team", "action_type", "timestamp", "set_number", "rally_number",
+] + DETAIL_FIELDS
+
+
+class Touch:
+    """One logged stat; slot is the player's position in the match, 0-1 for team 1 and 2-3 for team 2"""
+    __slots__ = ("slot", "action_type", "timestamp", "set_number", "rally_number", "details")
+
+    def __init__(self, slot, action_type, timestamp, set_number, rally_number, details):
+        self.slot = slot
+        self.action_type = action_type
+        self.timestamp = timestamp
+        self.set_number = set_number
+        self.rally_number = rally_number
+        self.details = details
+
+    @property
+    def team(self):
+        return 1 if self.slot < 2 else 2
+
+
+class MatchGenerator:
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def _pick(self, weighted):
+        roll = self.random.random()
+        for value, weight in weighted:
+            roll -= weight
+            if roll < 0:
+                return value
+        return weighted[-1][0]
+
+    def player_names(self, count):
+        return [f"Player {i:04d}" for i in range(1, count + 1)]
+
+    def schedule(self, player_count, game_count, start=date(2024, 5, 1), games_per_day=8):
+        """(date, team1, team2) for game_count games between fixed pairs of player indexes"""
+        order = list(range(player_count))
+        self.random.shuffle(order)
+        teams = [order[i:i + 2] for i in range(0, player_count - 1, 2)]
+        games = []
+        for i in range(game_count):
+            team1, team2 = self.random.sample(teams, 2)
+            games.append((start + timedelta(days=i // games_per_day), list(team1), list(team2)))
+        return games
+
+    def match(self, start):
+        """Touches of one best-of-three match starting at the given datetime"""
+        touches = []
+        clock = start
+        sets_won = [0, 0]
+        serving = self.random.choice((1, 2))
+        # Partners take turns serving each time their team wins the serve back
+        next_server = {1: 0, 2: 2}
+        set_number = 0
+        while max(sets_won) < SETS_TO_WIN:
+            set_number += 1
+            target = SET_POINTS[set_number - 1]
+            score = [0, 0]
+            rally_number = 0
+            while not (max(score) >= target and abs(score[0] - score[1]) >= 2):
+                rally_number += 1
+                winner, clock = self._rally(touches, serving, next_server[serving], clock, set_number, rally_number)
+                score[winner - 1] += 1
+                if winner != serving:
+                    serving = winner
+                    next_server[winner] = (next_server[winner] + 1) % 2 + (winner - 1) * 2
+                clock += timedelta(seconds=self.random.uniform(12, 30))
+            sets_won[0 if score[0] > score[1] else 1] += 1
+            clock += timedelta(seconds=120)
+        return touches
+
+    def game_touches(self, count, start):
+        """Exactly count touches, from as many back-to-back matches as it takes (a long logging session)"""
+        touches = []
+        while len(touches) < count:
+            match = self.match(start)
+            touches.extend(match)
+            start = match[-1].timestamp + timedelta(minutes=10)
+        return touches[:count]
+
+    def _rally(self, touches, serving, server, clock, set_number, rally_number):
+        """Append one rally's touches; returns the team that won it and the clock after it"""
+        random_ = self.random.random
+
+        def log(slot, action_type, details):
+            nonlocal clock
+            clock += timedelta(seconds=self.random.uniform(0.8, 2.5))
+            touch = Touch(slot, action_type, clock, set_number, rally_number, details)
+            touches.append(touch)
+            return touch
+
+        receiving = 3 - serving
+        serve = log(server, "serving", {
+            "is_ace": False,
+            "is_missed": False,
+            "serve_type": self._pick(SERVE_TYPES),
+            "serve_target": self.random.choice(SERVE_TARGETS),
+            "opponent_pass_quality": None,
+        })
+        if random_() < 0.08:
+            serve.details["is_missed"] = True
+            return receiving, clock
+        passer = (receiving - 1) * 2 + self.random.randrange(2)
+        if random_() < 0.06:
+            serve.details["is_ace"] = True
+            # Most aces are touched by the receiver
+            if random_() < 0.5:
+                log(passer, "serve_receive", {"is_good_pass": False, "is_error": True, "pass_rating": 0})
+            return serving, clock
+        rating = self._pick(PASS_RATINGS)
+        serve.details["opponent_pass_quality"] = rating
+        log(passer, "serve_receive", {"is_good_pass": rating >= 2, "is_error": False, "pass_rating": rating})
+
+        # The player who passed or dug attacks; their partner sets
+        attacking, attacker, quality = receiving, passer, rating
+        last_dig = None
+        for attack_count in range(1, MAX_ATTACKS_PER_RALLY + 1):
+            defending = 3 - attacking
+            setter = attacker ^ 1
+            killable = random_() < 0.35 + 0.15 * quality
+            set_touch = log(setter, "set", {"is_killable": killable, "is_error": False, "set_type": self._pick(SET_TYPES)})
+            if random_() < 0.02:
+                set_touch.details["is_error"] = True
+                return defending, clock
+
+            attack = log(attacker, "attack", {
+                "is_kill": False,
+                "is_error": False,
+                "is_blocked": False,
+                "attack_type": self._pick(ATTACK_TYPES),
+                "attack_direction": self._pick(ATTACK_DIRECTIONS),
+            })
+            blocker = (defending - 1) * 2 + self.random.randrange(2)
+            defender = blocker ^ 1
+            roll = random_()
+            kill_rate = 0.38 + (0.12 if killable else 0.0)
+            if roll < kill_rate or attack_count == MAX_ATTACKS_PER_RALLY:
+                attack.details["is_kill"] = True
+                if last_dig is not None and last_dig.team == attacking:
+                    last_dig.details["led_to_kill"] = True
+                if random_() < 0.3:
+                    log(defender, "dig", {"is_successful": False, "led_to_kill": False, "dig_quality": None})
+                return attacking, clock
+            if roll < kill_rate + 0.10:
+                attack.details["is_error"] = True
+                return defending, clock
+            if roll < kill_rate + 0.17:
+                attack.details["is_blocked"] = True
+                log(blocker, "block", {"is_stuff": True, "is_touch": False})
+                return defending, clock
+
+            if random_() < 0.25:
+                log(blocker, "block", {"is_stuff": False, "is_touch": True})
+            dig_quality = self._pick(DIG_QUALITIES)
+            last_dig = log(defender, "dig", {"is_successful": True, "led_to_kill": False, "dig_quality": dig_quality})
+            attacking, attacker = defending, defender
+            quality = {"good": 2, "playable": 1, "poor": 0}[dig_quality]
+        return attacking, clock
+
+
+def game_start(game_date, index_of_day=0):
+    """When the index_of_day-th game of a day starts, in UTC"""
+    return datetime.combine(game_date, time(9, 0), tzinfo=timezone.utc) + timedelta(hours=index_of_day)
+
+
+def stat_request(touch, game_id, player_ids):
+    """CreateStatRequest JSON for a touch; player_ids maps the match's slots to player ids"""
+    request = {
+        "base_stat": {
+            "game_id": game_id,
+            "player_id": player_ids[touch.slot],
+            "action_type": touch.action_type,
+            "timestamp": touch.timestamp.isoformat(),
+            "set_number": touch.set_number,
+            "rally_number": touch.rally_number,
+        }
+    }
+    key = {"serving": "serve_stat", "serve_receive": "receive_stat"}.get(touch.action_type, f"{touch.action_type}_stat")
+    request[key] = touch.details
+    return request
+
+
+def write_import_file(path, games):
+    """Write a CSV for the bulk importer from (game key, date, slot player names, touches) tuples.
+
+    Returns the number of records written.
+    """
+    count = 0
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(IMPORT_FIELDS)
+        detail_positions = {name: i for i, name in enumerate(IMPORT_FIELDS)}
+        width = len(IMPORT_FIELDS)
+        for game_key, game_date, names, touches in games:
+            day = game_date.isoformat()
+            for touch in touches:
+                values = [
+                    game_key, day, names[touch.slot], touch.team, touch.action_type,
+                    touch.timestamp.isoformat(), touch.set_number, touch.rally_number,
+                ]
+                values.extend([None] * (width - len(values)))
+                for name, value in touch.details.items():
+                    values[detail_positions[name]] = value
+                writer.writerow(values)
+            count += len(touches)
+    return count
+
+
+def season_games(generator, player_names, game_count, touches_per_game=None):
+    """(game key, date, slot player names, touches) for a generated season, one game at a time
+
+    Games are full matches unless touches_per_game is given.
+    """
+    day_index = {}
+    for number, (game_date, team1, team2) in enumerate(
+        generator.schedule(len(player_names), game_count), start=1
+    ):
+        index_of_day = day_index.get(game_date, 0)
+        day_index[game_date] = index_of_day + 1
+        start = game_start(game_date, index_of_day)
+        touches = generator.match(start) if touches_per_game is None else generator.game_touches(touches_per_game, start)
+        yield number, game_date, [player_names[i] for i in team1 + team2], touches
@@ -0,0 +1,326 @@
+"""In-process load driver: calls the ASGI app directly and records latency and SQL counts.
+
+Requests never touch a socket, so the numbers measure the application and
+SQLite rather than HTTP parsing. The statement count of every request is read
+back from the Server-Timing header that MetricsMiddleware adds; for streamed
+responses it only covers what ran before the first byte. HttpClient sends the
+same requests over keep-alive connections to a server in another process, for
+scenarios that measure the server itself (see app/serve.py).
+"""
+import asyncio
+import json
+import os
+import re
+import resource
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+SERVER_TIMING_STATEMENTS = re.compile(r'desc="(\d+) SQL statements"')
+
+
+class Response:
+    __slots__ = ("status", "headers", "body", "size")
+
+    def __init__(self, status, headers, body, size):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.size = size
+
+    def json(self):
+        return json.loads(self.body)
+
+    @property
+    def statements(self):
+        match = SERVER_TIMING_STATEMENTS.search(self.headers.get("server-timing", ""))
+        return int(match.group(1)) if match else None
+
+
+class AsgiClient:
+    """Minimal HTTP client for an ASGI app that can stream response bodies"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, url, body=None, headers=None, on_chunk=None, disconnect=None):
+        """Send one request; the body is kept unless on_chunk takes each chunk instead.
+
+        A streaming response runs until the app finishes it or the disconnect
+        event is set.
+        """
+        parts = urlsplit(url)
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers = {"content-type": "application/json", **(headers or {})}
+        body = body or b""
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": parts.path,
+            "raw_path": parts.path.encode(),
+            "query_string": parts.query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"benchmark")] + [
+                (name.lower().encode(), value.encode()) for name, value in (headers or {}).items()
+            ] + [(b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 50000),
+            "server": ("benchmark", 80),
+        }
+        disconnect = disconnect or asyncio.Event()
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        start = {}
+        chunks = []
+        size = 0
+
+        async def send(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                start["status"] = message["status"]
+                start["headers"] = {name.decode().lower(): value.decode() for name, value in message.get("headers", ())}
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+                else:
+                    chunks.append(chunk)
+
+        await self.app(scope, receive, send)
+        return Response(start.get("status"), start.get("headers", {}), b"".join(chunks), size)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, body=None, **kwargs):
+        return await self.request("POST", url, body=body, **kwargs)
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 client with the AsgiClient interface, over a pool of keep-alive connections"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._idle = []
+
+    async def request(self, method, url, body=None, headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers = {"content-type": "application/json", **(headers or {})}
+        body = body or b""
+        head = [f"{method} {url} HTTP/1.1", f"host: {self.host}:{self.port}", f"content-length: {len(body)}"]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        request = ("\r\n".join(head) + "\r\n\r\n").encode() + body
+        if self._idle:
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(request)
+            response = await self._read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if response.headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+        return response
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Server closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b"".join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return Response(status, headers, body, len(body))
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, body=None, **kwargs):
+        return await self.request("POST", url, body=body, **kwargs)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+@asynccontextmanager
+async def running(app):
+    """Run the app's startup and shutdown handlers around a block"""
+    await app.router.startup()
+    try:
+        yield AsgiClient(app)
+    finally:
+        await app.router.shutdown()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(seconds):
+    """count, mean and percentiles in milliseconds of a list of durations in seconds"""
+    values = sorted(seconds)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+class Recorder:
+    """Latency, status, SQL statement count and size of every request, per endpoint label"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.bytes = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, label, seconds, response):
+        self.latencies[label].append(seconds)
+        self.statuses[label][response.status] += 1
+        self.bytes[label] += response.size
+        if response.statements is not None:
+            self.statements[label].append(response.statements)
+
+    def summary(self, wall_seconds=None):
+        endpoints = {}
+        for label, seconds in sorted(self.latencies.items()):
+            result = latency_summary(seconds)
+            if wall_seconds:
+                result["throughput_rps"] = round(len(seconds) / wall_seconds, 1)
+            statements = self.statements.get(label)
+            if statements:
+                result["sql_statements_mean"] = round(sum(statements) / len(statements), 2)
+                result["sql_statements_max"] = max(statements)
+            result["bytes_mean"] = round(self.bytes[label] / len(seconds))
+            result["statuses"] = {str(status): count for status, count in sorted(self.statuses[label].items())}
+            endpoints[label] = result
+        return endpoints
+
+
+async def timed(client, recorder, label, method, url, **kwargs):
+    started = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    recorder.add(label, time.perf_counter() - started, response)
+    return response
+
+
+async def run_load(client, requests, concurrency):
+    """Send (label, method, url, body) requests from an iterable through concurrency workers.
+
+    Returns the per-endpoint summary with throughput over the whole run.
+    """
+    recorder = Recorder()
+    requests = iter(requests)
+
+    async def worker():
+        for label, method, url, body in requests:
+            await timed(client, recorder, label, method, url, body=body)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    endpoints = recorder.summary(wall)
+    total = sum(len(v) for v in recorder.latencies.values())
+    return {"requests": total, "seconds": round(wall, 3), "throughput_rps": round(total / wall, 1), "endpoints": endpoints}
+
+
+def rss_bytes():
+    """Current anonymous resident memory; peak RSS where /proc is not available
+
+    Anonymous memory leaves out the database pages SQLite maps into the
+    process (mmap_size), which would otherwise grow with every page read.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """Samples rss_bytes() every interval while running, from the event loop"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.samples.append(rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.samples = [rss_bytes()]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self.samples.append(rss_bytes())
+        return {
+            "rss_start_mb": round(self.samples[0] / 2**20, 1),
+            "rss_peak_mb": round(max(self.samples) / 2**20, 1),
+            "rss_end_mb": round(self.samples[-1] / 2**20, 1),
+        }
+
+
+def database_bytes(path):
+    """Size of a SQLite database including its WAL"""
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+class Stopwatch:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
@@ -0,0 +1,183 @@
+"""Run benchmark scenarios and store the results as JSON.
+
+From the repository root:
+
+    python -m benchmarks.run                                  # every scenario
+    python -m benchmarks.run endpoints storage_layouts --scale 1 --concurrency 16
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+
+Each scenario variant runs in a fresh process against an empty database in a
+temporary directory, with the BVB_* settings listed in VARIANTS, so results
+do not depend on what ran before. Results go to benchmarks/results/ named by
+time and commit.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Scenario -> {variant: BVB_* settings}; every variant runs in its own process
+VARIANTS = {
+    "endpoints": {"uncached": {"BVB_RESPONSE_CACHE": "0"}, "cached": {"BVB_RESPONSE_CACHE": "1"}},
+    "game_stats_scaling": {"default": {}},
+    "player_stats_scaling": {"default": {}},
+    "leaderboard": {"default": {}},
+    "mixed_read_write": {
+        "default_profile": {"BVB_STORAGE_PROFILE": "default", "BVB_RESPONSE_CACHE": "0"},
+        "tuned_profile": {"BVB_STORAGE_PROFILE": "tuned", "BVB_RESPONSE_CACHE": "0"},
+    },
+    "write_burst": {"direct": {"BVB_WRITE_BEHIND": "0"}, "write_behind": {"BVB_WRITE_BEHIND": "1"}},
+    "storage_layouts": {"normalized": {"BVB_STAT_STORAGE": "normalized"}, "compact": {"BVB_STAT_STORAGE": "compact"}},
+    "analytics": {"normalized": {"BVB_STAT_STORAGE": "normalized"}},
+    "subscribers": {"default": {}},
+    "serializer": {"normalized": {"BVB_STAT_STORAGE": "normalized"}, "compact": {"BVB_STAT_STORAGE": "compact"}},
+    "export": {"default": {}},
+    "bulk_import": {"normalized": {"BVB_STAT_STORAGE": "normalized"}, "compact": {"BVB_STAT_STORAGE": "compact"}},
+    "rallies": {"normalized": {"BVB_STAT_STORAGE": "normalized"}, "compact": {"BVB_STAT_STORAGE": "compact"}},
+    "cube": {"normalized": {"BVB_STAT_STORAGE": "normalized"}, "compact": {"BVB_STAT_STORAGE": "compact"}},
+    "jobs": {"default": {}},
+    "workers": {"cached": {"BVB_RESPONSE_CACHE": "1"}, "uncached": {"BVB_RESPONSE_CACHE": "0"}},
+}
+
+# Printed before the child's JSON result on stdout
+RESULT_MARKER = "BENCHMARK-RESULT "
+
+
+def git_revision():
+    def git(*args):
+        result = subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    commit = git("rev-parse", "HEAD")
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return {"commit": commit, "subject": git("log", "-1", "--format=%s"), "dirty": dirty}
+
+
+def run_child(scenario, variant, options):
+    """Run one scenario variant in a fresh process; returns its result dict"""
+    workdir = tempfile.mkdtemp(prefix=f"bvb-bench-{scenario}-")
+    env = dict(os.environ)
+    # Only the variant's settings apply, not whatever the shell has
+    for name in list(env):
+        if name.startswith("BVB_"):
+            del env[name]
+    env.update(VARIANTS[scenario][variant])
+    env["BVB_DATABASE_PATH"] = os.path.join(workdir, "bench.db")
+    env["BVB_METRICS"] = "1"
+    child_options = dict(vars(options), workdir=workdir)
+    command = [sys.executable, "-m", "benchmarks.run", "--child", scenario, variant, json.dumps(child_options)]
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+    finally:
+        if not options.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+            break
+    else:
+        result = {"error": f"exited with {completed.returncode} without a result"}
+    result["wall_seconds"] = round(time.perf_counter() - started, 1)
+    result["settings"] = VARIANTS[scenario][variant]
+    return result
+
+
+def child_main(scenario, variant, options_json):
+    import asyncio
+    import traceback
+
+    from .scenarios import SCENARIOS
+    from app.models.database import async_engine
+
+    options = SimpleNamespace(**json.loads(options_json))
+
+    async def run():
+        try:
+            return await SCENARIOS[scenario](options)
+        finally:
+            await async_engine.dispose()
+
+    try:
+        result = asyncio.run(run())
+    except Exception as e:
+        traceback.print_exc()
+        result = {"error": f"{type(e).__name__}: {e}"}
+    print(RESULT_MARKER + json.dumps(result), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios and store the results as JSON")
+    parser.add_argument("scenarios", nargs="*", help=f"default: all of {', '.join(VARIANTS)}")
+    parser.add_argument("--variant", action="append", help="only these variants (repeatable)")
+    parser.add_argument("--scale", type=float, default=0.1,
+                        help="dataset size multiplier; 1 gives the sizes of the original requests (default 0.1)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent in-process clients (default 8)")
+    parser.add_argument("--seed", type=int, default=2024, help="generator seed (default 2024)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="keep each run's database directory")
+    parser.add_argument("--child", nargs=3, metavar=("SCENARIO", "VARIANT", "OPTIONS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(*args.child)
+        return
+
+    unknown = [name for name in args.scenarios if name not in VARIANTS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(VARIANTS)}")
+    options = SimpleNamespace(scale=args.scale, concurrency=args.concurrency, seed=args.seed, keep=args.keep)
+
+    revision = git_revision()
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **revision,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "scenarios": {},
+    }
+    failed = False
+    for scenario in args.scenarios or list(VARIANTS):
+        results["scenarios"][scenario] = {}
+        for variant in VARIANTS[scenario]:
+            if args.variant and variant not in args.variant:
+                continue
+            print(f"{scenario} [{variant}]...", file=sys.stderr, flush=True)
+            result = run_child(scenario, variant, options)
+            results["scenarios"][scenario][variant] = result
+            if "error" in result:
+                failed = True
+                print(f"  failed: {result['error']}", file=sys.stderr)
+            else:
+                print(f"  done in {result['wall_seconds']} s", file=sys.stderr)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{(revision['commit'] or 'nogit')[:8]}.json")
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+    print(f"Results written to {output}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,897 @@
+"""Benchmark scenarios. Each one builds its own dataset in an empty database and returns a JSON-able dict.
+
+run.py starts a fresh process per scenario and variant with the BVB_*
+settings of that variant, so this module (and the app) is only imported once
+the environment is final. Dataset sizes are the ones from the original
+requests at --scale 1.
+"""
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import case, func, select
+
+from app.main import app
+from app.analytics import analytics
+from app.cube import SOURCES
+from app.events import broker
+from app.models.database import AsyncSessionLocal, async_engine
+from app.models.models import ActionType, AttackStat, Player
+from app.models.schemas import StatResponse
+from app.models.models import Rally
+from app.models.stat_store import encode_stat_rows, rebuild_aggregates, rebuild_rallies, rebuild_rollups, serialize_stat_row, stat_table, stats_query
+from app.response_cache import response_cache
+from app.stat_import import import_stat_file
+from app.write_behind import write_buffer
+
+from .generator import MatchGenerator, game_start, season_games, stat_request, write_import_file
+from .harness import HttpClient, Recorder, RssSampler, Stopwatch, database_bytes, latency_summary, run_load, running, timed
+
+# Stats per POST /api/games/{game_id}/stats/batch while loading through the API
+LOAD_BATCH_SIZE = 1000
+
+# Average touches in a generated match, to turn stat counts into game counts
+TOUCHES_PER_MATCH = 500
+
+
+def scaled(options, size, minimum):
+    return max(minimum, round(size * options.scale))
+
+
+def check(response):
+    if response.status is None or response.status >= 400:
+        raise RuntimeError(f"Setup request failed with {response.status}: {response.body[:500]!r}")
+    return response
+
+
+class Season:
+    def __init__(self, player_ids, games, stats, load_seconds):
+        self.player_ids = player_ids
+        # (game id, player id per match slot) pairs
+        self.games = games
+        self.stats = stats
+        self.load_seconds = load_seconds
+
+
+async def create_players(client, names):
+    return [check(await client.post("/api/players/", {"name": name})).json()["id"] for name in names]
+
+
+async def create_game(client, game_date, team1, team2):
+    response = await client.post("/api/games/", {"date": game_date.isoformat(), "team1": team1, "team2": team2})
+    return check(response).json()["id"]
+
+
+async def post_stats(client, game_id, slot_ids, touches, batch_size=LOAD_BATCH_SIZE):
+    for i in range(0, len(touches), batch_size):
+        body = [stat_request(touch, game_id, slot_ids) for touch in touches[i:i + batch_size]]
+        result = check(await client.post(f"/api/games/{game_id}/stats/batch", body)).json()
+        if result["failed"]:
+            raise RuntimeError(f"Batch insert rejected stats: {result['results'][:3]}")
+
+
+async def load_season(client, generator, player_count, game_count):
+    """Create players and games through the API and post every match through the batch endpoint"""
+    names = generator.player_names(player_count)
+    with Stopwatch() as load:
+        player_ids = await create_players(client, names)
+        ids_by_name = dict(zip(names, player_ids))
+        games = []
+        stats = 0
+        for _, game_date, slot_names, touches in season_games(generator, names, game_count):
+            slot_ids = [ids_by_name[name] for name in slot_names]
+            game_id = await create_game(client, game_date, slot_ids[:2], slot_ids[2:])
+            await post_stats(client, game_id, slot_ids, touches)
+            games.append((game_id, slot_ids))
+            stats += len(touches)
+    return Season(player_ids, games, stats, load.seconds)
+
+
+async def import_games(options, games, name):
+    """Load (game key, date, slot names, touches) tuples through the bulk importer"""
+    path = os.path.join(options.workdir, f"{name}.csv")
+    with Stopwatch() as writing:
+        records = write_import_file(path, games)
+    summary = await import_stat_file(path, "csv")
+    os.remove(path)
+    if summary["errors"]:
+        raise RuntimeError(f"Import rejected records: {summary['error_samples'][:3]}")
+    return {"records": records, "file_seconds": round(writing.seconds, 3), "import": summary}
+
+
+async def player_ids_by_name():
+    async with AsyncSessionLocal() as db:
+        return {name: player_id for player_id, name in (await db.execute(select(Player.id, Player.name))).all()}
+
+
+async def repeat(client, recorder, label, url, times, headers=None):
+    for _ in range(times):
+        await timed(client, recorder, label, "GET", url, headers=headers)
+
+
+async def checkpoint():
+    """Fold the WAL back into the database file so file sizes compare"""
+    async with async_engine.connect() as conn:
+        await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def uncached():
+    response_cache.enabled = False
+    response_cache.clear()
+
+
+# Share of each endpoint in the mixed workload: (label, weight, request builder)
+ENDPOINT_MIX = [
+    ("GET /api/games/", 5, lambda game, slots, player, body: ("GET", "/api/games/?limit=50", None)),
+    ("GET /api/games/{game_id}", 10, lambda game, slots, player, body: ("GET", f"/api/games/{game}", None)),
+    ("GET /api/games/{game_id}/stats", 20, lambda game, slots, player, body: ("GET", f"/api/games/{game}/stats", None)),
+    ("GET /api/games/{game_id}/stats?player_id", 5,
+     lambda game, slots, player, body: ("GET", f"/api/games/{game}/stats?player_id={slots[0]}", None)),
+    ("GET /api/players/", 5, lambda game, slots, player, body: ("GET", "/api/players/", None)),
+    ("GET /api/players/summary", 10, lambda game, slots, player, body: ("GET", "/api/players/summary", None)),
+    ("GET /api/players/{player_id}", 5, lambda game, slots, player, body: ("GET", f"/api/players/{player}", None)),
+    ("GET /api/players/{player_id}/games", 5,
+     lambda game, slots, player, body: ("GET", f"/api/players/{player}/games", None)),
+    ("GET /api/players/{player_id}/stats", 10,
+     lambda game, slots, player, body: ("GET", f"/api/players/{player}/stats", None)),
+    ("GET /api/stats/summary/game/{game_id}", 10,
+     lambda game, slots, player, body: ("GET", f"/api/stats/summary/game/{game}", None)),
+    ("GET /api/stats/analytics/attack?by=attack_direction", 5,
+     lambda game, slots, player, body: ("GET", "/api/stats/analytics/attack?by=attack_direction", None)),
+    ("POST /api/games/{game_id}/stats", 10, lambda game, slots, player, body: ("POST", f"/api/games/{game}/stats", body)),
+]
+
+
+def mixed_requests(season, mix, count, seed, touches):
+    """count (label, method, url, body) requests drawn from a weighted mix over a season's games and players"""
+    picker = random.Random(seed)
+    labels = [label for label, _, _ in mix]
+    builders = {label: build for label, _, build in mix}
+    weights = [weight for _, weight, _ in mix]
+    for label in picker.choices(labels, weights, k=count):
+        game_id, slot_ids = picker.choice(season.games)
+        body = stat_request(picker.choice(touches), game_id, slot_ids)
+        method, url, body = builders[label](game_id, slot_ids, picker.choice(season.player_ids), body)
+        yield label, method, url, body
+
+
+def warm_up(season, mix, touches):
+    """One request per endpoint, so first-use costs (analytics load, pool connections) are not measured"""
+    game_id, slot_ids = season.games[0]
+    for label, _, build in mix:
+        method, url, body = build(game_id, slot_ids, season.player_ids[0], stat_request(touches[0], game_id, slot_ids))
+        yield label, method, url, body
+
+
+async def endpoints(options):
+    """Mixed read/write traffic over the main endpoints of a generated season"""
+    generator = MatchGenerator(options.seed)
+    async with running(app) as client:
+        season = await load_season(client, generator, 40, scaled(options, 200, 10))
+        touches = generator.match(game_start(date(2024, 9, 1)))
+        await run_load(client, warm_up(season, ENDPOINT_MIX, touches), 1)
+        count = scaled(options, 5000, 500)
+        load = await run_load(
+            client, mixed_requests(season, ENDPOINT_MIX, count, options.seed, touches), options.concurrency
+        )
+    return {"players": len(season.player_ids), "games": len(season.games), "stats": season.stats,
+            "concurrency": options.concurrency, **load}
+
+
+SCALING_SIZES = (100, 1000, 5000, 20000)
+
+
+async def game_stats_scaling(options):
+    """GET /api/games/{game_id}/stats latency and statement count for games of growing size"""
+    generator = MatchGenerator(options.seed)
+    sizes = {}
+    async with running(app) as client:
+        uncached()
+        slot_ids = await create_players(client, generator.player_names(4))
+        for size in SCALING_SIZES:
+            game_id = await create_game(client, date(2024, 6, 1), slot_ids[:2], slot_ids[2:])
+            await post_stats(client, game_id, slot_ids, generator.game_touches(size, game_start(date(2024, 6, 1))))
+            recorder = Recorder()
+            await timed(client, Recorder(), "warm-up", "GET", f"/api/games/{game_id}/stats")
+            await repeat(client, recorder, "first page (limit=500)", f"/api/games/{game_id}/stats", 30)
+            await repeat(client, recorder, "limit=5000", f"/api/games/{game_id}/stats?limit=5000", 10)
+            await repeat(client, recorder, "set 1 (set_number=1)", f"/api/games/{game_id}/stats?set_number=1", 30)
+            sizes[str(size)] = recorder.summary()
+    return {"stats_per_game": sizes}
+
+
+CAREER_SIZES = (1000, 10000, 100000)
+
+
+def career_games(generator, names, start_key):
+    """Endless (key, date, slot names, touches) matches in which names[0] always plays in slot 0"""
+    key = start_key
+    day = date(2020, 1, 1)
+    while True:
+        key += 1
+        opponents = generator.random.sample(names[2:], 2)
+        slot_names = [names[0], names[1]] + opponents
+        yield key, day, slot_names, generator.match(game_start(day))
+        day = date.fromordinal(day.toordinal() + 1)
+
+
+async def player_stats_scaling(options):
+    """GET /api/players/{player_id}/stats as one player's career grows"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(22)
+    matches = career_games(generator, names, 0)
+    careers = {}
+    career = 0
+    async with running(app) as client:
+        uncached()
+        for size in sorted({max(100, round(n * options.scale)) for n in CAREER_SIZES}):
+            games = []
+            while career < size:
+                game = next(matches)
+                games.append(game)
+                career += sum(1 for touch in game[3] if touch.slot == 0)
+            await import_games(options, games, f"career-{size}")
+            player_id = (await player_ids_by_name())[names[0]]
+            url = f"/api/players/{player_id}/stats"
+            recorder = Recorder()
+            await timed(client, Recorder(), "warm-up", "GET", url)
+            await repeat(client, recorder, "all stats", url, 20)
+            await repeat(client, recorder, "action_type=attack", f"{url}?action_type=attack", 20)
+            await repeat(client, recorder, "date range", f"{url}?start_date=2020-01-01&end_date=2020-03-31", 20)
+            careers[str(career)] = recorder.summary()
+    return {"career_touches": careers}
+
+
+async def leaderboard(options):
+    """GET /api/players/summary over 500 players and 1M stats, computed, cached and revalidated"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(500)
+    game_count = scaled(options, 1_000_000 // TOUCHES_PER_MATCH, 10)
+    async with running(app) as client:
+        loaded = await import_games(options, season_games(generator, names, game_count), "leaderboard")
+        uncached()
+        recorder = Recorder()
+        await timed(client, Recorder(), "warm-up", "GET", "/api/players/summary")
+        await repeat(client, recorder, "computed", "/api/players/summary", 10)
+        await repeat(client, recorder, "computed, sort=total_kills&limit=20",
+                     "/api/players/summary?sort=total_kills&limit=20", 10)
+        response_cache.enabled = True
+        await timed(client, recorder, "cache miss", "GET", "/api/players/summary")
+        await repeat(client, recorder, "cache hit", "/api/players/summary", 50)
+        etag = (await client.get("/api/players/summary")).headers["etag"]
+        await repeat(client, recorder, "If-None-Match (304)", "/api/players/summary", 50, headers={"if-none-match": etag})
+    return {"players": len(names), "stats": loaded["records"], "requests": recorder.summary()}
+
+
+# Scorer-style mix for the read/write contention test
+READ_WRITE_MIX = [
+    ("GET /api/games/{game_id}/stats", 40, ENDPOINT_MIX[2][2]),
+    ("GET /api/players/{player_id}/stats", 20, ENDPOINT_MIX[8][2]),
+    ("GET /api/stats/summary/game/{game_id}", 20, ENDPOINT_MIX[9][2]),
+    ("POST /api/games/{game_id}/stats", 20, ENDPOINT_MIX[11][2]),
+]
+
+
+async def mixed_read_write(options):
+    """Concurrent readers and single-stat writers against SQLite, uncached"""
+    generator = MatchGenerator(options.seed)
+    async with running(app) as client:
+        uncached()
+        season = await load_season(client, generator, 40, scaled(options, 60, 10))
+        touches = generator.match(game_start(date(2024, 9, 1)))
+        await run_load(client, warm_up(season, READ_WRITE_MIX, touches), 1)
+        count = scaled(options, 4000, 500)
+        load = await run_load(
+            client, mixed_requests(season, READ_WRITE_MIX, count, options.seed, touches), options.concurrency
+        )
+    return {"stats": season.stats, "concurrency": options.concurrency, **load}
+
+
+async def write_burst(options):
+    """Tap-to-ack latency of POST /api/games/{game_id}/stats under bursts of concurrent taps"""
+    generator = MatchGenerator(options.seed)
+    async with running(app) as client:
+        slot_ids = await create_players(client, generator.player_names(4))
+        game_id = await create_game(client, date(2024, 6, 1), slot_ids[:2], slot_ids[2:])
+        touches = generator.game_touches(scaled(options, 2000, 400), game_start(date(2024, 6, 1)))
+        url = f"/api/games/{game_id}/stats"
+        recorder = Recorder()
+        burst = options.concurrency
+        with Stopwatch() as tapping:
+            for i in range(0, len(touches), burst):
+                await asyncio.gather(*(
+                    timed(client, recorder, "POST /api/games/{game_id}/stats", "POST", url,
+                          body=stat_request(touch, game_id, slot_ids))
+                    for touch in touches[i:i + burst]
+                ))
+                # Scorers pause between rallies
+                await asyncio.sleep(0.02)
+        with Stopwatch() as draining:
+            while write_buffer.enabled and write_buffer.pending_count:
+                await asyncio.sleep(0.005)
+        async with AsyncSessionLocal() as db:
+            committed = (await db.execute(select(func.count()).select_from(stat_table))).scalar()
+    return {
+        "taps": len(touches),
+        "burst_size": burst,
+        "seconds": round(tapping.seconds, 3),
+        "drain_seconds": round(draining.seconds, 3),
+        "stats_committed": committed,
+        "requests": recorder.summary(tapping.seconds),
+    }
+
+
+async def storage_layouts(options):
+    """Batch insert throughput, file size and aggregate query time of the configured stat layout"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(40)
+    games = list(season_games(generator, names, scaled(options, 400, 10)))
+    async with running(app) as client:
+        uncached()
+        ids_by_name = dict(zip(names, await create_players(client, names)))
+        await checkpoint()
+        before = database_bytes(os.environ["BVB_DATABASE_PATH"])
+        stats = 0
+        batch_times = []
+        with Stopwatch() as inserting:
+            for _, game_date, slot_names, touches in games:
+                slot_ids = [ids_by_name[name] for name in slot_names]
+                game_id = await create_game(client, game_date, slot_ids[:2], slot_ids[2:])
+                started = time.perf_counter()
+                await post_stats(client, game_id, slot_ids, touches)
+                batch_times.append(time.perf_counter() - started)
+                stats += len(touches)
+        await checkpoint()
+        size = database_bytes(os.environ["BVB_DATABASE_PATH"]) - before
+
+        player_id = ids_by_name[names[0]]
+        recorder = Recorder()
+        queries = [
+            ("GET /api/players/{player_id}/stats", f"/api/players/{player_id}/stats", 20),
+            ("GET /api/players/summary", "/api/players/summary", 10),
+            ("GET /api/stats/summary/game/{game_id}", f"/api/stats/summary/game/{game_id}", 20),
+            ("GET /api/games/{game_id}/stats", f"/api/games/{game_id}/stats", 20),
+            ("GET /api/export/stats (one game)", f"/api/export/stats?game_id={game_id}", 10),
+        ]
+        for label, url, times in queries:
+            await timed(client, Recorder(), "warm-up", "GET", url)
+            await repeat(client, recorder, label, url, times)
+    return {
+        "layout": os.environ.get("BVB_STAT_STORAGE", "normalized"),
+        "stats": stats,
+        "insert_seconds": round(inserting.seconds, 3),
+        "insert_stats_per_second": round(stats / sum(batch_times)),
+        "database_bytes": size,
+        "bytes_per_stat": round(size / stats, 1),
+        "queries": recorder.summary(),
+    }
+
+
+def analytics_sql(player_id=None):
+    """Hand-written SQL for the attack-by-direction breakdown, for comparison with the NumPy arrays"""
+    query = (
+        select(
+            AttackStat.attack_direction,
+            func.count(),
+            func.sum(case((AttackStat.is_kill, 1), else_=0)),
+            func.sum(case((AttackStat.is_error, 1), else_=0)),
+            func.sum(case((AttackStat.is_blocked, 1), else_=0)),
+        )
+        .select_from(stat_table)
+        .outerjoin(AttackStat, AttackStat.stat_id == stat_table.c.id)
+        .where(stat_table.c.action_type == ActionType.ATTACK)
+        .group_by(AttackStat.attack_direction)
+    )
+    if player_id is not None:
+        query = query.where(stat_table.c.player_id == player_id)
+    return query
+
+
+async def time_sql(query, times):
+    seconds = []
+    async with AsyncSessionLocal() as db:
+        for _ in range(times):
+            started = time.perf_counter()
+            (await db.execute(query)).all()
+            seconds.append(time.perf_counter() - started)
+    return latency_summary(seconds)
+
+
+async def analytics_breakdowns(options):
+    """Cross-game breakdowns from the NumPy analytics arrays against the equivalent SQL (normalized layout)"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(200)
+    game_count = scaled(options, 5_000_000 // TOUCHES_PER_MATCH, 20)
+    async with running(app) as client:
+        loaded = await import_games(options, season_games(generator, names, game_count), "analytics")
+        player_id = (await player_ids_by_name())[names[0]]
+        recorder = Recorder()
+        by_direction = "/api/stats/analytics/attack?by=attack_direction"
+        await timed(client, recorder, "first request (loads the arrays)", "GET", by_direction)
+        await repeat(client, recorder, "attack by attack_direction", by_direction, 20)
+        await repeat(client, recorder, "attack by attack_direction, one player",
+                     f"{by_direction}&player_id={player_id}", 20)
+        await repeat(client, recorder, "attack by player_id", "/api/stats/analytics/attack?by=player_id", 20)
+        await repeat(client, recorder, "serving by serve_type", "/api/stats/analytics/serving?by=serve_type", 20)
+        sql = {
+            "attack by attack_direction": await time_sql(analytics_sql(), 5),
+            "attack by attack_direction, one player": await time_sql(analytics_sql(player_id), 5),
+        }
+    return {
+        "stats": loaded["records"],
+        "analytics_rows": analytics.row_count,
+        "analytics_bytes": analytics.memory_bytes,
+        "endpoint": recorder.summary(),
+        "sql": sql,
+    }
+
+
+SUBSCRIBERS = 200
+
+
+async def subscribers(options):
+    """Fan-out of live stat events to 200 SSE subscribers of one game while a scorer posts"""
+    generator = MatchGenerator(options.seed)
+    async with running(app) as client:
+        slot_ids = await create_players(client, generator.player_names(4))
+        game_id = await create_game(client, date(2024, 6, 1), slot_ids[:2], slot_ids[2:])
+        touches = generator.game_touches(scaled(options, 1000, 200), game_start(date(2024, 6, 1)))
+        url = f"/api/games/{game_id}/stats"
+
+        # Post without subscribers first, for the baseline write latency
+        recorder = Recorder()
+        for touch in touches[:50]:
+            await timed(client, recorder, "POST without subscribers", "POST", url, body=stat_request(touch, game_id, slot_ids))
+
+        sent = {}
+        received = []
+        overflows = [0]
+        disconnect = asyncio.Event()
+        connected = []
+
+        def subscriber():
+            buffer = b""
+
+            def on_chunk(chunk):
+                nonlocal buffer
+                arrived = time.perf_counter()
+                buffer += chunk
+                while b"\n\n" in buffer:
+                    frame, buffer = buffer.split(b"\n\n", 1)
+                    if frame.startswith(b": connected"):
+                        connected.append(1)
+                    elif frame.startswith(b"event: overflow"):
+                        overflows[0] += 1
+                    elif frame.startswith(b"data: "):
+                        for stat in json.loads(frame[6:])["stats"]:
+                            received.append((stat["base"]["id"], arrived))
+            return on_chunk
+
+        streams = [
+            asyncio.create_task(client.get(f"{url}/stream", on_chunk=subscriber(), disconnect=disconnect))
+            for _ in range(SUBSCRIBERS)
+        ]
+        while len(connected) < SUBSCRIBERS:
+            await asyncio.sleep(0.01)
+
+        posted = touches[50:]
+        with Stopwatch() as posting:
+            for touch in posted:
+                started = time.perf_counter()
+                response = await client.post(url, body=stat_request(touch, game_id, slot_ids))
+                elapsed = time.perf_counter() - started
+                recorder.add("POST with subscribers", elapsed, response)
+                sent[response.json()["base"]["id"]] = started
+                # Let the subscribers drain their queues between taps, as a scorer's pace would
+                await asyncio.sleep(0)
+        expected = len(posted) * SUBSCRIBERS
+        deadline = time.perf_counter() + 30
+        while len(received) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        disconnect.set()
+        await asyncio.gather(*streams)
+    delivery = [arrived - sent[stat_id] for stat_id, arrived in received]
+    return {
+        "subscribers": SUBSCRIBERS,
+        "stats_posted": len(posted),
+        "post_seconds": round(posting.seconds, 3),
+        "events_expected": expected,
+        "events_delivered": len(delivery),
+        "overflow_events": overflows[0],
+        "subscribers_left": broker.subscriber_count(game_id),
+        "delivery_latency": latency_summary(delivery),
+        "requests": recorder.summary(),
+    }
+
+
+def best_of(function, times=5):
+    best = None
+    for _ in range(times):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def serializer(options):
+    """Cost per stat of the JSON encoders against the dict + jsonable_encoder / validation paths they replaced"""
+    generator = MatchGenerator(options.seed)
+    count = 10000
+    async with running(app) as client:
+        slot_ids = await create_players(client, generator.player_names(4))
+        game_id = await create_game(client, date(2024, 6, 1), slot_ids[:2], slot_ids[2:])
+        await post_stats(client, game_id, slot_ids, generator.game_touches(count, game_start(date(2024, 6, 1))))
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stats_query().where(stat_table.c.game_id == game_id))).all()
+
+    adapter = TypeAdapter(List[StatResponse])
+    paths = {
+        "dict + jsonable_encoder + json.dumps": lambda: json.dumps(
+            jsonable_encoder([serialize_stat_row(row) for row in rows]), separators=(",", ":")
+        ).encode(),
+        "dict + StatResponse validation": lambda: adapter.dump_json(
+            adapter.validate_python([serialize_stat_row(row) for row in rows])
+        ),
+        "encode_stat_rows": lambda: encode_stat_rows(rows),
+    }
+    results = {}
+    for name, function in paths.items():
+        seconds = best_of(function)
+        results[name] = {"seconds": round(seconds, 4), "us_per_stat": round(seconds / len(rows) * 1e6, 2)}
+    return {"stats": len(rows), "paths": results}
+
+
+async def export(options):
+    """Streamed CSV/NDJSON export rate and RSS for a whole season and for one game"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(200)
+    game_count = scaled(options, 2_000_000 // TOUCHES_PER_MATCH, 20)
+    results = {}
+    async with running(app) as client:
+        loaded = await import_games(options, season_games(generator, names, game_count), "export")
+        for label, query in (("one game", "&game_id=1"), ("everything", "")):
+            for format in ("csv", "ndjson"):
+                lines = [0]
+
+                def on_chunk(chunk):
+                    lines[0] += chunk.count(b"\n")
+
+                sampler = RssSampler()
+                sampler.start()
+                with Stopwatch() as streaming:
+                    response = await client.get(f"/api/export/stats?format={format}{query}", on_chunk=on_chunk)
+                memory = await sampler.stop()
+                rows = lines[0] - (1 if format == "csv" else 0)
+                results[f"{label}, {format}"] = {
+                    "status": response.status,
+                    "rows": rows,
+                    "bytes": response.size,
+                    "seconds": round(streaming.seconds, 3),
+                    "rows_per_second": round(rows / streaming.seconds),
+                    "rss_growth_mb": round(memory["rss_peak_mb"] - memory["rss_start_mb"], 1),
+                    **memory,
+                }
+    return {"stats": loaded["records"], "exports": results}
+
+
+async def bulk_import(options):
+    """Records per second through the resumable bulk importer"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(200)
+    game_count = scaled(options, 500_000 // TOUCHES_PER_MATCH, 20)
+    async with running(app):
+        loaded = await import_games(options, season_games(generator, names, game_count), "import")
+    summary = loaded["import"]
+    return {
+        "records": loaded["records"],
+        "games": summary["games_created"],
+        "players": summary["players_created"],
+        "seconds": summary["seconds"],
+        "records_per_second": summary["records_per_second"],
+        "file_seconds": loaded["file_seconds"],
+    }
+
+
+async def rallies(options):
+    """Full-season rally reconstruction, the incremental update on live taps, and the rally metrics endpoint"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(200)
+    game_count = scaled(options, 1_000_000 // TOUCHES_PER_MATCH, 20)
+    async with running(app) as client:
+        uncached()
+        # The importer reconstructs the rallies of its games once the file is loaded
+        loaded = await import_games(options, season_games(generator, names, game_count), "rallies")
+        async with AsyncSessionLocal() as db:
+            incremental = (await db.execute(select(func.count()).select_from(Rally))).scalar()
+        with Stopwatch() as recompute:
+            async with async_engine.begin() as conn:
+                games, rally_count = await conn.run_sync(rebuild_rallies)
+        if rally_count != incremental:
+            raise RuntimeError(f"Rebuild found {rally_count} rallies, the incremental updates {incremental}")
+
+        # A live game: one tap at a time, each followed by its rally update
+        slot_ids = await create_players(client, ["Live 1", "Live 2", "Live 3", "Live 4"])
+        game_id = await create_game(client, date(2024, 9, 1), slot_ids[:2], slot_ids[2:])
+        touches = generator.game_touches(scaled(options, 2000, 300), game_start(date(2024, 9, 1)))
+        recorder = Recorder()
+        for touch in touches:
+            await timed(client, recorder, "POST /api/games/{game_id}/stats", "POST", f"/api/games/{game_id}/stats",
+                        body=stat_request(touch, game_id, slot_ids))
+        await repeat(client, recorder, "GET /api/games/{game_id}/rallies", f"/api/games/{game_id}/rallies", 20)
+
+        player_id = (await player_ids_by_name())[names[0]]
+        await repeat(client, recorder, "rally metrics by player", "/api/stats/rallies?by=player", 5)
+        await repeat(client, recorder, "rally metrics by team", "/api/stats/rallies?by=team", 5)
+        await repeat(client, recorder, "rally metrics, one player", f"/api/stats/rallies?player_id={player_id}", 20)
+    return {
+        "stats": loaded["records"],
+        "games": games,
+        "rallies": rally_count,
+        "import_records_per_second": loaded["import"]["records_per_second"],
+        "recompute_seconds": round(recompute.seconds, 3),
+        "recompute_stats_per_second": round(loaded["records"] / recompute.seconds),
+        "endpoints": recorder.summary(),
+    }
+
+
+# Seconds between live taps while heavy work runs alongside
+TAP_INTERVAL = 0.02
+
+
+async def live_taps(client, recorder, label, game_id, slot_ids, touches, finished):
+    """Post one stat every TAP_INTERVAL until ``finished`` is set; returns how many were posted"""
+    posted = 0
+    while not finished.is_set():
+        touch = touches[posted % len(touches)]
+        await timed(client, recorder, label, "POST", f"/api/games/{game_id}/stats",
+                    body=stat_request(touch, game_id, slot_ids))
+        posted += 1
+        await asyncio.sleep(TAP_INTERVAL)
+    return posted
+
+
+async def alongside_taps(client, recorder, label, game_id, slot_ids, touches, work):
+    """Run the ``work`` coroutine function while posting live taps; returns (its result, seconds)"""
+    finished = asyncio.Event()
+
+    async def run_work():
+        try:
+            with Stopwatch() as watch:
+                return await work(), watch
+        finally:
+            finished.set()
+
+    (result, watch), _ = await asyncio.gather(
+        run_work(), live_taps(client, recorder, label, game_id, slot_ids, touches, finished)
+    )
+    return result, round(watch.seconds, 3)
+
+
+async def wait_for_job(client, job_id):
+    while True:
+        job = check(await client.get(f"/api/jobs/{job_id}")).json()
+        if job["status"] in ("done", "failed", "cancelled"):
+            if job["status"] != "done":
+                raise RuntimeError(f"Job {job['kind']} ended {job['status']}: {job['error']}")
+            return job
+        await asyncio.sleep(0.05)
+
+
+async def jobs(options):
+    """Live tap latency while a full export or a derived-table rebuild runs inline versus as a background job"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(200)
+    game_count = scaled(options, 1_000_000 // TOUCHES_PER_MATCH, 20)
+    async with running(app) as client:
+        uncached()
+        loaded = await import_games(options, season_games(generator, names, game_count), "jobs")
+        slot_ids = await create_players(client, ["Live 1", "Live 2", "Live 3", "Live 4"])
+        game_id = await create_game(client, date(2024, 9, 1), slot_ids[:2], slot_ids[2:])
+        touches = generator.game_touches(500, game_start(date(2024, 9, 1)))
+
+        recorder = Recorder()
+        label = "POST /api/games/{game_id}/stats"
+        work_seconds = {}
+        await alongside_taps(client, recorder, f"{label} [idle]", game_id, slot_ids, touches,
+                             lambda: asyncio.sleep(scaled(options, 50, 5)))
+
+        async def inline_export():
+            return check(await client.get("/api/export/stats?format=ndjson")).size
+
+        def inline_rebuild(rebuild):
+            async def rebuild_in_one_transaction():
+                async with async_engine.begin() as conn:
+                    return await conn.run_sync(rebuild)
+            return rebuild_in_one_transaction
+
+        def job(kind, params=None):
+            async def submit_and_wait():
+                response = await client.post("/api/jobs/", {"kind": kind, "params": params or {}})
+                return await wait_for_job(client, check(response).json()["id"])
+            return submit_and_wait
+
+        for work_label, work in (
+            ("inline export", inline_export),
+            ("export job", job("export", {"format": "ndjson"})),
+            ("inline aggregate rebuild", inline_rebuild(rebuild_aggregates)),
+            ("aggregate rebuild job", job("rebuild_aggregates")),
+            ("inline rally rebuild", inline_rebuild(rebuild_rallies)),
+            ("rally rebuild job", job("rebuild_rallies")),
+            ("inline rollup rebuild", inline_rebuild(rebuild_rollups)),
+            ("rollup rebuild job", job("rebuild_rollups")),
+        ):
+            _, work_seconds[work_label] = await alongside_taps(
+                client, recorder, f"{label} [{work_label}]", game_id, slot_ids, touches, work
+            )
+    return {
+        "stats": loaded["records"],
+        "work_seconds": work_seconds,
+        "endpoints": recorder.summary(),
+    }
+
+
+# (label, action type, query string) pivots timed against every source that can answer them
+CUBE_QUERIES = [
+    ("kills by player, direction, type and month", "attack",
+     "dimension=player_id,attack_direction,attack_type,month&measure=count,is_kill,efficiency"),
+    ("aces by serve type and target", "serving", "dimension=serve_type,serve_target&measure=count,is_ace,is_ace_rate"),
+    ("pass ratings by player", "serve_receive", "dimension=player_id,pass_rating"),
+    ("attacks by player and direction, one game", "attack", "dimension=player_id,attack_direction&game_id={game_id}"),
+    ("attacks by set", "attack", "dimension=set_number&measure=count,is_kill,efficiency"),
+]
+
+
+async def cube(options):
+    """Stat cube pivots answered from each source the planner can choose, plus the full rollup rebuild"""
+    generator = MatchGenerator(options.seed)
+    names = generator.player_names(200)
+    game_count = scaled(options, 1_000_000 // TOUCHES_PER_MATCH, 20)
+    async with running(app) as client:
+        uncached()
+        # The importer fills the rollups of its games once the file is loaded
+        loaded = await import_games(options, season_games(generator, names, game_count), "cube")
+        with Stopwatch() as recompute:
+            async with async_engine.begin() as conn:
+                game_rows, day_rows = await conn.run_sync(rebuild_rollups)
+        async with AsyncSessionLocal() as db:
+            game_id = (await db.execute(select(func.min(stat_table.c.game_id)))).scalar()
+
+        recorder = Recorder()
+        plans = {}
+        for label, action_type, query in CUBE_QUERIES:
+            url = f"/api/stats/cube?action_type={action_type}&{query.format(game_id=game_id)}"
+            plans[label] = check(await client.get(url)).json()["source"]
+            answers = {}
+            for source in SOURCES:
+                response = await client.get(f"{url}&source={source}")
+                if response.status == 400:
+                    continue
+                answers[source] = check(response).json()["cells"]
+                await repeat(client, recorder, f"{label} [{source}]", f"{url}&source={source}", 5)
+            if any(cells != answers["stats"] for cells in answers.values()):
+                raise RuntimeError(f"Cube sources disagree on {label}")
+    return {
+        "stats": loaded["records"],
+        "rollup_rows": {"game_rollup": game_rows, "day_rollup": day_rows},
+        "import_records_per_second": loaded["import"]["records_per_second"],
+        "recompute_seconds": round(recompute.seconds, 3),
+        "plans": plans,
+        "endpoints": recorder.summary(),
+    }
+
+
+# Worker processes app.serve runs with in the workers scenario; reads only scale up to the CPU count
+WORKER_COUNTS = (1, 2, 4)
+
+# Seconds to wait for app.serve to answer, and then for its other workers to finish starting
+SERVE_TIMEOUT = 60
+SERVE_SETTLE_SECONDS = 2
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@asynccontextmanager
+async def serving(options, worker_count):
+    """Run app.serve with worker_count processes on the scenario's database; yields an HttpClient"""
+    port = free_port()
+    env = dict(os.environ, BVB_BUS_SOCKET=os.path.join(options.workdir, "bus.sock"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", str(worker_count), "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    client = HttpClient("127.0.0.1", port)
+    try:
+        deadline = time.monotonic() + SERVE_TIMEOUT
+        while True:
+            try:
+                check(await client.get("/api/games/?limit=1"))
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"app.serve --workers {worker_count} did not start")
+                await asyncio.sleep(0.2)
+        await asyncio.sleep(SERVE_SETTLE_SECONDS)
+        yield client
+    finally:
+        client.close()
+        process.send_signal(signal.SIGINT)
+        process.wait()
+
+
+async def stale_reads(client, slot_ids, touches, writes, readers):
+    """Post stats to a new game, reading it on several connections before and right after each write
+
+    A read that does not include the write yet was answered from a worker's
+    cache before the invalidation reached it.
+    """
+    game_id = await create_game(client, date(2024, 9, 2), slot_ids[:2], slot_ids[2:])
+    url = f"/api/games/{game_id}/stats"
+    stale = 0
+    for posted in range(writes):
+        await asyncio.gather(*(client.get(url) for _ in range(readers)))
+        check(await client.post(url, stat_request(touches[posted % len(touches)], game_id, slot_ids)))
+        responses = await asyncio.gather(*(client.get(url) for _ in range(readers)))
+        stale += sum(len(check(response).json()) != posted + 1 for response in responses)
+    return {"writes": writes, "reads_after_write": writes * readers, "stale_reads": stale}
+
+
+# The read-only part of ENDPOINT_MIX
+READ_MIX = [entry for entry in ENDPOINT_MIX if not entry[0].startswith("POST ")]
+
+
+async def workers(options):
+    """Read throughput of app.serve over HTTP with one and more worker processes, and stale reads after writes"""
+    generator = MatchGenerator(options.seed)
+    async with running(app) as client:
+        season = await load_season(client, generator, 40, scaled(options, 200, 10))
+    await async_engine.dispose()
+    touches = generator.match(game_start(date(2024, 9, 1)))
+    count = scaled(options, 5000, 500)
+    results = {}
+    for worker_count in WORKER_COUNTS:
+        async with serving(options, worker_count) as client:
+            await run_load(client, warm_up(season, READ_MIX, touches), options.concurrency)
+            load = await run_load(
+                client, mixed_requests(season, READ_MIX, count, options.seed, touches), options.concurrency
+            )
+            coherence = await stale_reads(client, season.games[0][1], touches, scaled(options, 200, 20),
+                                          options.concurrency)
+        results[str(worker_count)] = {**load, **coherence}
+    return {"players": len(season.player_ids), "games": len(season.games), "stats": season.stats,
+            "cpu_count": os.cpu_count(), "concurrency": options.concurrency, "workers": results}
+
+
+SCENARIOS = {
+    "endpoints": endpoints,
+    "game_stats_scaling": game_stats_scaling,
+    "player_stats_scaling": player_stats_scaling,
+    "leaderboard": leaderboard,
+    "mixed_read_write": mixed_read_write,
+    "write_burst": write_burst,
+    "storage_layouts": storage_layouts,
+    "analytics": analytics_breakdowns,
+    "subscribers": subscribers,
+    "serializer": serializer,
+    "export": export,
+    "bulk_import": bulk_import,
+    "rallies": rallies,
+    "cube": cube,
+    "jobs": jobs,
+    "workers": workers,
+}
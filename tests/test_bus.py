@@ -0,0 +1,69 @@
+"""Messages larger than asyncio's 64 KiB line limit still cross the bus.
+
+Each test runs a Hub on a temporary socket with two WorkerBus connections,
+all on the test's own event loop.
+"""
+import asyncio
+import json
+
+from app.bus import MAX_MESSAGE_BYTES, Hub, WorkerBus
+
+TOPIC = "game:1"
+
+
+async def wait_until(condition, timeout=5.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def relay(path, build_message):
+    """Publish build_message() from one worker to another subscribed to TOPIC"""
+    ready = asyncio.Event()
+    hub = Hub()
+    hub_task = asyncio.create_task(hub.serve(path, ready))
+    await ready.wait()
+    sender, receiver = WorkerBus(path), WorkerBus(path)
+    received, sender_connections = [], []
+    receiver.on("game_event", received.append)
+    sender.on_connection(sender_connections.append)
+    try:
+        await sender.start()
+        await receiver.start()
+        receiver.subscribe(TOPIC)
+        await wait_until(lambda: sender.peers_subscribed(TOPIC))
+        message = build_message()
+        sender.publish(message)
+        sender.publish({"type": "game_event", "topic": TOPIC, "game_id": 1, "payload": "after"})
+        await wait_until(lambda: received and received[-1]["payload"] == "after")
+        return message, list(received), list(sender_connections), hub.peer_count
+    finally:
+        await sender.stop()
+        await receiver.stop()
+        hub_task.cancel()
+        await asyncio.gather(hub_task, return_exceptions=True)
+
+
+def game_event(payload_bytes):
+    return {"type": "game_event", "topic": TOPIC, "game_id": 1, "payload": "x" * payload_bytes}
+
+
+def test_oversized_game_event_is_relayed(tmp_path):
+    message, received, sender_connections, peer_count = asyncio.run(
+        relay(str(tmp_path / "bus.sock"), lambda: game_event(1024 * 1024))
+    )
+    assert [event["payload"] for event in received] == [message["payload"], "after"]
+    # Neither end dropped its connection over the size
+    assert sender_connections == [True]
+    assert peer_count == 2
+
+
+def test_message_over_the_limit_is_not_published(tmp_path):
+    message, received, sender_connections, peer_count = asyncio.run(
+        relay(str(tmp_path / "bus.sock"), lambda: game_event(MAX_MESSAGE_BYTES))
+    )
+    assert len(json.dumps(message)) > MAX_MESSAGE_BYTES
+    assert [event["payload"] for event in received] == ["after"]
+    assert sender_connections == [True]
+    assert peer_count == 2
@@ -0,0 +1,45 @@
+"""Stat cube answers on a database without matching stats.
+
+Each test builds the schema the way startup does, in a fresh SQLite file,
+and queries it through its own async engine.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.cube import SOURCES, stat_cube
+from app.models.migrations import upgrade_schema
+from app.models.models import ActionType
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    path = tmp_path / "cube.db"
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+    engine.dispose()
+    return path
+
+
+def cube_cells(database_path, **query):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        try:
+            async with AsyncSession(engine) as db:
+                return await stat_cube(db, ActionType.ATTACK, **query)
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())["cells"]
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_no_dimensions_and_no_stats_gives_no_cells(database_path, source):
+    assert cube_cells(database_path, source=source) == []
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_player_dimension_and_no_stats_gives_no_cells(database_path, source):
+    assert cube_cells(database_path, by=["player_id"], source=source) == []
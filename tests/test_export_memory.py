@@ -0,0 +1,106 @@
+"""Streaming a 2M-row export keeps memory flat.
+
+The export runs in a child process against its own database, since the app
+reads BVB_DATABASE_PATH when it is first imported. The child fills the stat
+tables with SQL, exports one game to warm everything up, then streams the
+whole table as CSV and as NDJSON through the ASGI app while sampling its
+own resident memory.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXPORT_ROWS = 2_000_000
+STATS_PER_GAME = 500
+
+# Allowed growth of anonymous RSS over the one-game export while streaming everything
+MAX_RSS_GROWTH_MB = 32
+
+FILL_SQL = [
+    "INSERT INTO players (id, name) VALUES (1, 'A1'), (2, 'A2'), (3, 'B1'), (4, 'B2')",
+    """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :games)
+    INSERT INTO games (id, date, team1, team2)
+    SELECT i, date('2020-01-01', '+' || (i / 4) || ' days'), '[1, 2]', '[3, 4]' FROM n
+    """,
+    """
+    INSERT INTO game_participants (game_id, player_id, team, position)
+    SELECT games.id, p.player_id, p.team, p.position FROM games
+    CROSS JOIN (SELECT 1 AS player_id, 1 AS team, 1 AS position UNION ALL SELECT 2, 1, 2
+                UNION ALL SELECT 3, 2, 1 UNION ALL SELECT 4, 2, 2) AS p
+    """,
+    """
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :rows - 1)
+    INSERT INTO base_stats (id, game_id, player_id, action_type, timestamp, set_number, rally_number)
+    SELECT i + 1, i / :per_game + 1, i % 4 + 1, CASE i % 2 WHEN 0 THEN 'ATTACK' ELSE 'DIG' END,
+           1577872800000 + i * 1000, 1, (i % :per_game) / 4 + 1
+    FROM n
+    """,
+    """
+    INSERT INTO attack_stats (stat_id, is_kill, is_error, is_blocked, attack_type, attack_direction)
+    SELECT id, id % 3 = 0, id % 7 = 0, 0, 'HARD', 'LINE' FROM base_stats WHERE action_type = 'ATTACK'
+    """,
+]
+
+
+def test_full_export_streams_in_bounded_memory(tmp_path):
+    env = dict(os.environ, BVB_DATABASE_PATH=str(tmp_path / "export.db"), BVB_RESPONSE_CACHE="0")
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__)], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    result = json.loads(completed.stdout.splitlines()[-1])
+    for file_format, export in result.items():
+        assert export["status"] == 200, (file_format, export)
+        assert export["rows"] == EXPORT_ROWS, (file_format, export)
+        assert export["rss_growth_mb"] <= MAX_RSS_GROWTH_MB, (file_format, export)
+
+
+async def export_in_child():
+    from sqlalchemy import text
+
+    from app.main import app
+    from app.models.database import engine
+    from app.models.migrations import upgrade_schema
+    from benchmarks.harness import RssSampler, rss_bytes, running
+
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+        params = {"games": EXPORT_ROWS // STATS_PER_GAME, "rows": EXPORT_ROWS, "per_game": STATS_PER_GAME}
+        for statement in FILL_SQL:
+            conn.execute(text(statement), params)
+    engine.dispose()
+
+    results = {}
+    async with running(app) as client:
+        for file_format in ("csv", "ndjson"):
+            lines = [0]
+
+            def on_chunk(chunk):
+                lines[0] += chunk.count(b"\n")
+
+            # First use of the export path and the connection pool is not what is measured
+            await client.get(f"/api/export/stats?format={file_format}&game_id=1", on_chunk=on_chunk)
+            lines[0] = 0
+            baseline = rss_bytes()
+            sampler = RssSampler()
+            sampler.start()
+            response = await client.get(f"/api/export/stats?format={file_format}", on_chunk=on_chunk)
+            memory = await sampler.stop()
+            results[file_format] = {
+                "status": response.status,
+                "rows": lines[0] - (1 if file_format == "csv" else 0),
+                "rss_growth_mb": round(memory["rss_peak_mb"] - baseline / 2**20, 1),
+                **memory,
+            }
+    return results
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    sys.path.insert(0, ROOT)
+    print(json.dumps(asyncio.run(export_in_child())))
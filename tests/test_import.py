@@ -0,0 +1,90 @@
+"""A bulk import leaves the derived tables as a full rebuild would.
+
+The importer only keeps the aggregates current batch by batch and catches
+up the rollups, rallies and change log of its games once at the end. The
+check runs in a child process against its own database, since the app reads
+BVB_DATABASE_PATH when it is first imported. It imports two generated files
+whose games share dates, in batches smaller than a game, then compares every
+derived table with what the full rebuilds compute.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GAMES_PER_FILE = 6
+TOUCHES_PER_GAME = 300
+BATCH_SIZE = 250
+
+
+def test_import_matches_full_rebuilds(tmp_path):
+    env = dict(os.environ, BVB_DATABASE_PATH=str(tmp_path / "import.db"), BVB_RESPONSE_CACHE="0")
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), str(tmp_path)], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    result = json.loads(completed.stdout.splitlines()[-1])
+    assert result["stats"] == 2 * GAMES_PER_FILE * TOUCHES_PER_GAME
+    assert result["logged_inserts"] == result["stats"]
+    assert result["aggregate_mismatches"] == 0
+    for table, (rows, matches) in result["tables"].items():
+        assert rows > 0, table
+        assert matches, table
+
+
+async def import_in_child(directory):
+    from sqlalchemy import func, select
+
+    from app.models.database import engine
+    from app.models.migrations import upgrade_schema
+    from app.models.models import Rally, RallyPossession, StatChange, StatDayRollup, StatRollup
+    from app.models.stat_store import rebuild_aggregates, rebuild_rallies, rebuild_rollups, stat_table
+    from app.stat_import import import_stat_file
+    from benchmarks.generator import MatchGenerator, season_games, write_import_file
+
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+    names = MatchGenerator(0).player_names(8)
+    for seed in (1, 2):
+        path = os.path.join(directory, f"season-{seed}.csv")
+        write_import_file(path, season_games(MatchGenerator(seed), names, GAMES_PER_FILE, TOUCHES_PER_GAME))
+        summary = await import_stat_file(path, "csv", batch_size=BATCH_SIZE)
+        assert summary["status"] == "done", summary
+
+    def rows(conn):
+        return {
+            model.__tablename__: sorted(
+                (tuple(row) for row in conn.execute(select(*(c for c in model.__table__.columns if c.name != "id")))),
+                key=repr,
+            )
+            for model in (StatRollup, StatDayRollup, Rally, RallyPossession)
+        }
+
+    with engine.connect() as conn:
+        imported = rows(conn)
+        stats = conn.execute(select(func.count()).select_from(stat_table)).scalar()
+        logged = conn.execute(
+            select(func.count(func.distinct(StatChange.stat_id))).where(StatChange.op == "insert")
+        ).scalar()
+        conn.rollback()
+        with conn.begin() as transaction:
+            rebuild_rollups(conn)
+            rebuild_rallies(conn)
+            mismatches = rebuild_aggregates(conn)
+            rebuilt = rows(conn)
+            transaction.rollback()
+    return {
+        "stats": stats,
+        "logged_inserts": logged,
+        "aggregate_mismatches": len(mismatches),
+        "tables": {table: (len(imported[table]), imported[table] == rebuilt[table]) for table in imported},
+    }
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    sys.path.insert(0, ROOT)
+    print(json.dumps(asyncio.run(import_in_child(sys.argv[1]))))
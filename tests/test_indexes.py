@@ -0,0 +1,66 @@
+"""The base_stats composite indexes serve the game-stats and player-stats lookups.
+
+Each test builds the schema the way startup does, in a fresh SQLite file,
+and reads the planner's choice back from EXPLAIN QUERY PLAN.
+"""
+import pytest
+from sqlalchemy import create_engine, func, select
+
+from app.models.migrations import upgrade_schema
+from app.models.models import ActionType, BaseStat
+
+stats = BaseStat.__table__
+
+
+@pytest.fixture
+def conn(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plan.db'}")
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+        yield conn
+    engine.dispose()
+
+
+def query_plan(conn, query):
+    sql = str(query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def base_stats_step(plan):
+    steps = [step for step in plan if " base_stats " in f"{step} "]
+    assert len(steps) == 1, plan
+    return steps[0]
+
+
+def test_game_stats_page_searches_game_timestamp_index(conn):
+    query = (
+        select(stats)
+        .where(stats.c.game_id == 1)
+        .order_by(stats.c.timestamp.desc(), stats.c.id.desc())
+        .limit(501)
+    )
+    step = base_stats_step(query_plan(conn, query))
+    assert step.startswith("SEARCH base_stats USING INDEX ix_base_stats_game_timestamp (game_id=?)")
+
+
+def test_game_stats_by_player_and_action_search_an_index(conn):
+    query = select(stats).where(
+        stats.c.game_id == 1, stats.c.player_id == 2, stats.c.action_type == ActionType.ATTACK
+    )
+    step = base_stats_step(query_plan(conn, query))
+    assert step.startswith("SEARCH base_stats USING INDEX ix_base_stats_game_")
+
+
+def test_player_stats_searches_player_action_index(conn):
+    query = select(func.count()).select_from(stats).where(
+        stats.c.player_id == 2, stats.c.action_type == ActionType.SERVING
+    )
+    step = base_stats_step(query_plan(conn, query))
+    assert "USING COVERING INDEX ix_base_stats_player_action (player_id=? AND action_type=?)" in step
+    assert not step.startswith("SCAN")
+
+
+def test_player_stats_without_action_searches_player_action_index(conn):
+    query = select(stats.c.id).where(stats.c.player_id == 2)
+    step = base_stats_step(query_plan(conn, query))
+    assert "INDEX ix_base_stats_player_action (player_id=?)" in step
@@ -0,0 +1,59 @@
+"""SQL statement metrics gathered through cursor events.
+
+Each test attaches the metrics listeners to its own async engine on a fresh
+SQLite file, the way metrics.py attaches them to the app's engine.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.metrics import (RequestMetrics, _after_cursor_execute, _before_cursor_execute, _handle_error,
+                         current_request)
+
+
+async def with_metrics(database_path, work):
+    """(RequestMetrics, work's result) for work(conn) run as one request on a listened-to engine"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+    request = RequestMetrics()
+    token = current_request.set(request)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY)"))
+            await conn.execute(text("INSERT INTO items (id) VALUES (1), (2), (3)"))
+            return request, await work(conn)
+    finally:
+        current_request.reset(token)
+        await engine.dispose()
+
+
+def test_rows_returned_by_a_query_are_counted(tmp_path):
+    async def work(conn):
+        return (await conn.execute(text("SELECT id FROM items"))).all()
+
+    request, rows = asyncio.run(with_metrics(tmp_path / "metrics.db", work))
+    assert len(rows) == 3
+    # 3 inserted plus 3 read back; aiosqlite's private row buffer still backs this count
+    assert request.rows == 6
+    assert request.statements == 3
+
+
+def test_failed_statement_leaves_no_start_time_behind(tmp_path):
+    async def work(conn):
+        for _ in range(3):
+            with pytest.raises(IntegrityError):
+                await conn.execute(text("INSERT INTO items (id) VALUES (1)"))
+        info = conn.sync_connection.info
+        left = info.get("query_started")
+        await conn.execute(text("SELECT id FROM items"))
+        return left, info.get("query_started")
+
+    request, (after_errors, after_query) = asyncio.run(with_metrics(tmp_path / "metrics.db", work))
+    assert after_errors is None
+    assert after_query is None
+    assert request.statements == 3
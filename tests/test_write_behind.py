@@ -0,0 +1,50 @@
+"""Group commits of the write-behind buffer, with the database writes stubbed out.
+
+Each test drives StatWriteBuffer._commit_next by hand against a fake
+_commit that records what it was asked to insert.
+"""
+import asyncio
+import os
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.write_behind import StatWriteBuffer
+
+
+def buffer_with(tmp_path, seqs, failures):
+    """A buffer holding one record per seq, whose _commit raises the queued failures in order"""
+    buffer = StatWriteBuffer(str(tmp_path / "stats.log"), interval_ms=5, max_batch=10)
+    buffer._fd = os.open(buffer.log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    buffer._pending = [{"seq": seq, "game_id": 1, "request": {}} for seq in seqs]
+    buffer.committed = []
+
+    async def commit(records):
+        failure = failures.pop(0) if failures else None
+        if failure is not None:
+            raise failure
+        buffer.committed.extend(record["seq"] for record in records)
+
+    buffer._commit = commit
+    return buffer
+
+
+def test_busy_database_during_one_by_one_retry_commits_each_stat_once(tmp_path):
+    failures = [
+        IntegrityError("INSERT", {}, Exception("constraint failed")),  # the group
+        None,  # seq 1 alone
+        OperationalError("INSERT", {}, Exception("database is locked")),  # seq 2 alone
+    ]
+    buffer = buffer_with(tmp_path, [1, 2, 3], failures)
+
+    async def ticks():
+        try:
+            await buffer._commit_next()
+        except OperationalError:
+            pass
+        assert [record["seq"] for record in buffer._pending] == [2, 3]
+        await buffer._commit_next()
+
+    asyncio.run(ticks())
+    os.close(buffer._fd)
+    assert buffer.committed == [1, 2, 3]
+    assert buffer.pending_count == 0